@@ -14,7 +14,9 @@
 from app.config.settings import Config
 import logging
 from logging import config
+from app.config.logs import configure_logging
 logging.config.fileConfig(Config.LOGGING_CNF)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -29,7 +31,10 @@ from flask import Flask
 from app import commands
 from app.config.settings import Config, ConfigProdFlask, ConfigDevFlask
 from app.extensions import cors
-from app.routes import alive, files
+from app.routes import alive, files, metrics, uploads
+from app.utils import metrics as request_metrics
+from app.utils import limits as request_limits
+from app.utils.general import replay_journal
 from app.responses import MyException
 
 
@@ -48,7 +53,10 @@ def create_app():
     app = Flask(__name__)
     # Configure app
     logger.info("Execution mode: '{}'".format(FILE_MANAGER_EXECUTION_MODE))
-    logger.info("Authentication: {}".format(True if Config.FILE_MANAGER_API_KEY is not None else False))
+    logger.info("Authentication: {}".format(
+        True if Config.FILE_MANAGER_API_KEY is not None or Config.FILE_MANAGER_API_KEYS else False))
+    logger.info("API keys: {} (limits kept in '{}')".format(
+        len(request_limits.clients()), Config.FILE_MANAGER_RATE_LIMIT_BACKEND))
     logger.info("Lock Incoming: {}".format(Config.FILE_MANAGER_AUTH_INCOMING))
     logger.info("Lock Outgoing: {}".format(Config.FILE_MANAGER_AUTH_OUTGOING))
     app.config.from_object(config)
@@ -56,13 +64,25 @@ def create_app():
     register_extensions(app)
     # Blueprints
     register_blueprints(app)
+    # Metrics
+    register_metrics(app)
+    # Limits
+    register_limits(app)
     # Error Handlers
     register_errorhandlers(app)
     # Commands
     register_commands(app)
+    # Journal
+    recover_files()
     return app
 
 
+def recover_files():
+    """Complete the changes to the stored files interrupted by a crash"""
+    logger.info('Replay the files journal')
+    replay_journal()
+
+
 def register_extensions(app):
     """Register Flask extensions."""
     pass
@@ -75,9 +95,30 @@ def register_blueprints(app):
     origins = app.config.get('CORS_ORIGIN_WHITELIST', '*')
     cors.init_app(alive.blueprint, origins=origins)
     cors.init_app(files.blueprint, origins=origins)
+    cors.init_app(uploads.blueprint, origins=origins)
     # Registration
     app.register_blueprint(alive.blueprint)
     app.register_blueprint(files.blueprint)
+    app.register_blueprint(uploads.blueprint)
+    if Config.FILE_MANAGER_METRICS:
+        cors.init_app(metrics.blueprint, origins=origins)
+        app.register_blueprint(metrics.blueprint)
+
+
+def register_metrics(app):
+    """Register the request hooks of the metrics"""
+    if not Config.FILE_MANAGER_METRICS:
+        return
+    logger.info('Register metrics')
+    app.before_request(request_metrics.start_request)
+    app.after_request(request_metrics.finish_request)
+    app.teardown_request(request_metrics.teardown_request)
+
+
+def register_limits(app):
+    """Register the request hooks of the limits of the clients"""
+    logger.info('Register limits')
+    app.after_request(request_limits.finish_request)
 
 
 def register_errorhandlers(app):
@@ -95,3 +136,11 @@ def register_commands(app):
     logger.info('Register Flask Commands')
     app.cli.add_command(commands.clean)
     app.cli.add_command(commands.urls)
+    app.cli.add_command(commands.dedup)
+    app.cli.add_command(commands.reindex)
+    app.cli.add_command(commands.expire_uploads)
+    app.cli.add_command(commands.bench)
+    app.cli.add_command(commands.scrub)
+    app.cli.add_command(commands.compact)
+    app.cli.add_command(commands.expire_files)
+    app.cli.add_command(commands.tier)
@@ -0,0 +1,420 @@
+# asgi.py ------------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the ASGI variant of the app. The file routes (store, get, download and
+#    delete a file) are served as coroutines, so a slow client holds a coroutine and a small buffer
+#    instead of a thread, while the disk I/O runs in a thread pool. All the other routes are served
+#    by the flask app (through an ASGI-to-WSGI adapter).
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import json
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+# Installed
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_range_header
+from werkzeug.routing import Map, Rule
+from werkzeug.urls import url_decode
+from werkzeug.wrappers import Response
+# Custom
+from app.app import create_app
+from app.config.settings import Config
+from app.responses import MyResponse, MyException
+from app.utils import index, metrics
+from app.utils.decorators import authenticated
+from app.utils.limits import admit, charge_download
+from app.utils.general import open_file, read_file_content, store_files, remove_file, batch_failed
+from app.utils.general import file_expiry, file_quarantined
+from app.utils.multipart import create_receiver
+from app.utils.signing import SIGNATURE_ARG, verify
+from app.utils.serving import describe_file, file_headers, file_representation, open_blob
+from app.utils.storage import storage
+from app.utils.tiering import count_read
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# The routes served as coroutines (the endpoints are named as the flask ones, for the metrics)
+ROUTES = Map([
+    Rule('/storage/v1/file', methods=['POST'], endpoint='create_file'),
+    Rule('/storage/v1/file/<filename>', methods=['GET'], endpoint='read_file'),
+    Rule('/storage/v1/file/<filename>', methods=['DELETE'], endpoint='delete_file'),
+    Rule('/storage/v1/file/download/<filename>', methods=['GET'], endpoint='download_file'),
+])
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class AsyncRequest():
+    """The request of an ASGI connection (method, headers, query arguments and body)"""
+
+    def __init__(self, scope, receive, endpoint=None):
+        self.scope = scope
+        self.endpoint = endpoint
+        self.receive = receive
+        self.method = scope['method']
+        self.headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+        self.args = url_decode(scope.get('query_string', b''))
+        self.received = 0
+        self.started = False
+        # NOTE: The client of the API key (see 'app/utils/limits.py'), set when authenticated
+        self.client = None
+
+    @property
+    def environ(self):
+        """The WSGI environ of the request (only its method and headers)"""
+        environ = {'REQUEST_METHOD': self.method}
+        for key, value in self.headers.items():
+            environ['HTTP_' + key.upper().replace('-', '_')] = value
+        return environ
+
+    async def body(self):
+        """This function yields the chunks of the request body as they are received"""
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionError('Client disconnected')
+            chunk = message.get('body', b'')
+            self.received += len(chunk)
+            if chunk:
+                yield chunk
+            if not message.get('more_body', False):
+                return
+
+
+class AsyncFileApp():
+    """ASGI app that serves the file routes as coroutines and the rest of them with the flask app"""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        self.executor = ThreadPoolExecutor(
+            max_workers=Config.FILE_MANAGER_ASGI_IO_THREADS, thread_name_prefix='asgi-io')
+        origins = app.config.get('CORS_ORIGIN_WHITELIST', '*')
+        self.origins = [origins] if isinstance(origins, str) else list(origins)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            try:
+                endpoint, arguments = ROUTES.bind('localhost').match(scope['path'], method=scope['method'])
+            except HTTPException:
+                # NOTE: Unknown routes and methods (e.g. CORS preflights) are answered by flask
+                endpoint, arguments = None, None
+            if endpoint is not None:
+                return await self.handle(endpoint, arguments, scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        """This function answers the startup and shutdown of the server"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def authorize(self, request, filename=None):
+        """This function authenticates a request and checks the limits of its client (before the body is received)"""
+        if SIGNATURE_ARG in request.args:
+            request.client = verify(request.args, request.endpoint, request.method, filename)
+        else:
+            request.client = authenticated(request.method, request.headers)
+        content_length = request.headers.get('Content-Length', type=int)
+        await self.run(admit, request.client, request.method, content_length)
+
+    async def run(self, function, *args, **kwargs):
+        """This function runs a blocking function (disk I/O, index) in the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def handle(self, endpoint, arguments, scope, receive, send):
+        """This function serves a file route and records its metrics"""
+        request = AsyncRequest(scope, receive, endpoint)
+        started = time.perf_counter()
+        metrics.inc('file_manager_http_requests_in_flight')
+        status, sent = 500, 0
+        try:
+            status, sent = await getattr(self, endpoint)(request, send, **arguments)
+        except MyException as e:
+            status, sent = await self.send_response(request, send, e)
+        except HTTPException as e:
+            # NOTE: E.g. an unsatisfiable range (416)
+            response = e.get_response()
+            body = response.get_data()
+            status, sent = await self.send_body(request, send, response, self.content_chunks(body, 0, len(body)))
+        except ConnectionError:
+            logger.warning("Client disconnected during '{}'".format(endpoint))
+        except Exception as e:
+            logger.exception(e)
+            if not request.started:
+                status, sent = await self.send_response(request, send, MyException.error('Internal Server Error', 500))
+        finally:
+            metrics.inc('file_manager_http_requests_in_flight', value=-1)
+        if request.method == 'GET' and sent:
+            await self.run(charge_download, request.client, sent)
+        label = 'files.{}'.format(endpoint)
+        metrics.inc('file_manager_http_requests_total', (label, status))
+        metrics.observe('file_manager_http_request_duration_seconds', (label, status), time.perf_counter() - started)
+        if request.received:
+            metrics.inc('file_manager_http_received_bytes_total', (label,), request.received)
+        if sent:
+            metrics.inc('file_manager_http_sent_bytes_total', (label,), sent)
+
+    def cors_headers(self, request):
+        """This function returns the CORS headers of a response (as the flask app adds them)"""
+        origin = request.headers.get('Origin')
+        if origin is None:
+            return []
+        if '*' in self.origins:
+            return [(b'access-control-allow-origin', b'*')]
+        if origin in self.origins:
+            return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+        return []
+
+    async def start(self, request, send, response):
+        """This function sends the status and the headers of a response"""
+        # NOTE: The server adds its own 'Date' header
+        headers = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                   for k, v in response.headers.items() if k.lower() != 'date']
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers + self.cors_headers(request),
+        })
+        request.started = True
+
+    async def send_response(self, request, send, result):
+        """This function sends a JSON response (a 'MyResponse' or a 'MyException')"""
+        result.log()
+        # NOTE: Formatted as flask's 'jsonify' does
+        body = (json.dumps(result.response, separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+        response = Response(body, status=result.code, mimetype='application/json', headers=result.header)
+        await self.start(request, send, response)
+        await send({'type': 'http.response.body', 'body': body})
+        return result.code, len(body)
+
+    async def send_body(self, request, send, response, chunks):
+        """This function sends a response and its body (asynchronous iterator of bytes)
+
+        Each chunk is sent only after the previous one was handed to the client's socket, so a slow
+        client holds no more than a chunk.
+        """
+        await self.start(request, send, response)
+        sent = 0
+        if chunks is not None:
+            try:
+                async for chunk in chunks:
+                    sent += len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                # NOTE: Closes the file even when the client disconnected
+                await chunks.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+        return response.status_code, sent
+
+    #
+    # Bodies
+    #
+    async def file_chunks(self, file, start, stop):
+        """This function yields the bytes [start, stop) of an open file, read in the thread pool"""
+        try:
+            offset = start
+            while offset < stop:
+                chunk = await self.run(
+                    os.pread, file.fileno(), min(Config.FILE_MANAGER_ASGI_BLOCK_SIZE, stop - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            file.close()
+
+    async def driver_chunks(self, key, start, stop):
+        """This function yields the bytes [start, stop) of a blob, streamed by the storage driver"""
+        iterator = storage().stream(key, start, stop)
+        try:
+            while True:
+                chunk = await self.run(next, iterator, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await self.run(iterator.close)
+
+    async def decoded_chunks(self, record, start, stop):
+        """This function yields the bytes [start, stop) of the content of a compressed file
+
+        The content is decompressed in the thread pool, from its start (the bytes before 'start'
+        are skipped).
+        """
+        file = await self.run(open_file, record)
+        try:
+            offset = 0
+            while offset < stop:
+                chunk = await self.run(file.read, min(Config.FILE_MANAGER_ASGI_BLOCK_SIZE, stop - offset))
+                if not chunk:
+                    break
+                if offset + len(chunk) > start:
+                    yield chunk[max(start - offset, 0):]
+                offset += len(chunk)
+        finally:
+            await self.run(file.close)
+
+    @staticmethod
+    async def content_chunks(content, start, stop):
+        """This function yields the bytes [start, stop) of a (cached) content"""
+        for offset in range(start, stop, Config.FILE_MANAGER_ASGI_BLOCK_SIZE):
+            yield content[offset:min(offset + Config.FILE_MANAGER_ASGI_BLOCK_SIZE, stop)]
+
+    #
+    # Uploads
+    #
+    async def receive_files(self, request):
+        """This function parses the files of a multipart body while it is received
+
+        Each file is written to the files directory as it arrives (see 'app/utils/multipart.py'),
+        in the thread pool.
+        """
+        content_length = request.headers.get('Content-Length', type=int)
+        receiver = create_receiver(request.headers.get('Content-Type'), content_length)
+        if receiver is None:
+            return []
+        try:
+            finished = False
+            async for chunk in request.body():
+                finished = await self.run(receiver.receive, chunk)
+                if finished:
+                    break
+            if not finished:
+                await self.run(receiver.close)
+        except BaseException:
+            await self.run(receiver.abort)
+            raise
+        return receiver.files
+
+    #
+    # Routes
+    #
+    async def create_file(self, request, send):
+        """This function stores the uploaded files to the filesystem"""
+        logger.info('Request to store file(s)')
+        # NOTE: Authenticated before the arguments are validated and the body is received
+        await self.authorize(request)
+        unique_id = request.args.get('unique_id', type=lambda v: v.lower() == 'true')
+        expires = file_expiry(request.args.get('ttl'), request.args.get('expires_at'))
+        files = [f for f in await self.receive_files(request) if f.filename != '']
+        try:
+            if len(files) == 0:
+                raise MyException.error('No files are given', 500)
+            try:
+                filename = await self.run(store_files, files, unique_id, client=request.client, expires=expires)
+            except MyException:
+                raise
+            except Exception as e:
+                logger.exception(e)
+                raise MyException.error('Failed to store the file!', 500)
+        finally:
+            for file in files:
+                file.close()
+        # NOTE: A batch where some files failed returns 207 (Multi-Status)
+        return await self.send_response(
+            request, send, MyResponse.only_data(filename, 207 if batch_failed(filename) else 200))
+
+    async def read_file(self, request, send, filename):
+        """This function returns a file from the filesystem"""
+        logger.info("Request to get file: '%s'", filename)
+        return await self.get_file(request, send, filename, Config.FILE_MANAGER_CACHE_CONTROL_READ)
+
+    async def download_file(self, request, send, filename):
+        """This function returns a file from the filesystem as an attachment"""
+        logger.info("Request to download file: '%s'", filename)
+        return await self.get_file(
+            request, send, filename, Config.FILE_MANAGER_CACHE_CONTROL_DOWNLOAD, as_attachment=True)
+
+    async def delete_file(self, request, send, filename):
+        """This function deletes a file from the filesystem"""
+        logger.info("Request to delete file: '{}'".format(filename))
+        await self.authorize(request)
+        if await self.run(remove_file, filename):
+            return await self.send_response(request, send, MyResponse.success("File '{}' deleted".format(filename), 200))
+        raise MyException.warning("File '{}' not found".format(filename), 404)
+
+    async def get_file(self, request, send, filename, policy, as_attachment=False):
+        """This function returns a stored file, honoring the conditional and range request headers
+
+        As the flask route ('serve_file') does, except multiple ranges, which return the whole file.
+        """
+        await self.authorize(request, filename)
+        record = await self.run(index.lookup_live, filename)
+        if record is None:
+            raise MyException.warning("File '{}' not found".format(filename), 404)
+        if record['quarantined'] is not None:
+            raise file_quarantined(filename)
+        logger.info("File '%s' retrieved", filename)
+        await self.run(index.touch, record)
+        await self.run(count_read, record)
+        path, key, size, etag = file_representation(
+            record, parse_accept_header(request.headers.get('Accept-Encoding')))
+        response = Response(mimetype=record['type'])
+        response.content_length = size
+        describe_file(response, record, etag, as_attachment)
+        file_headers(response, record, policy, path)
+        # NOTE: Multiple ranges are not served by 'make_conditional', so the whole file is sent
+        ranges = parse_range_header(request.headers.get('Range'))
+        single_range = ranges is None or len(ranges.ranges) <= 1
+        response.make_conditional(request.environ, accept_ranges=True, complete_length=size if single_range else None)
+        if request.method == 'HEAD' or response.status_code not in (200, 206):
+            return await self.send_body(request, send, response, None)
+        start, stop = (response.content_range.start, response.content_range.stop) \
+            if response.status_code == 206 else (0, size)
+        if path == 'decoded':
+            chunks = self.decoded_chunks(record, start, stop)
+        elif path == 'cache':
+            chunks = self.content_chunks(await self.run(read_file_content, record), start, stop)
+        else:
+            file = await self.run(open_blob, storage(), key)
+            if file is None:
+                # NOTE: Blobs that are not on a local filesystem (e.g. 's3' driver)
+                chunks, path = self.driver_chunks(key, start, stop), 'stream'
+            else:
+                chunks, path = self.file_chunks(file, start, stop), 'async'
+        metrics.inc('file_manager_download_path_total', (path,))
+        metrics.inc('file_manager_download_path_bytes_total', (path,), stop - start)
+        return await self.send_body(request, send, response, chunks)
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def create_asgi_app():
+    """This function creates the ASGI app (e.g. 'uvicorn --factory app.asgi:create_asgi_app')"""
+    return AsyncFileApp(create_app())
@@ -15,6 +15,14 @@
 # |----------------------|---------|---------------------------------------------------------------
 # | --- (command 01) --- | clean   | Removes all python's binary files from the project
 # | --- (command 02) --- | urls    | Prints all the Flask Routes
+# | --- (command 03) --- | dedup   | Moves the files that are not linked to a blob into the blob store
+# | --- (command 04) --- | reindex | Rebuilds the metadata index from the files found on disk
+# | --- (command 05) --- | expire-uploads | Deletes the expired resumable uploads
+# | --- (command 06) --- | bench   | Benchmarks the uploads and downloads of the storage API
+# | --- (command 07) --- | scrub   | Verifies the hashes of the stored blobs, quarantines the corrupted
+# | --- (command 08) --- | compact | Reclaims the space of the deleted blobs of the packed store
+# | --- (command 09) --- | expire-files | Deletes the files that expired
+# | --- (command 10) --- | tier    | Moves the cold blobs to the cold tier and the hot ones back
 
 
 # ==================================================================================================
@@ -22,6 +30,7 @@
 # ==================================================================================================
 # Build-in
 import os
+import json
 # Installed
 import click
 from flask import current_app
@@ -29,6 +38,14 @@ from flask.cli import with_appcontext
 from werkzeug.exceptions import MethodNotAllowed, NotFound
 # Custom
 from app.config.settings import Config
+from app.utils.general import blob_key, blobpath, file_hash, link_file, scan_files
+from app.utils.storage import PackedDriver, TieredDriver, storage
+from app.utils import index
+from app.utils.uploads import collect_expired_uploads
+from app.utils import bench as benchmark
+from app.utils.scrub import scrub_blobs
+from app.utils.expiry import expire_files as reap_expired_files
+from app.utils.tiering import move_blobs
 
 
 # ==================================================================================================
@@ -111,3 +128,134 @@ def urls(url, order):
         stringify = [str(x) for x in row]
         click.echo(str_template.format(*stringify[:no_of_colums]))
     click.echo('')
+
+
+# --- (command 03) ---
+@click.command()
+def dedup():
+    """Move the files that are not linked to a blob into the content-addressed store"""
+    if not storage().named:
+        raise click.ClickException("'dedup' requires the 'local' storage driver")
+    # Find all files inside the files directory
+    for entry in os.scandir(Config.FILES_DIR):
+        # Skip the hidden entries (blob store, temporary files, etc.) and the files already linked
+        if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+            continue
+        if entry.stat().st_nlink > 1:
+            continue
+        with open(entry.path, 'rb') as file:
+            digest = file_hash(file)
+        blob = blobpath(digest)
+        if os.path.exists(blob):
+            # Replace the duplicate copy with a link to the existing blob
+            link_file(blob_key(digest), entry.name)
+            click.echo('Deduplicated {}'.format(entry.name))
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(entry.path, blob)
+            click.echo('Linked {}'.format(entry.name))
+
+
+# --- (command 04) ---
+@click.command()
+def reindex():
+    """Rebuild the metadata index from the files found on disk"""
+    # NOTE: The other drivers keep no filenames, so the index is their only record of them
+    if not storage().named:
+        raise click.ClickException("'reindex' requires the 'local' storage driver")
+    click.echo('Rebuilding index {}'.format(index.index_path()))
+    removed = index.rebuild(scan_files())
+    click.echo('Indexed {} files ({} removed)'.format(index.files_count(), removed))
+
+
+# --- (command 05) ---
+@click.command()
+def expire_uploads():
+    """Delete the resumable uploads that expired (and their data files)"""
+    click.echo('Deleted {} expired uploads'.format(collect_expired_uploads(force=True)))
+
+
+# --- (command 06) ---
+@click.command()
+@click.option('-s', '--sizes', default='1KB,64KB,1MB,16MB', show_default=True,
+              help="File sizes, each one fixed (e.g. '1MB') or a log-uniform range (e.g. '1KB-1GB')")
+@click.option('-c', '--concurrency', default='1,8,32', show_default=True, help='Concurrent clients')
+@click.option('-b', '--batch', default='1,10', show_default=True, help="Files per upload ('files[]')")
+@click.option('-n', '--requests', default=20, show_default=True, help='Uploads per case (and downloads of their files)')
+@click.option('-o', '--output', default='bench-results.json', show_default=True, help='Results file (JSON)')
+@click.option('--baseline', default=None, type=click.Path(exists=True), help='Results of a previous run to compare with')
+@click.option('--seed', default=0, show_default=True, help='Seed of the random sizes and contents')
+@click.option('--server', default=None, type=click.Choice(benchmark.SERVERS),
+              help='Server the app is served on [default: FILE_MANAGER_SERVER]')
+@click.option('--url', default=None, help='URL of a running instance to benchmark instead (e.g. http://host:8000)')
+def bench(sizes, concurrency, batch, requests, output, baseline, seed, server, url):
+    """Benchmark the uploads and downloads of the storage API against a temporary files directory (or a running instance)"""
+    try:
+        distributions = [size.strip() for size in sizes.split(',')]
+        for distribution in distributions:
+            benchmark.parse_distribution(distribution)
+        concurrencies = [int(value) for value in concurrency.split(',')]
+        batches = [int(value) for value in batch.split(',')]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    report = benchmark.run_bench(
+        distributions, concurrencies, batches, requests, seed,
+        progress=lambda result: click.echo(benchmark.format_result(result)), server=server, url=url)
+    if baseline:
+        with open(baseline) as file:
+            report['baseline'] = benchmark.compare(report, json.load(file))
+        for change in report['baseline']:
+            click.echo('{:<8} size={:<10} concurrency={:<4} batch={:<4} change (%): {}'.format(
+                change['operation'], change['size'], change['concurrency'], change['batch'],
+                change['change_pct']))
+    benchmark.write_report(report, output)
+    click.echo('Results written to {}'.format(output))
+
+
+# --- (command 07) ---
+@click.command()
+@click.option('-p', '--processes', default=None, type=int, help='Processes hashing the blobs [default: FILE_MANAGER_SCRUB_PROCESSES]')
+@click.option('-b', '--bandwidth', default=None, type=int, help='Bytes per second read, 0 for no limit [default: FILE_MANAGER_SCRUB_BANDWIDTH]')
+@click.option('-n', '--limit', default=None, type=int, help='Blobs to verify before stopping (the next run resumes)')
+@click.option('--restart', is_flag=True, help='Start a new pass instead of resuming the current one')
+def scrub(processes, bandwidth, limit, restart):
+    """Verify the hashes of the stored blobs and quarantine the corrupted ones"""
+    state = scrub_blobs(
+        processes, bandwidth, limit, restart,
+        progress=lambda state: click.echo('Verified {} blobs ({} bytes), up to {}'.format(
+            state['blobs'], state['bytes'], state['hash'])))
+    click.echo('{} blobs ({} bytes) verified, {} corrupted, {} missing{}'.format(
+        state['blobs'], state['bytes'], state['corrupted'], state['missing'],
+        '' if state['finished'] else ' (the pass is not finished, run again to resume)'))
+
+
+# --- (command 08) ---
+@click.command()
+def compact():
+    """Reclaim the space of the deleted blobs of the packed store (segments over FILE_MANAGER_PACK_COMPACT_RATIO)"""
+    driver = storage()
+    # NOTE: The packed store is the hot tier of a tiered driver
+    driver = driver.hot if isinstance(driver, TieredDriver) else driver
+    if not isinstance(driver, PackedDriver):
+        raise click.ClickException("'compact' requires packing ('FILE_MANAGER_PACK_MAX_SIZE')")
+    removed, reclaimed = driver.compact()
+    click.echo('Compacted {} segments ({} bytes reclaimed)'.format(removed, reclaimed))
+
+
+# --- (command 09) ---
+@click.command()
+@click.option('-n', '--limit', default=None, type=int, help='Files to delete before stopping')
+def expire_files(limit):
+    """Delete the files that expired (stored with a 'ttl' or an 'expires_at')"""
+    click.echo('Deleted {} expired files'.format(reap_expired_files(limit)))
+
+
+# --- (command 10) ---
+@click.command()
+@click.option('-n', '--limit', default=None, type=int, help='Blobs to move each way before stopping')
+def tier(limit):
+    """Move the blobs not read for FILE_MANAGER_TIER_COLD_AFTER seconds to the cold tier and the hot ones back"""
+    if not Config.FILE_MANAGER_COLD_DIR:
+        raise click.ClickException("'tier' requires a cold tier ('FILE_MANAGER_COLD_DIR')")
+    demoted, promoted = move_blobs(limit)
+    click.echo('Moved {} blobs to the cold tier and {} to the hot tier'.format(demoted, promoted))
@@ -0,0 +1,308 @@
+# logs.py ------------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the logging pipeline of the app, applied on top of 'logging.conf': the
+#    rotation of the log file, the (text or JSON) format, the sampling of the high-volume lines and
+#    the queue mode, where the request threads only enqueue the records and a background listener
+#    formats and writes them. The processes of a server (e.g. gunicorn's workers) do not write the
+#    log file themselves, since each one would rotate it on its own and corrupt its lines: they send
+#    their records to a single writer (the background process) over a Unix socket.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import json
+import queue
+import atexit
+import struct
+import datetime
+import itertools
+import threading
+import socketserver
+import logging
+from logging import handlers
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# The logger configured by 'logging.conf'
+APP_LOGGER = 'app'
+# Listener of the queue mode (re-created in each forked process)
+_listener = {'listener': None, 'handlers': None}
+# Length prefix of the records sent to the writer of the log file
+RECORD_LENGTH = struct.Struct('>L')
+# Handlers sending the records to the writer, with the handlers they replaced
+_writers = {}
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # NOTE: A record received by the writer of the log file carries its formatted exception
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in every 'every' INFO (or lower) records of the given loggers
+
+    The decision is made once per record and kept on it, so all the handlers sharing the filter
+    keep the same records.
+    """
+
+    def __init__(self, loggers, every):
+        super().__init__()
+        self.loggers = tuple(loggers)
+        self.every = every
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not record.name.startswith(self.loggers):
+            return True
+        sampled = getattr(record, 'sampled', None)
+        if sampled is None:
+            # NOTE: 'next' on a counter is atomic, so concurrent threads need no lock
+            sampled = record.sampled = next(self.counter) % self.every == 0
+        return sampled
+
+
+class AsyncQueueHandler(handlers.QueueHandler):
+    """Enqueues the records as they are and drops them when the queue is full
+
+    The message is not formatted here (as 'QueueHandler' does), since the queue stays inside the
+    process. A full queue never blocks the request thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class WriterHandler(handlers.SocketHandler):
+    """Sends the records to the writer of the log file over a Unix socket, as length-prefixed JSON
+
+    The message and the exception are formatted here, so the writer needs neither the arguments
+    nor the traceback objects (and no pickle crosses the socket). The records are dropped while
+    the writer is unreachable.
+    """
+
+    def __init__(self, address):
+        # NOTE: Without a port 'SocketHandler' connects to a Unix socket
+        super().__init__(address, None)
+
+    def makePickle(self, record):
+        data = dict(record.__dict__)
+        data['msg'], data['args'] = record.getMessage(), None
+        if record.exc_info and not record.exc_text:
+            data['exc_text'] = logging.Formatter().formatException(record.exc_info)
+        data['exc_info'] = None
+        payload = json.dumps(data, default=str).encode()
+        return RECORD_LENGTH.pack(len(payload)) + payload
+
+
+class RecordStreamHandler(socketserver.StreamRequestHandler):
+    """Receives the records of a process and writes them with the handlers of the writer"""
+
+    def handle(self):
+        while True:
+            header = self.rfile.read(RECORD_LENGTH.size)
+            if len(header) < RECORD_LENGTH.size:
+                return
+            payload = self.rfile.read(RECORD_LENGTH.unpack(header)[0])
+            record = logging.makeLogRecord(json.loads(payload))
+            for handler in self.server.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+class RecordServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server of the writer of the log file (a thread per connected process)"""
+
+    daemon_threads = True
+
+    def __init__(self, address, handlers):
+        self.handlers = handlers
+        super().__init__(address, RecordStreamHandler)
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def file_handler(location):
+    """This function returns the rotating handler of the log file"""
+    if Config.FILE_MANAGER_LOG_ROTATION == 'time':
+        return handlers.TimedRotatingFileHandler(
+            location, when=Config.FILE_MANAGER_LOG_ROTATE_WHEN, backupCount=Config.FILE_MANAGER_LOG_BACKUP_COUNT)
+    return handlers.RotatingFileHandler(
+        location, 'a', Config.FILE_MANAGER_LOG_MAX_BYTES, Config.FILE_MANAGER_LOG_BACKUP_COUNT)
+
+
+def start_listener():
+    """This function starts the background listener of the queue mode"""
+    log_queue = queue.Queue(Config.FILE_MANAGER_LOG_QUEUE_SIZE)
+    listener = handlers.QueueListener(log_queue, *_listener['handlers'], respect_handler_level=True)
+    listener.start()
+    _listener['listener'] = listener
+    return log_queue
+
+
+def restart_listener():
+    """This function starts a new listener in a forked process (threads do not survive a fork)"""
+    if _listener['listener'] is None:
+        return
+    log_queue = start_listener()
+    for handler in logging.getLogger(APP_LOGGER).handlers:
+        if isinstance(handler, AsyncQueueHandler):
+            handler.queue = log_queue
+
+
+def stop_listener():
+    """This function writes the records left in the queue and stops the listener"""
+    if _listener['listener'] is not None:
+        _listener['listener'].stop()
+        _listener['listener'] = None
+
+
+def file_handlers():
+    """This function returns the handlers of the app writing the log file (behind the queue, if any)"""
+    handlers = _listener['handlers'] if _listener['listener'] is not None else logging.getLogger(APP_LOGGER).handlers
+    return [handler for handler in handlers if isinstance(handler, logging.FileHandler)]
+
+
+def serve_records(address):
+    """This function writes the records sent to a Unix socket by the other processes, returns its server
+
+    The records are written by the handlers of the log file of this process, which becomes the
+    single writer of it. The server runs in a daemon thread until it is shut down.
+    """
+    if os.path.exists(address):
+        os.remove(address)
+    server = RecordServer(address, file_handlers())
+    threading.Thread(target=server.serve_forever, name='log-writer', daemon=True).start()
+    return server
+
+
+def route_records(address):
+    """This function sends the records of the log file to the writer at a Unix socket instead of writing them
+
+    The other handlers (e.g. the standard output) are kept.
+    """
+    def routed(handler):
+        if isinstance(handler, WriterHandler):
+            handler.close()
+            handler = _writers.pop(handler)
+        if not isinstance(handler, logging.FileHandler):
+            return handler
+        writer = WriterHandler(address)
+        writer.setLevel(handler.level)
+        for item in handler.filters:
+            writer.addFilter(item)
+        # NOTE: A closed file handler opens its file again when it writes (see 'restore_records')
+        handler.close()
+        _writers[writer] = handler
+        return writer
+
+    replace_handlers(routed)
+
+
+def restore_records():
+    """This function writes the records of the log file in this process again (once its writer has stopped)"""
+    def restored(handler):
+        if not isinstance(handler, WriterHandler):
+            return handler
+        handler.close()
+        return _writers.pop(handler)
+
+    replace_handlers(restored)
+
+
+def replace_handlers(replace):
+    """This function replaces each handler of the app (behind the queue, if any) by the one returned for it"""
+    logger = logging.getLogger(APP_LOGGER)
+    logger.handlers = [replace(handler) for handler in logger.handlers]
+    if _listener['listener'] is not None:
+        _listener['handlers'] = [replace(handler) for handler in _listener['handlers']]
+        _listener['listener'].handlers = tuple(_listener['handlers'])
+
+
+def reset_writers():
+    """This function drops the connections to the writer inherited by a forked process (they are the parent's)"""
+    for writer in _writers:
+        if writer.sock is not None:
+            writer.sock.close()
+            writer.sock = None
+
+
+os.register_at_fork(after_in_child=reset_writers)
+
+
+def configure_logging():
+    """This function applies the 'FILE_MANAGER_LOG_*' settings to the loggers of 'logging.conf'"""
+    logger = logging.getLogger(APP_LOGGER)
+    configured = []
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if isinstance(handler, logging.FileHandler):
+            handler.close()
+            rotating = file_handler(handler.baseFilename)
+            rotating.setFormatter(handler.formatter)
+            rotating.setLevel(handler.level)
+            handler = rotating
+        if Config.FILE_MANAGER_LOG_FORMAT == 'json':
+            handler.setFormatter(JsonFormatter())
+        configured.append(handler)
+    sampling = SamplingFilter(Config.FILE_MANAGER_LOG_SAMPLE_LOGGERS, Config.FILE_MANAGER_LOG_SAMPLE_EVERY)
+    if Config.FILE_MANAGER_LOG_MODE != 'queue':
+        for handler in configured:
+            handler.addFilter(sampling)
+            logger.addHandler(handler)
+    else:
+        # The records are sampled before they are enqueued, so the dropped ones cost nothing more
+        _listener['handlers'] = configured
+        handler = AsyncQueueHandler(start_listener())
+        handler.addFilter(sampling)
+        logger.addHandler(handler)
+        os.register_at_fork(after_in_child=restart_listener)
+        atexit.register(stop_listener)
+    # NOTE: A worker started by the server (e.g. of uvicorn) sends its records to the server's writer
+    if Config.FILE_MANAGER_LOG_SOCKET:
+        route_records(Config.FILE_MANAGER_LOG_SOCKET)
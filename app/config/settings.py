@@ -10,7 +10,8 @@
 # Imports
 # ==================================================================================================
 # Build-in
-from os import environ, pardir
+from os import cpu_count, environ, pardir
+from json import loads
 from os.path import abspath, dirname, join
 # Installed
 # NOTE: Add here the Installed modules
@@ -32,8 +33,183 @@ FILE_MANAGER_PORT = environ.get('FILE_MANAGER_PORT', 8000)
 FILE_MANAGER_API_KEY = environ.get('FILE_MANAGER_API_KEY', None)
 FILE_MANAGER_AUTH_INCOMING = environ.get('FILE_MANAGER_AUTH_INCOMING', 'True').lower() in ['true', '1', 'yes', 'on']
 FILE_MANAGER_AUTH_OUTGOING = not environ.get('FILE_MANAGER_AUTH_OUTGOING', 'False').lower() in ['false', '0', 'no', 'off']
+# Clients
+# NOTE: To give each client its own API key and limits export the OS environmental variable
+#       'FILE_MANAGER_API_KEYS' to a JSON object of the keys and their (optional) limits, e.g.
+#       '{"<key>": {"name": "client-a", "requests_per_second": 100, "requests_burst": 200,
+#       "upload_bytes_per_second": 10485760, "download_bytes_per_second": 52428800,
+#       "bytes_burst": 104857600, "max_bytes": 1073741824, "max_files": 10000}}' [default: '{}']
+FILE_MANAGER_API_KEYS = loads(environ.get('FILE_MANAGER_API_KEYS', '{}'))
+# NOTE: Where the token buckets of the limits are kept: 'memory' (per process) or 'sqlite' (a
+#       database at 'FILE_MANAGER_RATE_LIMIT_PATH', shared by the processes of the host) [default: 'memory']
+FILE_MANAGER_RATE_LIMIT_BACKEND = environ.get('FILE_MANAGER_RATE_LIMIT_BACKEND', 'memory').lower()
+FILE_MANAGER_RATE_LIMIT_PATH = environ.get('FILE_MANAGER_RATE_LIMIT_PATH', None)
+# Signed URLs
+# NOTE: The seconds a signed URL is valid for, unless requested otherwise [default: 3600], and at most
+#       [default: 604800, a week]
+FILE_MANAGER_SIGNED_URL_EXPIRES = int(environ.get('FILE_MANAGER_SIGNED_URL_EXPIRES', 3600))
+FILE_MANAGER_SIGNED_URL_MAX_EXPIRES = int(environ.get('FILE_MANAGER_SIGNED_URL_MAX_EXPIRES', 604800))
 # Set it for CORS
 FILE_MANAGER_SERVER_URL = environ.get('FILE_MANAGER_SERVER_URL', None)
+# Logging
+# NOTE: To control the logging pipeline export the OS environmental variable 'FILE_MANAGER_LOG_MODE' to
+#       'queue' so that the request threads only enqueue the records and a background thread writes
+#       them [default: 'sync']
+FILE_MANAGER_LOG_MODE = environ.get('FILE_MANAGER_LOG_MODE', 'sync').lower()
+# NOTE: Maximum number of records waiting in the queue (the rest are dropped)
+FILE_MANAGER_LOG_QUEUE_SIZE = int(environ.get('FILE_MANAGER_LOG_QUEUE_SIZE', 10000))
+# NOTE: Format of the records, 'text' (as in 'logging.conf') or 'json' [default: 'text']
+FILE_MANAGER_LOG_FORMAT = environ.get('FILE_MANAGER_LOG_FORMAT', 'text').lower()
+# NOTE: Rotation of the log file, by 'size' (at 'FILE_MANAGER_LOG_MAX_BYTES') or by 'time' (at
+#       'FILE_MANAGER_LOG_ROTATE_WHEN', e.g. 'midnight' or 'H') [default: 'size']
+FILE_MANAGER_LOG_ROTATION = environ.get('FILE_MANAGER_LOG_ROTATION', 'size').lower()
+FILE_MANAGER_LOG_MAX_BYTES = int(environ.get('FILE_MANAGER_LOG_MAX_BYTES', 1000000))
+FILE_MANAGER_LOG_ROTATE_WHEN = environ.get('FILE_MANAGER_LOG_ROTATE_WHEN', 'midnight')
+FILE_MANAGER_LOG_BACKUP_COUNT = int(environ.get('FILE_MANAGER_LOG_BACKUP_COUNT', 100))
+# NOTE: Only one in every 'FILE_MANAGER_LOG_SAMPLE_EVERY' INFO records of the (comma-separated)
+#       'FILE_MANAGER_LOG_SAMPLE_LOGGERS' is kept [default: 1 (all of them)]
+FILE_MANAGER_LOG_SAMPLE_EVERY = max(int(environ.get('FILE_MANAGER_LOG_SAMPLE_EVERY', 1)), 1)
+FILE_MANAGER_LOG_SAMPLE_LOGGERS = [
+    name.strip() for name in environ.get('FILE_MANAGER_LOG_SAMPLE_LOGGERS', 'app.routes.alive').split(',')
+    if name.strip()]
+# NOTE: Unix socket of the process that writes the log file for all the server's processes, set by
+#       the server itself for its workers (see 'app/utils/background.py') [default: None, each
+#       process writes the log file]
+FILE_MANAGER_LOG_SOCKET = environ.get('FILE_MANAGER_LOG_SOCKET', None)
+# Production Server
+# NOTE: To control the server export the OS environmental variable 'FILE_MANAGER_SERVER' to 'werkzeug'
+#       to use the single-process development server or 'uvicorn' to serve the file routes as
+#       coroutines (ASGI) [default: 'gunicorn' in production mode]
+FILE_MANAGER_SERVER = environ.get(
+    'FILE_MANAGER_SERVER', 'gunicorn' if FILE_MANAGER_EXECUTION_MODE == 'production' else 'werkzeug')
+FILE_MANAGER_WORKERS = int(environ.get('FILE_MANAGER_WORKERS', 2 * (cpu_count() or 1) + 1))
+FILE_MANAGER_THREADS = int(environ.get('FILE_MANAGER_THREADS', 4))
+FILE_MANAGER_KEEPALIVE = int(environ.get('FILE_MANAGER_KEEPALIVE', 5))
+FILE_MANAGER_TIMEOUT = int(environ.get('FILE_MANAGER_TIMEOUT', 120))
+FILE_MANAGER_GRACEFUL_TIMEOUT = int(environ.get('FILE_MANAGER_GRACEFUL_TIMEOUT', 30))
+FILE_MANAGER_MAX_REQUESTS = int(environ.get('FILE_MANAGER_MAX_REQUESTS', 0))
+FILE_MANAGER_BACKLOG = int(environ.get('FILE_MANAGER_BACKLOG', 2048))
+# NOTE: Number of threads (per process) of the disk I/O of the ASGI server [default: 32]
+FILE_MANAGER_ASGI_IO_THREADS = int(environ.get('FILE_MANAGER_ASGI_IO_THREADS', 32))
+# NOTE: Size (in bytes) of the blocks the ASGI server sends, i.e. the memory held by each slow
+#       client [default: 64 KiB]
+FILE_MANAGER_ASGI_BLOCK_SIZE = int(environ.get('FILE_MANAGER_ASGI_BLOCK_SIZE', 64 * 1024))
+# Storage
+# NOTE: Size (in bytes) of the chunks used to stream uploads to the filesystem [default: 1 MiB]
+FILE_MANAGER_CHUNK_SIZE = int(environ.get('FILE_MANAGER_CHUNK_SIZE', 1024 * 1024))
+# NOTE: Maximum size (in bytes) of each uploaded file and of the whole body of an upload request,
+#       refused (413) while they are received [default: 0, no limit]
+FILE_MANAGER_MAX_FILE_SIZE = int(environ.get('FILE_MANAGER_MAX_FILE_SIZE', 0))
+FILE_MANAGER_MAX_CONTENT_LENGTH = int(environ.get('FILE_MANAGER_MAX_CONTENT_LENGTH', 0))
+# NOTE: Maximum number of files of a batch upload that are stored concurrently (per process)
+FILE_MANAGER_BATCH_MAX_IN_FLIGHT = int(environ.get('FILE_MANAGER_BATCH_MAX_IN_FLIGHT', 8))
+# NOTE: Flush the stored files (and their directories) to disk before they are committed, so a
+#       committed file survives a power loss [default: True]
+FILE_MANAGER_FSYNC = environ.get('FILE_MANAGER_FSYNC', 'True').lower() in ['true', '1', 'yes', 'on']
+# Storage Driver
+# NOTE: To control where the blobs are stored export the OS environmental variable
+#       'FILE_MANAGER_STORAGE_DRIVER' to 'local' (the files directory), 'sharded' (the directories
+#       of 'FILE_MANAGER_STORAGE_SHARDS') or 's3' (a bucket of an S3-compatible object store,
+#       requires the 'boto3' package) [default: 'local']
+FILE_MANAGER_STORAGE_DRIVER = environ.get('FILE_MANAGER_STORAGE_DRIVER', 'local').lower()
+# NOTE: Comma-separated directories of the 'sharded' driver (e.g. one mount point per disk)
+FILE_MANAGER_STORAGE_SHARDS = [
+    path.strip() for path in environ.get('FILE_MANAGER_STORAGE_SHARDS', '').split(',') if path.strip()]
+# NOTE: Points of each shard on the consistent hashing ring of the 'sharded' driver [default: 64]
+FILE_MANAGER_STORAGE_VNODES = int(environ.get('FILE_MANAGER_STORAGE_VNODES', 64))
+# NOTE: Bucket, key prefix and endpoint (e.g. 'http://minio:9000', unset for AWS) of the 's3' driver
+FILE_MANAGER_S3_BUCKET = environ.get('FILE_MANAGER_S3_BUCKET', None)
+FILE_MANAGER_S3_PREFIX = environ.get('FILE_MANAGER_S3_PREFIX', '')
+FILE_MANAGER_S3_ENDPOINT_URL = environ.get('FILE_MANAGER_S3_ENDPOINT_URL', None)
+FILE_MANAGER_S3_REGION = environ.get('FILE_MANAGER_S3_REGION', None)
+# NOTE: Credentials of the 's3' driver (unset to use the default chain of boto3)
+FILE_MANAGER_S3_ACCESS_KEY_ID = environ.get('FILE_MANAGER_S3_ACCESS_KEY_ID', None)
+FILE_MANAGER_S3_SECRET_ACCESS_KEY = environ.get('FILE_MANAGER_S3_SECRET_ACCESS_KEY', None)
+# NOTE: Blobs of at most 'FILE_MANAGER_PACK_MAX_SIZE' bytes are appended to segment files of
+#       'FILE_MANAGER_PACK_SEGMENT_SIZE' bytes inside the files directory instead of a file each
+#       (0 disables it) [default: 0, e.g. 16384]
+FILE_MANAGER_PACK_MAX_SIZE = int(environ.get('FILE_MANAGER_PACK_MAX_SIZE', 0))
+FILE_MANAGER_PACK_SEGMENT_SIZE = int(environ.get('FILE_MANAGER_PACK_SEGMENT_SIZE', 256 * 1024 * 1024))
+# NOTE: Fraction of deleted bytes over which 'flask compact' rewrites a segment [default: 0.5]
+FILE_MANAGER_PACK_COMPACT_RATIO = float(environ.get('FILE_MANAGER_PACK_COMPACT_RATIO', 0.5))
+# Tiering
+# NOTE: Directory of the cold tier (e.g. a HDD or a network mount), where the blobs of the files
+#       not read for 'FILE_MANAGER_TIER_COLD_AFTER' seconds are moved (unset disables it) [default: None]
+FILE_MANAGER_COLD_DIR = environ.get('FILE_MANAGER_COLD_DIR', None)
+FILE_MANAGER_TIER_COLD_AFTER = int(environ.get('FILE_MANAGER_TIER_COLD_AFTER', 24 * 60 * 60))
+# NOTE: Reads (counted by sampling, halved on each run of the mover) after which a cold blob is
+#       moved back to the hot tier [default: 8]
+FILE_MANAGER_TIER_PROMOTE_READS = int(environ.get('FILE_MANAGER_TIER_PROMOTE_READS', 8))
+# NOTE: One in 'FILE_MANAGER_TIER_SAMPLE_RATE' reads of a cold file is counted (by that many), so
+#       the reads are not written each time [default: 4]
+FILE_MANAGER_TIER_SAMPLE_RATE = int(environ.get('FILE_MANAGER_TIER_SAMPLE_RATE', 4))
+# NOTE: Seconds between two runs of the mover inside the service (0 disables it, 'flask tier' runs
+#       it on demand) [default: 1 hour]
+FILE_MANAGER_TIER_INTERVAL = int(environ.get('FILE_MANAGER_TIER_INTERVAL', 60 * 60))
+# Scrubber
+# NOTE: Seconds between two passes of the integrity scrubber inside the service, which re-hashes
+#       the stored blobs and quarantines the corrupted ones (0 disables it, 'flask scrub' runs a
+#       pass on demand) [default: 0]
+FILE_MANAGER_SCRUB_INTERVAL = int(environ.get('FILE_MANAGER_SCRUB_INTERVAL', 0))
+# NOTE: Bytes per second read by the scrubber, shared by its processes (0 for no limit) [default: 32 MiB]
+FILE_MANAGER_SCRUB_BANDWIDTH = int(environ.get('FILE_MANAGER_SCRUB_BANDWIDTH', 32 * 1024 * 1024))
+# NOTE: Processes hashing the blobs in parallel (1 hashes them in the scrubber's thread) [default: 1]
+FILE_MANAGER_SCRUB_PROCESSES = int(environ.get('FILE_MANAGER_SCRUB_PROCESSES', 1))
+# Expiry
+# NOTE: Seconds between two runs of the reaper inside the service, which deletes the files that
+#       expired (0 disables it, 'flask expire-files' runs it on demand; expired files are served as
+#       missing either way) [default: 60]
+FILE_MANAGER_EXPIRY_INTERVAL = int(environ.get('FILE_MANAGER_EXPIRY_INTERVAL', 60))
+# Journal
+# NOTE: Seconds between two replays of the journal inside the service, which complete the changes of
+#       the processes that crashed (e.g. a worker of uvicorn, whose server does not replay them when
+#       it restarts it; 0 disables it, the journal is replayed at startup either way) [default: 10]
+FILE_MANAGER_JOURNAL_INTERVAL = int(environ.get('FILE_MANAGER_JOURNAL_INTERVAL', 10))
+# Compression
+# NOTE: To compress the stored files export the OS environmental variable 'FILE_MANAGER_COMPRESSION' to
+#       'gzip' or 'zstd' (requires the 'zstandard' package) [default: 'none']
+FILE_MANAGER_COMPRESSION = environ.get('FILE_MANAGER_COMPRESSION', 'none').lower()
+# NOTE: Compression level [default: 6 for gzip, 3 for zstd]
+FILE_MANAGER_COMPRESSION_LEVEL = int(environ.get('FILE_MANAGER_COMPRESSION_LEVEL', 0)) or None
+# NOTE: Files smaller than this (in bytes) are stored uncompressed [default: 1 KiB]
+FILE_MANAGER_COMPRESSION_MIN_SIZE = int(environ.get('FILE_MANAGER_COMPRESSION_MIN_SIZE', 1024))
+# Downloads
+# NOTE: To control how the files are sent export the OS environmental variable 'FILE_MANAGER_ZERO_COPY'
+#       to 'auto' ('sendfile' when the server supports it, e.g. gunicorn, or else a memory map),
+#       'mmap' (always a memory map) or 'off' (Flask's 'send_file') [default: 'auto']
+FILE_MANAGER_ZERO_COPY = environ.get('FILE_MANAGER_ZERO_COPY', 'auto').lower()
+# NOTE: Size (in bytes) of the blocks of the memory-mapped files [default: 8 MiB]
+FILE_MANAGER_MMAP_BLOCK_SIZE = int(environ.get('FILE_MANAGER_MMAP_BLOCK_SIZE', 8 * 1024 * 1024))
+# Resumable Uploads
+# NOTE: Number of seconds after the last chunk that an unfinished upload is deleted [default: 1 day]
+FILE_MANAGER_UPLOAD_TTL = int(environ.get('FILE_MANAGER_UPLOAD_TTL', 24 * 60 * 60))
+# NOTE: Minimum number of seconds between two collections of the expired uploads (per process)
+FILE_MANAGER_UPLOAD_GC_INTERVAL = int(environ.get('FILE_MANAGER_UPLOAD_GC_INTERVAL', 10 * 60))
+# Archives
+FILE_MANAGER_ARCHIVE_MAX_FILES = int(environ.get('FILE_MANAGER_ARCHIVE_MAX_FILES', 1000))
+FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL = int(environ.get('FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL', 6))
+# Metadata Index
+# NOTE: Path of the SQLite index of the stored files [default: '.index.db' inside the files directory]
+FILE_MANAGER_INDEX_PATH = environ.get('FILE_MANAGER_INDEX_PATH', None)
+# NOTE: Minimum number of seconds between two updates of a file's access timestamp
+FILE_MANAGER_INDEX_ACCESS_RESOLUTION = int(environ.get('FILE_MANAGER_INDEX_ACCESS_RESOLUTION', 60))
+# Read Cache
+# NOTE: Total size (in bytes) of the per-process in-memory cache of small files [default: 0 (disabled)]
+FILE_MANAGER_READ_CACHE_MAX_BYTES = int(environ.get('FILE_MANAGER_READ_CACHE_MAX_BYTES', 0))
+# NOTE: Only files up to this size (in bytes) are cached [default: 64 KiB]
+FILE_MANAGER_READ_CACHE_MAX_FILE_SIZE = int(environ.get('FILE_MANAGER_READ_CACHE_MAX_FILE_SIZE', 64 * 1024))
+# Metrics
+# NOTE: To disable the '/metrics' route export the OS environmental variable 'FILE_MANAGER_METRICS' to 'False'
+FILE_MANAGER_METRICS = environ.get('FILE_MANAGER_METRICS', 'True').lower() in ['true', '1', 'yes', 'on']
+# NOTE: Directory of the metric files shared by the worker processes [default: 'file-manager-metrics'
+#       inside the temporary directory]
+FILE_MANAGER_METRICS_DIR = environ.get('FILE_MANAGER_METRICS_DIR', None)
+# HTTP Caching
+# NOTE: 'Cache-Control' of each route. Files named by their hash never change, so they are served
+#       using the immutable policy
+FILE_MANAGER_CACHE_CONTROL_READ = environ.get('FILE_MANAGER_CACHE_CONTROL_READ', 'no-cache')
+FILE_MANAGER_CACHE_CONTROL_DOWNLOAD = environ.get('FILE_MANAGER_CACHE_CONTROL_DOWNLOAD', 'no-cache')
+FILE_MANAGER_CACHE_CONTROL_IMMUTABLE = environ.get('FILE_MANAGER_CACHE_CONTROL_IMMUTABLE', 'public, max-age=31536000, immutable')
 
 
 # ==================================================================================================
@@ -64,7 +240,77 @@ class ConfigApp(object):
     FILE_MANAGER_API_KEY = FILE_MANAGER_API_KEY
     FILE_MANAGER_AUTH_INCOMING = FILE_MANAGER_AUTH_INCOMING
     FILE_MANAGER_AUTH_OUTGOING = FILE_MANAGER_AUTH_OUTGOING
+    FILE_MANAGER_API_KEYS = FILE_MANAGER_API_KEYS
+    FILE_MANAGER_RATE_LIMIT_BACKEND = FILE_MANAGER_RATE_LIMIT_BACKEND
+    FILE_MANAGER_RATE_LIMIT_PATH = FILE_MANAGER_RATE_LIMIT_PATH
+    FILE_MANAGER_SIGNED_URL_EXPIRES = FILE_MANAGER_SIGNED_URL_EXPIRES
+    FILE_MANAGER_SIGNED_URL_MAX_EXPIRES = FILE_MANAGER_SIGNED_URL_MAX_EXPIRES
     FILE_MANAGER_SERVER_URL = FILE_MANAGER_SERVER_URL
+    FILE_MANAGER_LOG_MODE = FILE_MANAGER_LOG_MODE
+    FILE_MANAGER_LOG_QUEUE_SIZE = FILE_MANAGER_LOG_QUEUE_SIZE
+    FILE_MANAGER_LOG_FORMAT = FILE_MANAGER_LOG_FORMAT
+    FILE_MANAGER_LOG_ROTATION = FILE_MANAGER_LOG_ROTATION
+    FILE_MANAGER_LOG_MAX_BYTES = FILE_MANAGER_LOG_MAX_BYTES
+    FILE_MANAGER_LOG_ROTATE_WHEN = FILE_MANAGER_LOG_ROTATE_WHEN
+    FILE_MANAGER_LOG_BACKUP_COUNT = FILE_MANAGER_LOG_BACKUP_COUNT
+    FILE_MANAGER_LOG_SAMPLE_EVERY = FILE_MANAGER_LOG_SAMPLE_EVERY
+    FILE_MANAGER_LOG_SAMPLE_LOGGERS = FILE_MANAGER_LOG_SAMPLE_LOGGERS
+    FILE_MANAGER_LOG_SOCKET = FILE_MANAGER_LOG_SOCKET
+    FILE_MANAGER_SERVER = FILE_MANAGER_SERVER
+    FILE_MANAGER_WORKERS = FILE_MANAGER_WORKERS
+    FILE_MANAGER_THREADS = FILE_MANAGER_THREADS
+    FILE_MANAGER_KEEPALIVE = FILE_MANAGER_KEEPALIVE
+    FILE_MANAGER_TIMEOUT = FILE_MANAGER_TIMEOUT
+    FILE_MANAGER_GRACEFUL_TIMEOUT = FILE_MANAGER_GRACEFUL_TIMEOUT
+    FILE_MANAGER_MAX_REQUESTS = FILE_MANAGER_MAX_REQUESTS
+    FILE_MANAGER_BACKLOG = FILE_MANAGER_BACKLOG
+    FILE_MANAGER_ASGI_IO_THREADS = FILE_MANAGER_ASGI_IO_THREADS
+    FILE_MANAGER_ASGI_BLOCK_SIZE = FILE_MANAGER_ASGI_BLOCK_SIZE
+    FILE_MANAGER_CHUNK_SIZE = FILE_MANAGER_CHUNK_SIZE
+    FILE_MANAGER_MAX_FILE_SIZE = FILE_MANAGER_MAX_FILE_SIZE
+    FILE_MANAGER_MAX_CONTENT_LENGTH = FILE_MANAGER_MAX_CONTENT_LENGTH
+    FILE_MANAGER_BATCH_MAX_IN_FLIGHT = FILE_MANAGER_BATCH_MAX_IN_FLIGHT
+    FILE_MANAGER_FSYNC = FILE_MANAGER_FSYNC
+    FILE_MANAGER_STORAGE_DRIVER = FILE_MANAGER_STORAGE_DRIVER
+    FILE_MANAGER_STORAGE_SHARDS = FILE_MANAGER_STORAGE_SHARDS
+    FILE_MANAGER_STORAGE_VNODES = FILE_MANAGER_STORAGE_VNODES
+    FILE_MANAGER_S3_BUCKET = FILE_MANAGER_S3_BUCKET
+    FILE_MANAGER_S3_PREFIX = FILE_MANAGER_S3_PREFIX
+    FILE_MANAGER_S3_ENDPOINT_URL = FILE_MANAGER_S3_ENDPOINT_URL
+    FILE_MANAGER_S3_REGION = FILE_MANAGER_S3_REGION
+    FILE_MANAGER_S3_ACCESS_KEY_ID = FILE_MANAGER_S3_ACCESS_KEY_ID
+    FILE_MANAGER_S3_SECRET_ACCESS_KEY = FILE_MANAGER_S3_SECRET_ACCESS_KEY
+    FILE_MANAGER_PACK_MAX_SIZE = FILE_MANAGER_PACK_MAX_SIZE
+    FILE_MANAGER_PACK_SEGMENT_SIZE = FILE_MANAGER_PACK_SEGMENT_SIZE
+    FILE_MANAGER_PACK_COMPACT_RATIO = FILE_MANAGER_PACK_COMPACT_RATIO
+    FILE_MANAGER_COLD_DIR = FILE_MANAGER_COLD_DIR
+    FILE_MANAGER_TIER_COLD_AFTER = FILE_MANAGER_TIER_COLD_AFTER
+    FILE_MANAGER_TIER_PROMOTE_READS = FILE_MANAGER_TIER_PROMOTE_READS
+    FILE_MANAGER_TIER_SAMPLE_RATE = FILE_MANAGER_TIER_SAMPLE_RATE
+    FILE_MANAGER_TIER_INTERVAL = FILE_MANAGER_TIER_INTERVAL
+    FILE_MANAGER_SCRUB_INTERVAL = FILE_MANAGER_SCRUB_INTERVAL
+    FILE_MANAGER_SCRUB_BANDWIDTH = FILE_MANAGER_SCRUB_BANDWIDTH
+    FILE_MANAGER_SCRUB_PROCESSES = FILE_MANAGER_SCRUB_PROCESSES
+    FILE_MANAGER_EXPIRY_INTERVAL = FILE_MANAGER_EXPIRY_INTERVAL
+    FILE_MANAGER_JOURNAL_INTERVAL = FILE_MANAGER_JOURNAL_INTERVAL
+    FILE_MANAGER_COMPRESSION = FILE_MANAGER_COMPRESSION
+    FILE_MANAGER_COMPRESSION_LEVEL = FILE_MANAGER_COMPRESSION_LEVEL
+    FILE_MANAGER_COMPRESSION_MIN_SIZE = FILE_MANAGER_COMPRESSION_MIN_SIZE
+    FILE_MANAGER_ZERO_COPY = FILE_MANAGER_ZERO_COPY
+    FILE_MANAGER_MMAP_BLOCK_SIZE = FILE_MANAGER_MMAP_BLOCK_SIZE
+    FILE_MANAGER_UPLOAD_TTL = FILE_MANAGER_UPLOAD_TTL
+    FILE_MANAGER_UPLOAD_GC_INTERVAL = FILE_MANAGER_UPLOAD_GC_INTERVAL
+    FILE_MANAGER_ARCHIVE_MAX_FILES = FILE_MANAGER_ARCHIVE_MAX_FILES
+    FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL = FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL
+    FILE_MANAGER_INDEX_PATH = FILE_MANAGER_INDEX_PATH
+    FILE_MANAGER_INDEX_ACCESS_RESOLUTION = FILE_MANAGER_INDEX_ACCESS_RESOLUTION
+    FILE_MANAGER_READ_CACHE_MAX_BYTES = FILE_MANAGER_READ_CACHE_MAX_BYTES
+    FILE_MANAGER_READ_CACHE_MAX_FILE_SIZE = FILE_MANAGER_READ_CACHE_MAX_FILE_SIZE
+    FILE_MANAGER_METRICS = FILE_MANAGER_METRICS
+    FILE_MANAGER_METRICS_DIR = FILE_MANAGER_METRICS_DIR
+    FILE_MANAGER_CACHE_CONTROL_READ = FILE_MANAGER_CACHE_CONTROL_READ
+    FILE_MANAGER_CACHE_CONTROL_DOWNLOAD = FILE_MANAGER_CACHE_CONTROL_DOWNLOAD
+    FILE_MANAGER_CACHE_CONTROL_IMMUTABLE = FILE_MANAGER_CACHE_CONTROL_IMMUTABLE
 
 
 class ConfigFlask(object):
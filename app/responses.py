@@ -40,9 +40,19 @@ def template(status='error', message='empty-message', code=500):
 #
 # General
 MESSING_FIELDS = template('warning', 'Missing fields!', 400)
+# Files
+MISSING_EXTENSION = template('warning', 'Missing file extension!', 400)
+UNSECURE_FILENAME = template('warning', 'Unsecure filename!', 400)
+INVALID_FILENAME = template('warning', 'Invalid filename!', 400)
+UNEXPECTED_EXTENSION = template('warning', 'Unexpected file extension!', 400)
 # Authentication
 AUTH_NOT_FOUND = template('warning', 'Auth Not Found!', 401)
 UNAUTHORIZED = template('error', 'Unauthorized', 403)
+SIGNED_URL_EXPIRED = template('warning', 'Signed URL expired', 403)
+# Limits
+TOO_MANY_REQUESTS = template('warning', 'Too Many Requests', 429)
+QUOTA_EXCEEDED = template('warning', 'Storage quota exceeded', 403)
+PAYLOAD_TOO_LARGE = template('warning', 'Payload Too Large', 413)
 
 
 # ==================================================================================================
@@ -115,6 +125,25 @@ class MyResponse():
     def missing_fields(cls, data=None):
         return cls(**{**MESSING_FIELDS, 'data': data} if data else {**MESSING_FIELDS})
 
+    #
+    # Files
+    #
+    @classmethod
+    def missing_extension(cls):
+        return cls(**MISSING_EXTENSION)
+
+    @classmethod
+    def unsecure_filename(cls):
+        return cls(**UNSECURE_FILENAME)
+
+    @classmethod
+    def invalid_filename(cls):
+        return cls(**INVALID_FILENAME)
+
+    @classmethod
+    def unexpected_extension(cls):
+        return cls(**UNEXPECTED_EXTENSION)
+
     #
     # Authentication
     #
@@ -126,6 +155,25 @@ class MyResponse():
     def unauthorized(cls):
         return cls(**UNAUTHORIZED, verbose=False)
 
+    @classmethod
+    def signed_url_expired(cls):
+        return cls(**SIGNED_URL_EXPIRED, verbose=False)
+
+    #
+    # Limits
+    #
+    @classmethod
+    def too_many_requests(cls, retry_after):
+        return cls(**TOO_MANY_REQUESTS, header={'Retry-After': str(retry_after)}, verbose=False)
+
+    @classmethod
+    def quota_exceeded(cls, limit, value):
+        return cls(**QUOTA_EXCEEDED, data={'limit': limit, 'max': value})
+
+    @classmethod
+    def payload_too_large(cls, limit, value):
+        return cls(**PAYLOAD_TOO_LARGE, data={'limit': limit, 'max': value})
+
 
 class MyException(MyResponse, Exception):
     """Flask catches it and returns it as responce"""
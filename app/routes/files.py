@@ -18,6 +18,9 @@
 # | --- (router 03) --- | /storage/v1/file/<filename>          | GET     | Returns a file from the filesystem
 # | --- (router 04) --- | /storage/v1/file/<filename>          | DELETE  | Deletes a file from the filesystem
 # | --- (router 05) --- | /storage/v1/file/donwload/<filename> | GET     | Returns a file from the filesystem as attachment
+# | --- (router 06) --- | /storage/v1/files                    | GET     | Returns the stored files (paginated)
+# | --- (router 07) --- | /storage/v1/files/archive            | POST    | Returns many files as a single archive
+# | --- (router 08) --- | /storage/v1/files/presign            | POST    | Returns a signed URL of a file (or prefix)
 
 
 # ==================================================================================================
@@ -33,12 +36,20 @@ logger = logging.getLogger(__name__)
 # Imports
 # ==================================================================================================
 # Build-in
-import os
+# NOTE: Add here the Build-in modules
 # Installed
-from flask import Blueprint, send_file
+from flask import Blueprint, Response, g, request, url_for
 # Custom
 from app.utils.decorators import files_required, unique_filename, auth_required
-from app.utils.general import filepath, store_files, remove_file
+from app.utils.general import store_files, remove_file, batch_failed, precondition_failed, version_matches
+from app.utils.general import encode_cursor, decode_cursor, parse_timestamp, timestamp_to_iso
+from app.utils.general import file_quarantined
+from app.utils import index
+from app.utils.serving import serve_file
+from app.utils.archives import ARCHIVE_FORMATS, stream_archive
+from app.utils.signing import SIGNED_METHODS, signed_query
+from app.utils.tiering import count_read
+from app.config.settings import Config
 from app.responses import MyResponse, MyException
 
 
@@ -47,6 +58,9 @@ from app.responses import MyResponse, MyException
 # ==================================================================================================
 #
 blueprint = Blueprint('files', __name__)
+# Listing
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
 
 
 # ==================================================================================================
@@ -55,15 +69,18 @@ blueprint = Blueprint('files', __name__)
 #
 # --- (router 01) ---
 @blueprint.route('/storage/v1/file', methods=['POST'])
+@auth_required
 @unique_filename
 @files_required
-@auth_required
-def create_file(files: list, unique_id: bool):
-    """This function stores a file to the filesystem"""
+def create_file(files: list, unique_id: bool, expires: float):
+    """This function stores a file to the filesystem (deleted once it expires, if 'ttl' or 'expires_at' is given)"""
     logger.info('Request to store file(s)')
     try:
-        filename = store_files(files, unique_id)
-        return MyResponse.only_data(filename, 200).to_response()
+        filename = store_files(files, unique_id, client=g.client, expires=expires)
+        # NOTE: A batch where some files failed returns 207 (Multi-Status)
+        return MyResponse.only_data(filename, 207 if batch_failed(filename) else 200).to_response()
+    except MyException:
+        raise
     except Exception as e:
         logger.exception(e)
         raise MyException.error('Failed to store the file!', 500)
@@ -71,16 +88,34 @@ def create_file(files: list, unique_id: bool):
 
 # --- (router 02) ---
 @blueprint.route('/storage/v1/file/<filename>', methods=['PUT'])
+@auth_required
 @unique_filename
 @files_required
-@auth_required
-def update_file(files: list, unique_id: bool, filename: str):
-    """This function updates a file to the filesystem"""
+def update_file(files: list, unique_id: bool, expires: float, filename: str):
+    """This function updates a file to the filesystem
+
+    The new file is stored before the old one is removed, so readers always get one of them (a
+    file that keeps its name is replaced atomically). With 'If-Match' (the ETag or the version of
+    the file) the file is only replaced if it did not change meanwhile, or else 412 is returned.
+    The new file keeps no expiry of the old one (see 'create_file').
+    """
     logger.info('Request to update file(s)')
+    if_match = request.if_match if 'If-Match' in request.headers else None
+    if if_match is not None and not version_matches(index.lookup(filename), if_match):
+        raise precondition_failed(filename)
     try:
-        remove_file(filename)
-        filename = store_files(files, unique_id)
-        return MyResponse.only_data(filename, 200).to_response()
+        result = store_files(
+            files, unique_id, preconditions={filename: if_match} if if_match is not None else None, client=g.client,
+            expires=expires)
+        entries = result if isinstance(result, list) else [result]
+        stored = [e['filename'] if isinstance(e, dict) else e for e in entries
+                  if not isinstance(e, dict) or e.get('status') != 'error']
+        # The previous file is removed only when it was replaced under another name
+        if stored and filename not in stored:
+            remove_file(filename, if_match)
+        return MyResponse.only_data(result, 207 if batch_failed(result) else 200).to_response()
+    except MyException:
+        raise
     except Exception as e:
         logger.exception(e)
         raise MyException.error('Failed to update the file!', 500)
@@ -91,11 +126,14 @@ def update_file(files: list, unique_id: bool, filename: str):
 @auth_required
 def read_file(filename: str):
     """This function returns a file from the filesystem"""
-    logger.info("Request to get file: '{}'".format(filename))
-    file_location = filepath(filename)
-    if os.path.exists(file_location):
-        logger.info("File '{}' retrieved".format(filename))
-        return send_file(file_location, download_name=filename)
+    # NOTE: Hot routes pass the arguments to the logger, so nothing is formatted for dropped records
+    logger.info("Request to get file: '%s'", filename)
+    record = index.lookup_live(filename)
+    if record is not None:
+        logger.info("File '%s' retrieved", filename)
+        index.touch(record)
+        count_read(record)
+        return serve_file(record, Config.FILE_MANAGER_CACHE_CONTROL_READ)
     else:
         raise MyException.warning("File '{}' not found".format(filename), 404)
 
@@ -117,10 +155,144 @@ def delete_file(filename: str):
 @auth_required
 def download_file(filename: str):
     """This function returns a file from the filesystem as an attachment"""
-    logger.info("Request to download file: '{}'".format(filename))
-    file_location = filepath(filename)
-    if os.path.exists(file_location):
-        logger.info("File '{}' retrieved".format(filename))
-        return send_file(file_location, as_attachment=True, download_name=filename)
+    logger.info("Request to download file: '%s'", filename)
+    record = index.lookup_live(filename)
+    if record is not None:
+        logger.info("File '%s' retrieved", filename)
+        index.touch(record)
+        count_read(record)
+        return serve_file(record, Config.FILE_MANAGER_CACHE_CONTROL_DOWNLOAD, as_attachment=True)
     else:
         raise MyException.warning("File '{}' not found".format(filename), 404)
+
+
+# --- (router 06) ---
+@blueprint.route('/storage/v1/files', methods=['GET'])
+@auth_required
+def list_files():
+    """This function returns a page of the stored files
+
+    Query parameters: 'prefix', 'extension', 'min_size', 'max_size', 'created_after' and
+    'created_before' (POSIX or ISO 8601) filter the files, 'sort' ('name', 'size' or 'created') and
+    'order' ('asc' or 'desc') sort them, 'limit' sets the page size and 'cursor' (the 'next_cursor'
+    of the previous page) fetches the next page.
+    """
+    logger.info('Request to list files')
+    try:
+        sort = request.args.get('sort', 'name')
+        order = request.args.get('order', 'asc')
+        limit = min(request.args.get('limit', LIST_DEFAULT_LIMIT, type=int), LIST_MAX_LIMIT)
+        created_after = request.args.get('created_after', type=parse_timestamp)
+        created_before = request.args.get('created_before', type=parse_timestamp)
+        if sort not in index.SORT_COLUMNS or order not in ('asc', 'desc') or limit < 1:
+            raise ValueError()
+    except ValueError:
+        raise MyException.warning('Invalid listing parameters', 400)
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and (not isinstance(after, list) or len(after) != 2):
+        raise MyException.warning('Invalid cursor', 400)
+    files = index.search(
+        prefix=request.args.get('prefix'),
+        extension=request.args.get('extension'),
+        min_size=request.args.get('min_size', type=int),
+        max_size=request.args.get('max_size', type=int),
+        created_after=created_after,
+        created_before=created_before,
+        sort=sort,
+        descending=order == 'desc',
+        limit=limit,
+        after=after)
+    next_cursor = encode_cursor([files[-1][sort], files[-1]['name']]) if len(files) == limit else None
+    data = {
+        'files': [{
+            'filename': f['name'],
+            'name': f['original_name'],
+            'type': f['type'],
+            'size': f['size'],
+            'hash': f['hash'],
+            'version': f['version'],
+            'owner': f['owner'],
+            'created': timestamp_to_iso(f['created']),
+            'accessed': timestamp_to_iso(f['accessed']),
+            'quarantined': timestamp_to_iso(f['quarantined']) if f['quarantined'] is not None else None,
+            'expires': timestamp_to_iso(f['expires']) if f['expires'] is not None else None,
+        } for f in files],
+        'next_cursor': next_cursor,
+    }
+    return MyResponse.only_data(data, 200).to_response()
+
+
+# --- (router 07) ---
+@blueprint.route('/storage/v1/files/archive', methods=['POST'])
+@auth_required
+def archive_files():
+    """This function returns many files as a single archive, streamed while it is built
+
+    The JSON body contains the 'files' (list of filenames) and the 'format' ('zip', 'tar' or
+    'tar.gz', default 'zip') of the archive.
+    """
+    logger.info('Request to archive files')
+    body = request.get_json(silent=True) or {}
+    filenames = body.get('files')
+    archive_format = body.get('format', 'zip')
+    if not isinstance(filenames, list) or len(filenames) == 0 or archive_format not in ARCHIVE_FORMATS:
+        raise MyException.missing_fields()
+    if len(filenames) > Config.FILE_MANAGER_ARCHIVE_MAX_FILES:
+        raise MyException.warning(
+            'Too many files (maximum {})'.format(Config.FILE_MANAGER_ARCHIVE_MAX_FILES), 400)
+    # Look up all the files before the response starts
+    records, missing = [], []
+    for filename in dict.fromkeys(filenames):
+        record = index.lookup_live(filename) if isinstance(filename, str) else None
+        if record is None:
+            missing.append(filename)
+        elif record['quarantined'] is not None:
+            raise file_quarantined(filename)
+        else:
+            records.append(record)
+    if missing:
+        raise MyException.warning('Files not found', 404, data=missing)
+    logger.info('Archiving {} files as {}'.format(len(records), archive_format))
+    response = Response(stream_archive(records, archive_format), mimetype=ARCHIVE_FORMATS[archive_format])
+    response.headers.set('Content-Disposition', 'attachment', filename='files.{}'.format(archive_format))
+    return response
+
+
+# --- (router 08) ---
+@blueprint.route('/storage/v1/files/presign', methods=['POST'])
+@auth_required
+def presign_url():
+    """This function returns a signed, expiring URL of a file, readable without an API key
+
+    The JSON body contains the 'filename' of the file or a 'prefix' of the filenames the URL is
+    valid for (the filename of the URL can then be changed to any of them), the 'route' ('read' or
+    'download', default 'read'), the 'method' ('GET' or 'HEAD', default both) and the 'expires_in'
+    seconds of the URL. The URL is signed by the API key of the request.
+    """
+    logger.info('Request to sign a URL')
+    body = request.get_json(silent=True) or {}
+    filename, prefix = body.get('filename'), body.get('prefix')
+    route, method = body.get('route', 'read'), body.get('method')
+    expires_in = body.get('expires_in', Config.FILE_MANAGER_SIGNED_URL_EXPIRES)
+    if filename is None and prefix is None:
+        raise MyException.missing_fields()
+    if not isinstance(filename, (str, type(None))) or not isinstance(prefix, (str, type(None))):
+        raise MyException.warning('Invalid filename or prefix', 400)
+    if filename is not None and prefix is not None and not filename.startswith(prefix):
+        raise MyException.warning("Filename outside of prefix '{}'".format(prefix), 400)
+    if route not in ('read', 'download') or method not in (None, *SIGNED_METHODS):
+        raise MyException.warning('Invalid route or method', 400)
+    # NOTE: JSON booleans are ints in Python
+    if not isinstance(expires_in, int) or isinstance(expires_in, bool) or not 0 < expires_in <= Config.FILE_MANAGER_SIGNED_URL_MAX_EXPIRES:
+        raise MyException.warning(
+            'Invalid expiry (at most {} seconds)'.format(Config.FILE_MANAGER_SIGNED_URL_MAX_EXPIRES), 400)
+    # NOTE: The URLs are signed by the key of a client, so one is needed even when auth is disabled
+    if g.client is None:
+        raise MyException.auth_not_found()
+    endpoint = '{}_file'.format(route)
+    query, expires = signed_query(g.client, endpoint, filename, prefix, method, expires_in)
+    data = {'query': query, 'expires': timestamp_to_iso(expires)}
+    if filename is not None:
+        data['url'] = '{}?{}'.format(url_for('files.{}'.format(endpoint), filename=filename), query)
+    return MyResponse.only_data(data, 200).to_response()
@@ -0,0 +1,65 @@
+# metrics.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains all the routes regarding REST-API metrics (Prometheus text format)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Routes table of contents
+# ==================================================================================================
+# Search the Routes based on the following patterns (comments)
+#
+# | Pattern             | URL      | Methods | Comments
+# |---------------------|----------|---------|------------------------
+# | --- (router 01) --- | /metrics | GET     | Return the metrics of all the worker processes
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+# NOTE: Add here the Build-in modules
+# Installed
+from flask import Blueprint, Response
+# Custom
+from app.utils import index, metrics
+from app.utils.scrub import scrub_progress
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+blueprint = Blueprint('metrics', __name__)
+
+
+# ==================================================================================================
+# Main
+# ==================================================================================================
+#
+# --- (router 01) ---
+@blueprint.route('/metrics', methods=['GET'])
+def read_metrics():
+    """This function returns the metrics of all the worker processes"""
+    totals = index.storage_totals()
+    progress, finished = scrub_progress()
+    gauges = {
+        'file_manager_storage_files': ('Number of stored files', totals['files']),
+        'file_manager_storage_bytes': ('Size of the stored files', totals['bytes']),
+        'file_manager_storage_stored_bytes': ('Size of the stored files on disk', totals['stored_bytes']),
+        'file_manager_scrub_progress_ratio': ('Progress of the current pass of the scrubber', progress),
+        'file_manager_scrub_last_pass_timestamp_seconds': (
+            'When the last pass of the scrubber finished', finished or 0),
+    }
+    return Response(metrics.exposition(gauges), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,118 @@
+# uploads.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains all the routes regarding resumable (chunked) uploads
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Routes table of contents
+# ==================================================================================================
+# Search the Routes based on the following patterns (comments)
+#
+# | Pattern             | URL                                      | Methods | Comments
+# |---------------------|------------------------------------------|---------|----------------------
+# | --- (router 01) --- | /storage/v1/uploads                      | POST    | Creates an upload session
+# | --- (router 02) --- | /storage/v1/uploads/<upload_id>          | PATCH   | Writes a chunk of an upload
+# | --- (router 03) --- | /storage/v1/uploads/<upload_id>          | GET     | Returns the received ranges of an upload
+# | --- (router 04) --- | /storage/v1/uploads/<upload_id>/finalize | POST    | Verifies and stores an upload
+# | --- (router 05) --- | /storage/v1/uploads/<upload_id>          | DELETE  | Aborts an upload
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+# NOTE: Add here the Build-in modules
+# Installed
+from flask import Blueprint, g, request
+from werkzeug.http import parse_content_range_header
+# Custom
+from app.utils.decorators import unique_filename, auth_required
+from app.utils.uploads import create_upload, write_chunk, upload_status, finalize_upload, abort_upload
+from app.responses import MyResponse, MyException
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+blueprint = Blueprint('uploads', __name__)
+
+
+# ==================================================================================================
+# Main
+# ==================================================================================================
+#
+# --- (router 01) ---
+@blueprint.route('/storage/v1/uploads', methods=['POST'])
+@auth_required
+@unique_filename
+def create_upload_session(unique_id: bool, expires: float):
+    """This function creates an upload session
+
+    The JSON body contains the 'filename', the 'size' (in bytes) and optionally the 'sha256' and
+    the 'type' (MIME type) of the file. The 'ttl' or 'expires_at' query arguments set when the
+    file expires, counted from the creation of the session.
+    """
+    logger.info('Request to create an upload')
+    body = request.get_json(silent=True) or {}
+    if 'filename' not in body or 'size' not in body:
+        raise MyException.missing_fields()
+    status = create_upload(
+        body['filename'], body['size'], body.get('sha256'), body.get('type'), bool(unique_id), g.client, expires)
+    return MyResponse.only_data(status, 201).to_response()
+
+
+# --- (router 02) ---
+@blueprint.route('/storage/v1/uploads/<upload_id>', methods=['PATCH'])
+@auth_required
+def write_upload_chunk(upload_id: str):
+    """This function writes the chunk given by the 'Content-Range' header (e.g. 'bytes 0-1023/*')"""
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes':
+        raise MyException.warning('Invalid Content-Range', 400)
+    status = write_chunk(
+        upload_id, content_range.start, content_range.stop, request.stream, content_range.length)
+    return MyResponse.only_data(status, 200).to_response()
+
+
+# --- (router 03) ---
+@blueprint.route('/storage/v1/uploads/<upload_id>', methods=['GET'])
+@auth_required
+def read_upload(upload_id: str):
+    """This function returns an upload session and the byte ranges received so far"""
+    return MyResponse.only_data(upload_status(upload_id), 200).to_response()
+
+
+# --- (router 04) ---
+@blueprint.route('/storage/v1/uploads/<upload_id>/finalize', methods=['POST'])
+@auth_required
+def finalize_upload_session(upload_id: str):
+    """This function verifies the SHA-256 of a complete upload and stores it"""
+    logger.info("Request to finalize upload: '{}'".format(upload_id))
+    body = request.get_json(silent=True) or {}
+    metadata = finalize_upload(upload_id, body.get('sha256'), g.client)
+    return MyResponse.only_data(metadata, 200).to_response()
+
+
+# --- (router 05) ---
+@blueprint.route('/storage/v1/uploads/<upload_id>', methods=['DELETE'])
+@auth_required
+def delete_upload_session(upload_id: str):
+    """This function aborts an upload"""
+    logger.info("Request to abort upload: '{}'".format(upload_id))
+    if abort_upload(upload_id):
+        return MyResponse.success("Upload '{}' deleted".format(upload_id), 200).to_response()
+    else:
+        raise MyException.warning("Upload '{}' not found".format(upload_id), 404)
@@ -0,0 +1,115 @@
+# server.py ----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the production server (pre-fork worker pool) of the flask app
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+# NOTE: Add here the Build-in modules
+# Installed
+from gunicorn.app.base import BaseApplication
+# Custom
+from app.config.settings import Config
+from app.utils import metrics
+from app.utils.general import replay_journal
+from app.utils.background import start_background, stop_background
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def server_options():
+    """This function returns the production server's options
+
+    Signals to the master process:
+        HUP  -> graceful restart of the workers (new ones are started before the old ones are
+                stopped). With 'preload_app' they are forked from the master, so they run the code
+                it loaded: new code is deployed with USR2 (a new master) and then QUIT to the old one
+        TERM -> graceful shutdown (workers drain their connections for 'FILE_MANAGER_GRACEFUL_TIMEOUT')
+        TTIN/TTOU -> increase/decrease the number of workers by one
+    """
+    return {
+        'bind': '0.0.0.0:{}'.format(int(Config.FILE_MANAGER_PORT)),
+        'workers': Config.FILE_MANAGER_WORKERS,
+        'worker_class': 'gthread',
+        'threads': Config.FILE_MANAGER_THREADS,
+        'keepalive': Config.FILE_MANAGER_KEEPALIVE,
+        'timeout': Config.FILE_MANAGER_TIMEOUT,
+        'graceful_timeout': Config.FILE_MANAGER_GRACEFUL_TIMEOUT,
+        'max_requests': Config.FILE_MANAGER_MAX_REQUESTS,
+        'max_requests_jitter': Config.FILE_MANAGER_MAX_REQUESTS // 10,
+        'backlog': Config.FILE_MANAGER_BACKLOG,
+        'preload_app': True,
+        # NOTE: Files are sent by the kernel ('FILE_MANAGER_ZERO_COPY')
+        'sendfile': True,
+        'errorlog': '-',
+        'child_exit': worker_exited,
+        'when_ready': server_ready,
+        'on_exit': server_exiting,
+    }
+
+
+def server_ready(server):
+    """This function starts the background process (scrubber, reaper, mover), before the workers are forked
+
+    The master itself runs no threads, so that no worker is forked while one of them holds a lock.
+    """
+    start_background()
+
+
+def server_exiting(server):
+    """This function stops the background process, once the workers have exited"""
+    stop_background()
+
+
+def worker_exited(server, worker):
+    """This function completes the changes of a worker that exited (e.g. crashed), in the master process
+
+    With 'preload_app' the app (and its journal replay) is created once in the master, not by the
+    workers that replace the crashed ones. The metrics of the worker are merged with those of the
+    workers that exited before it.
+    """
+    try:
+        replay_journal(worker.pid)
+    except Exception as e:
+        logger.exception(e)
+    try:
+        metrics.merge_process(worker.pid)
+    except Exception as e:
+        logger.exception(e)
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class ProductionServer(BaseApplication):
+    """Pre-fork server (gunicorn) that runs the flask app in a pool of threaded worker processes"""
+
+    def __init__(self, app, options=None):
+        self.application = app
+        self.options = options if options is not None else server_options()
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        return self.application
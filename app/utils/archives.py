@@ -0,0 +1,151 @@
+# archives.py --------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the funtions that stream many stored files as a single archive (zip, tar
+#    or tar.gz) built on the fly
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import time
+import zlib
+import tarfile
+import zipfile
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+from app.utils.general import file_chunks, is_compressed, open_file
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Supported formats and their MIME types
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+    'tar.gz': 'application/gzip',
+}
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class StreamBuffer(object):
+    """Write-only, non-seekable buffer that collects the bytes written by the archivers"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def zip_entry(archive, record):
+    """This function returns the zip entry of a file, compressed as the archive's files are (unless its format is)
+
+    'ZipFile.open' applies the archive's level only to the entries it creates itself (which carry
+    neither the time nor the mode of the file), so the level is copied to the entry: through the
+    public 'compress_level' since Python 3.13, the attribute that 'ZipFile.open' reads before it.
+    """
+    info = zipfile.ZipInfo(record['name'], time.gmtime(record['created'])[:6])
+    info.external_attr = 0o644 << 16
+    info.file_size = record['size']
+    if is_compressed(record['name']):
+        info.compress_type = zipfile.ZIP_STORED
+        return info
+    info.compress_type = archive.compression
+    if hasattr(zipfile.ZipInfo, 'compress_level'):
+        info.compress_level = archive.compresslevel
+    else:
+        info._compresslevel = archive.compresslevel
+    return info
+
+
+def stream_zip(records):
+    """This function yields a zip archive of the given files
+
+    Each entry is written as soon as it is read, so the first bytes are sent before the archive is
+    complete and memory is bounded by the chunk size. Files of already compressed formats are
+    stored as they are, the rest are deflated.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=Config.FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL, allowZip64=True) as archive:
+        for record in records:
+            with open_file(record) as file, archive.open(zip_entry(archive, record), 'w', force_zip64=True) as entry:
+                for chunk in file_chunks(file):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def stream_tar(records):
+    """This function yields a (ustar/pax) tar archive of the given files"""
+    for record in records:
+        info = tarfile.TarInfo(record['name'])
+        info.size = record['size']
+        info.mtime = int(record['created'])
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        with open_file(record) as file:
+            for chunk in file_chunks(file):
+                yield chunk
+        # Pad the entry to a whole block
+        yield tarfile.NUL * (-record['size'] % tarfile.BLOCKSIZE)
+    # End of archive marker (two empty blocks)
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def stream_gzip(stream):
+    """This function yields the gzip compression of a stream"""
+    compressor = zlib.compressobj(Config.FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    for chunk in stream:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_archive(records, archive_format):
+    """This function yields an archive of the given files in the given format"""
+    if archive_format == 'zip':
+        stream = stream_zip(records)
+    elif archive_format == 'tar':
+        stream = stream_tar(records)
+    else:
+        stream = stream_gzip(stream_tar(records))
+    for chunk in stream:
+        # NOTE: Skip the empty chunks, so the server does not flush the connection for nothing
+        if chunk:
+            yield chunk
@@ -0,0 +1,180 @@
+# background.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the background process of the service, which runs the scrubber, the
+#    reaper, the mover and the replay of the journal next to the server. They are kept out of the
+#    server's main process, since a pre-fork server (gunicorn's master) must not run threads: a
+#    worker forked while one of them holds a lock (e.g. of the logging or of the index) starts with
+#    that lock held forever. The process is a new interpreter, so it inherits neither the threads
+#    nor the sockets of the server, and its children (e.g. the processes of the scrubber) are its
+#    own. It is also the single writer of the log file: the server's processes send their records to
+#    it over a Unix socket, so the file is written and rotated by one process only.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import sys
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+from app.config.logs import file_handlers, serve_records, route_records, restore_records
+from app.utils.scrub import start_scrubber, stop_scrubber
+from app.utils.expiry import start_reaper, stop_reaper
+from app.utils.tiering import start_mover, stop_mover
+from app.utils.general import replay_journal
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Seconds between two checks that the server (the parent process) is still running
+PARENT_CHECK_SECONDS = 1
+# Seconds given to the background process to stop (after the file, blob or batch in progress)
+STOP_TIMEOUT_SECONDS = 30
+# Seconds given to the background process to start writing the log file
+WRITER_TIMEOUT_SECONDS = 5
+# The directory of the 'app' package, from which the background process imports it
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The background process of the service
+_background = {'process': None}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def background_enabled():
+    """This function returns whether any of the background loops is enabled"""
+    return (Config.FILE_MANAGER_SCRUB_INTERVAL > 0 or Config.FILE_MANAGER_EXPIRY_INTERVAL > 0
+            or Config.FILE_MANAGER_JOURNAL_INTERVAL > 0
+            or (bool(Config.FILE_MANAGER_COLD_DIR) and Config.FILE_MANAGER_TIER_INTERVAL > 0))
+
+
+def replay_crashed():
+    """This function completes the changes of the server's processes that crashed since the last replay
+
+    gunicorn's master replays those of a worker as soon as it exits, uvicorn's supervisor does not.
+    """
+    try:
+        replay_journal()
+    except Exception as e:
+        logger.exception(e)
+
+
+def writer_address(pid):
+    """This function returns the Unix socket of the writer of the log file of a server"""
+    return os.path.join(tempfile.gettempdir(), 'file-manager-log-{}.sock'.format(pid))
+
+
+def run_background(parent, address=None):
+    """This function runs the background loops until the process is terminated or its parent exits
+
+    TERM stops the loops, while INT is ignored (Ctrl-C reaches the whole process group and the
+    server stops this process itself). Given a Unix socket, it writes the log records sent to it.
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = serve_records(address) if address else None
+    start_scrubber()
+    start_reaper()
+    start_mover()
+    interval, replayed = Config.FILE_MANAGER_JOURNAL_INTERVAL, time.monotonic()
+    # NOTE: A server killed with SIGKILL cannot stop this process, so it exits when orphaned
+    while not stop.wait(PARENT_CHECK_SECONDS) and os.getppid() == parent:
+        if interval > 0 and time.monotonic() - replayed >= interval:
+            replay_crashed()
+            replayed = time.monotonic()
+    stop_mover()
+    stop_reaper()
+    stop_scrubber()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        os.remove(address)
+
+
+def wait_for_writer(process, address):
+    """This function waits for the background process to listen to its Unix socket, returns whether it does"""
+    deadline = time.monotonic() + WRITER_TIMEOUT_SECONDS
+    while not os.path.exists(address):
+        if process.poll() is not None or time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def start_background():
+    """This function starts the background process of the service, if any of its loops is enabled or
+    there is a log file to write
+
+    The records of the log file of this process (and of the processes it forks or starts after it)
+    are sent to the background process from then on.
+
+    NOTE: It is not a 'multiprocessing' process, since the workers that gunicorn forks would inherit
+          it as their own child and try to join it when they exit.
+    """
+    if _background['process'] is not None:
+        return
+    # NOTE: A server started by another one (e.g. gunicorn's master after USR2) has its own writer
+    restore_records()
+    writes_logs = bool(file_handlers())
+    if not (background_enabled() or writes_logs):
+        return
+    address = writer_address(os.getpid())
+    command = ('import sys; from app.utils.background import run_background; '
+               'run_background(int(sys.argv[1]), *sys.argv[2:])')
+    arguments = [str(os.getpid())] + ([address] if writes_logs else [])
+    environment = {name: value for name, value in os.environ.items() if name != 'FILE_MANAGER_LOG_SOCKET'}
+    process = subprocess.Popen([sys.executable, '-c', command] + arguments, cwd=ROOT_DIR, env=environment)
+    logger.info('Started the background process (pid: {})'.format(process.pid))
+    _background['process'] = process
+    if not writes_logs:
+        return
+    if not wait_for_writer(process, address):
+        logger.warning('The background process does not write the log file, each process writes it')
+        return
+    route_records(address)
+    # NOTE: For the workers that the server starts instead of forking (uvicorn's)
+    os.environ['FILE_MANAGER_LOG_SOCKET'] = address
+
+
+def stop_background():
+    """This function stops the background process of the service (killed after 'STOP_TIMEOUT_SECONDS')"""
+    process = _background['process']
+    if process is None:
+        return
+    _background['process'] = None
+    # NOTE: gunicorn's master may have reaped it already (it reaps any of its children), which
+    #       'wait' takes as an exit
+    process.terminate()
+    try:
+        process.wait(STOP_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        logger.warning('Killing the background process (pid: {})'.format(process.pid))
+        process.kill()
+        process.wait()
+    # NOTE: The records of the shutdown are written by this process again
+    restore_records()
+    os.environ.pop('FILE_MANAGER_LOG_SOCKET', None)
@@ -0,0 +1,426 @@
+# bench.py -----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the benchmark of the storage API. The app is served over HTTP (on the
+#    configured server: werkzeug, gunicorn or uvicorn) against a temporary files directory, or a
+#    running instance is given by its URL, and loaded with uploads and downloads of several file
+#    sizes, concurrency levels and batch sizes.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import signal
+import socket
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import http.client
+import multiprocessing
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+# Installed
+from werkzeug.serving import WSGIRequestHandler, make_server
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+SIZE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?B)$', re.IGNORECASE)
+# Block of random bytes the payloads are made of (each payload starts with a unique prefix, so the
+# blob store does not deduplicate them)
+BLOCK_SIZE = 1024 * 1024
+# Settings changed while the benchmark runs
+BENCH_SETTINGS = ('FILES_DIR', 'FILE_MANAGER_INDEX_PATH', 'FILE_MANAGER_METRICS_DIR')
+# Servers the app can be benchmarked on (see 'main.py')
+SERVERS = ('werkzeug', 'gunicorn', 'uvicorn')
+# Seconds to wait for a server to accept requests
+SERVER_START_TIMEOUT = 30
+# Result fields compared between two runs (higher is better)
+COMPARED_FIELDS = {'throughput_mib_s': True, 'requests_s': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False}
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler of the benchmark server without the access log"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def parse_size(text):
+    """This function returns the number of bytes of a size (e.g. '64KB', '1GB')"""
+    match = SIZE_PATTERN.match(text.strip())
+    if match is None:
+        raise ValueError("Invalid size '{}'".format(text))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_distribution(text):
+    """This function returns the (low, high) sizes of a distribution ('1MB' or '1KB-1MB')"""
+    low, _, high = text.partition('-')
+    return parse_size(low), parse_size(high or low)
+
+
+def sample_size(distribution, rng):
+    """This function returns a size of a distribution (log-uniform between its bounds)"""
+    low, high = distribution
+    if low == high:
+        return low
+    return int(math.exp(rng.uniform(math.log(low), math.log(high))))
+
+
+def percentile(values, fraction):
+    """This function returns a percentile (nearest rank) of the given values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def peak_rss():
+    """This function returns the peak resident memory of the process (in bytes)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def payload(size, block):
+    """This function yields the content of a benchmark file (a unique prefix and random blocks)"""
+    prefix = uuid.uuid4().bytes
+    yield prefix[:size]
+    remaining = size - len(prefix[:size])
+    while remaining > 0:
+        chunk = block[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+
+
+def multipart_body(files, block):
+    """This function returns the content type, the length and the (streamed) body of an upload"""
+    boundary = uuid.uuid4().hex
+    template = (
+        '--{}\r\nContent-Disposition: form-data; name="files[]"; filename="{}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n')
+    parts = [(template.format(boundary, name).encode(), size) for name, size in files]
+    trailer = '--{}--\r\n'.format(boundary).encode()
+    length = sum(len(header) + size + 2 for header, size in parts) + len(trailer)
+
+    def generate():
+        for header, size in parts:
+            yield header
+            for chunk in payload(size, block):
+                yield chunk
+            yield b'\r\n'
+        yield trailer
+
+    return 'multipart/form-data; boundary={}'.format(boundary), length, generate()
+
+
+def request(target, method, url, headers=None, body=None):
+    """This function sends a request to the target (a parsed URL) and returns its status, the bytes read and its latency"""
+    started = time.perf_counter()
+    connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(target.hostname, target.port, timeout=600)
+    try:
+        connection.request(method, target.path.rstrip('/') + url, body=body, headers=headers or {})
+        response = connection.getresponse()
+        received = 0
+        while True:
+            chunk = response.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+        return response.status, received, time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def summarize(operation, case, outcomes, elapsed, transferred):
+    """This function returns the result of a benchmark case"""
+    latencies = [latency for status, _, latency in outcomes if status < 400]
+    errors = sum(1 for status, _, _ in outcomes if status >= 400)
+    return {
+        'operation': operation,
+        **case,
+        'requests': len(outcomes),
+        'errors': errors,
+        'bytes': transferred,
+        'seconds': round(elapsed, 6),
+        'throughput_mib_s': round(transferred / elapsed / SIZE_UNITS['MB'], 3) if elapsed else None,
+        'requests_s': round(len(outcomes) / elapsed, 3) if elapsed else None,
+        **{'p{}_ms'.format(p): round(percentile(latencies, p / 100) * 1000, 3) if latencies else None
+           for p in (50, 95, 99)},
+        'peak_rss_bytes': peak_rss(),
+    }
+
+
+def run_case(target, headers, distribution, concurrency, batch, requests, block, rng, cleanup=False):
+    """This function uploads and then downloads the files of a benchmark case
+
+    The files are deleted afterwards (untimed) if 'cleanup' is set, e.g. on a running instance.
+    """
+    case = {'size': distribution, 'concurrency': concurrency, 'batch': batch}
+    prefix = uuid.uuid4().hex[:8]
+    uploads = [
+        [('bench-{}-{}-{}.bin'.format(prefix, i, j), sample_size(parse_distribution(distribution), rng))
+         for j in range(batch)]
+        for i in range(requests)]
+
+    def upload(files):
+        content_type, length, body = multipart_body(files, block)
+        return request(target, 'POST', '/storage/v1/file?unique_id=false',
+                       {**headers, 'Content-Type': content_type, 'Content-Length': str(length)}, body)
+
+    def download(name):
+        return request(target, 'GET', '/storage/v1/file/{}'.format(name), headers)
+
+    def delete(name):
+        return request(target, 'DELETE', '/storage/v1/file/{}'.format(name), headers)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        outcomes = list(executor.map(upload, uploads))
+        elapsed = time.perf_counter() - started
+        uploaded = sum(size for files in uploads for _, size in files)
+        results.append(summarize('upload', case, outcomes, elapsed, uploaded))
+        names = [name for files in uploads for name, _ in files]
+        started = time.perf_counter()
+        outcomes = list(executor.map(download, names))
+        elapsed = time.perf_counter() - started
+        results.append(summarize('download', case, outcomes, elapsed, sum(r for _, r, _ in outcomes)))
+        if cleanup:
+            list(executor.map(delete, names))
+    return results
+
+
+def git_revision():
+    """This function returns the git revision of the project (if any)"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Config.PROJECT_ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def listening_socket():
+    """This function returns a socket listening on a free local port (shared by the server's workers)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(Config.FILE_MANAGER_BACKLOG)
+    return sock
+
+
+def serve_gunicorn(sock):
+    """This function serves the app on gunicorn, with the options of 'app/server.py' (in a child process)"""
+    from app.app import create_app
+    from app.server import ProductionServer, server_options
+    options = server_options()
+    options['bind'] = 'fd://{}'.format(sock.fileno())
+    ProductionServer(create_app(), options).run()
+
+
+def serve_uvicorn(sock):
+    """This function serves the ASGI app on uvicorn (in each of the child processes)"""
+    import uvicorn
+    from app.asgi import create_asgi_app
+    server = uvicorn.Server(uvicorn.Config(
+        create_asgi_app(), timeout_keep_alive=Config.FILE_MANAGER_KEEPALIVE, log_config=None, log_level='warning'))
+    server.run(sockets=[sock])
+
+
+def start_server(name):
+    """This function serves the app on a server, returns its URL and a function that stops it
+
+    gunicorn and uvicorn run in forked processes ('FILE_MANAGER_WORKERS' of them), so they serve
+    the temporary files directory set by the benchmark.
+    """
+    # NOTE: Imported here, since the app module imports this package
+    from app.app import create_app
+    if name == 'werkzeug':
+        server = make_server('127.0.0.1', 0, create_app(), threaded=True, request_handler=QuietRequestHandler)
+        thread = threading.Thread(target=server.serve_forever, name='bench-server', daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+
+        return 'http://127.0.0.1:{}'.format(server.server_port), stop
+    sock = listening_socket()
+    context = multiprocessing.get_context('fork')
+    if name == 'gunicorn':
+        processes = [context.Process(target=serve_gunicorn, args=(sock,), name='bench-gunicorn')]
+    else:
+        processes = [
+            context.Process(target=serve_uvicorn, args=(sock,), name='bench-uvicorn-{}'.format(i))
+            for i in range(max(1, Config.FILE_MANAGER_WORKERS))]
+    for process in processes:
+        process.start()
+    url = 'http://127.0.0.1:{}'.format(sock.getsockname()[1])
+    sock.close()
+
+    def stop():
+        for process in processes:
+            os.kill(process.pid, signal.SIGTERM)
+        for process in processes:
+            process.join()
+
+    try:
+        wait_for_server(urllib.parse.urlsplit(url), processes)
+    except BaseException:
+        stop()
+        raise
+    return url, stop
+
+
+def wait_for_server(target, processes):
+    """This function waits until a server answers its alive route"""
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            if request(target, 'GET', '/')[0] < 500:
+                return
+        except OSError:
+            pass
+        if time.monotonic() > deadline or not all(process.is_alive() for process in processes):
+            raise RuntimeError('The benchmark server did not start')
+        time.sleep(0.1)
+
+
+def run_bench(distributions, concurrencies, batches, requests, seed=0, progress=None, server=None, url=None):
+    """This function runs every combination of the benchmark cases and returns the report
+
+    The app is served on the 'server' ('FILE_MANAGER_SERVER' by default) against a temporary files
+    directory (and index and metrics), which is deleted afterwards. Given a 'url', the running
+    instance there is benchmarked instead (its uploaded files are deleted after each case). The
+    peak RSS of a case is the high-water mark of this process so far (the clients and, on
+    werkzeug, the server), so run the largest sizes last (or alone) to attribute it.
+    """
+    from app.utils.cache import file_cache
+    server = server or Config.FILE_MANAGER_SERVER
+    if url is None and server not in SERVERS:
+        raise ValueError("Unknown server '{}'".format(server))
+    saved = {name: getattr(Config, name) for name in BENCH_SETTINGS}
+    rng = random.Random(seed)
+    block = random.Random(seed).randbytes(BLOCK_SIZE)
+    headers = {Config.FILE_MANAGER_API_KEY_HEADER: Config.FILE_MANAGER_API_KEY} if Config.FILE_MANAGER_API_KEY else {}
+    results = []
+    with tempfile.TemporaryDirectory(prefix='file-manager-bench-') as directory:
+        stop = None
+        try:
+            if url is None:
+                Config.FILES_DIR = os.path.join(directory, 'files')
+                Config.FILE_MANAGER_INDEX_PATH = None
+                Config.FILE_MANAGER_METRICS_DIR = os.path.join(directory, 'metrics')
+                os.makedirs(Config.FILES_DIR)
+                file_cache.clear()
+                url, stop = start_server(server)
+            else:
+                server = url
+            target = urllib.parse.urlsplit(url)
+            for distribution in distributions:
+                for concurrency in concurrencies:
+                    for batch in batches:
+                        case = run_case(target, headers, distribution, concurrency, batch,
+                                        requests, block, rng, cleanup=stop is None)
+                        results += case
+                        if progress is not None:
+                            for result in case:
+                                progress(result)
+        finally:
+            if stop is not None:
+                stop()
+            for name, value in saved.items():
+                setattr(Config, name, value)
+            file_cache.clear()
+    return {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {
+            'requests': requests, 'seed': seed,
+            'server': server,
+            'workers': Config.FILE_MANAGER_WORKERS if server in ('gunicorn', 'uvicorn') else None,
+            'threads': Config.FILE_MANAGER_THREADS if server == 'gunicorn' else None,
+            'chunk_size': Config.FILE_MANAGER_CHUNK_SIZE,
+            'compression': Config.FILE_MANAGER_COMPRESSION,
+            'read_cache_max_bytes': Config.FILE_MANAGER_READ_CACHE_MAX_BYTES,
+            'authentication': bool(headers),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """This function returns the relative change of each result against a baseline run
+
+    A positive change is an improvement (higher throughput, lower latency).
+    """
+    key = lambda result: (result['operation'], result['size'], result['concurrency'], result['batch'])
+    previous = {key(result): result for result in baseline['results']}
+    changes = []
+    for result in report['results']:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        change = {}
+        for field, higher_is_better in COMPARED_FIELDS.items():
+            if result.get(field) and before.get(field):
+                ratio = result[field] / before[field] - 1
+                change[field] = round(100 * (ratio if higher_is_better else -ratio), 1)
+        changes.append({'operation': result['operation'], 'size': result['size'],
+                        'concurrency': result['concurrency'], 'batch': result['batch'], 'change_pct': change})
+    return changes
+
+
+def format_result(result):
+    """This function returns a result as a single line"""
+    return '{:<8} size={:<10} concurrency={:<4} batch={:<4} {:>10} MiB/s {:>9} req/s p50={} p95={} p99={} ms errors={}'.format(
+        result['operation'], result['size'], result['concurrency'], result['batch'],
+        result['throughput_mib_s'], result['requests_s'], result['p50_ms'], result['p95_ms'],
+        result['p99_ms'], result['errors'])
+
+
+def write_report(report, location):
+    """This function writes a report as JSON"""
+    with open(location, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -0,0 +1,113 @@
+# cache.py -----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the in-memory (per process) read cache of the small stored files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import threading
+from collections import OrderedDict
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class FileCache(object):
+    """LRU cache of file contents with a total byte budget
+
+    Entries are keyed by filename and tagged with the hash of their content. A lookup must give the
+    hash of the file (from the metadata index), so an entry is never served after the file has been
+    overwritten, even by another process.
+    """
+
+    def __init__(self, max_bytes, max_file_size):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def cacheable(self, size):
+        return self.enabled and size <= min(self.max_file_size, self.max_bytes)
+
+    def get(self, filename, digest):
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[0] != digest:
+                if entry is not None:
+                    self._remove(filename)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(filename)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, filename, digest, data):
+        if not self.cacheable(len(data)):
+            return
+        with self.lock:
+            if filename in self.entries:
+                self._remove(filename)
+            self.entries[filename] = (digest, data)
+            self.size += len(data)
+            # Evict the least recently used entries until the cache fits its budget
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        with self.lock:
+            if filename in self.entries:
+                self._remove(filename)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'files': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, filename):
+        _, data = self.entries.pop(filename)
+        self.size -= len(data)
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+file_cache = FileCache(Config.FILE_MANAGER_READ_CACHE_MAX_BYTES, Config.FILE_MANAGER_READ_CACHE_MAX_FILE_SIZE)
@@ -0,0 +1,102 @@
+# compression.py -----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the funtions of the at-rest compression of the stored files (gzip, or
+#    zstd when the 'zstandard' package is installed)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import gzip
+import zlib
+# Installed
+try:
+    import zstandard
+except ImportError:  # NOTE: Optional, only needed for 'FILE_MANAGER_COMPRESSION=zstd'
+    zstandard = None
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Supported encodings (as in the 'Content-Encoding' header) and the suffix of their blobs
+ENCODINGS = {'gzip': '.gz', 'zstd': '.zst'}
+# Default compression level of each encoding
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+# Magic numbers (offset, bytes) of the formats that are already compressed
+MAGIC_NUMBERS = (
+    (0, b'\x1f\x8b'),                   # gzip
+    (0, b'\x28\xb5\x2f\xfd'),           # zstd
+    (0, b'PK\x03\x04'),                 # zip (and docx, xlsx, jar, apk, etc.)
+    (0, b'BZh'),                        # bzip2
+    (0, b'\xfd7zXZ\x00'),               # xz
+    (0, b'7z\xbc\xaf\x27\x1c'),         # 7z
+    (0, b'Rar!\x1a\x07'),               # rar
+    (0, b'\x04\x22\x4d\x18'),           # lz4
+    (0, b'\x89PNG\r\n\x1a\n'),          # png
+    (0, b'\xff\xd8\xff'),               # jpeg
+    (0, b'GIF8'),                       # gif
+    (8, b'WEBP'),                       # webp
+    (4, b'ftyp'),                       # mp4, mov, heic
+    (0, b'OggS'),                       # ogg
+    (0, b'fLaC'),                       # flac
+    (0, b'\x1a\x45\xdf\xa3'),           # mkv, webm
+)
+# Whether the missing 'zstandard' package was reported (per process)
+_zstd_missing = {'logged': False}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def configured_encoding():
+    """This function returns the encoding used to store new files (or None if disabled)"""
+    encoding = Config.FILE_MANAGER_COMPRESSION
+    if encoding not in ENCODINGS:
+        return None
+    if encoding == 'zstd' and zstandard is None:
+        if not _zstd_missing['logged']:
+            logger.warning("Compression 'zstd' requires the 'zstandard' package, falling back to 'gzip'")
+            _zstd_missing['logged'] = True
+        return 'gzip'
+    return encoding
+
+
+def has_compressed_magic(chunk):
+    """This function checks if the first bytes of a file belong to an already compressed format"""
+    return any(chunk[offset:offset + len(magic)] == magic for offset, magic in MAGIC_NUMBERS)
+
+
+def compressor(encoding):
+    """This function returns a streaming compressor (with 'compress' and 'flush')"""
+    level = Config.FILE_MANAGER_COMPRESSION_LEVEL or DEFAULT_LEVELS[encoding]
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def open_encoded(file, encoding):
+    """This function opens a compressed blob (a binary file object) as a stream of its content"""
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(file, closefd=True)
+    reader = gzip.GzipFile(fileobj=file, mode='rb')
+    # NOTE: 'GzipFile' closes its 'myfileobj' when it is closed (as 'gzip.open' does with a path)
+    reader.myfileobj = file
+    return reader
@@ -21,10 +21,14 @@ logger = logging.getLogger(__name__)
 # Build-in
 from functools import wraps
 # Installed
-from flask import request
+from flask import g, request
 # Custom
 from app.config.settings import Config
 from app.responses import MyException
+from app.utils.general import file_expiry
+from app.utils.limits import admit, identify
+from app.utils.multipart import receive_files
+from app.utils.signing import SIGNATURE_ARG, verify
 
 
 # ==================================================================================================
@@ -33,47 +37,54 @@ from app.responses import MyException
 #
 def should_be_authenticated():
     """This function checks if request must be authenticated"""
-    if Config.FILE_MANAGER_API_KEY is None:
+    if Config.FILE_MANAGER_API_KEY is None and not Config.FILE_MANAGER_API_KEYS:
         return False
     return True
 
 
-def should_be_authenticated_for_incoming():
+def should_be_authenticated_for_incoming(method):
     """This function checks if request must be authenticated for incoming requests"""
     # NOTE: Incoming requests consider in this case all but GET method
-    if request.method == 'GET':
+    if method == 'GET':
         return False
     if Config.FILE_MANAGER_AUTH_INCOMING:
         return True
     return False
 
 
-def should_be_authenticated_for_outgoing():
+def should_be_authenticated_for_outgoing(method):
     """This function checks if request must be authenticated for outgoing requests"""
     # NOTE: Outgoing requests consider in this case only GET method
-    if request.method != 'GET':
+    if method != 'GET':
         return False
-    if Config.FILE_MANAGER_AUTH_OUTGOING and request.method == 'GET':
+    if Config.FILE_MANAGER_AUTH_OUTGOING and method == 'GET':
         return True
     return False
 
 
-def authenticated():
-    """This function checks if a user is authenticated"""
+def authenticated(method=None, headers=None):
+    """This function checks if a user is authenticated and returns its client (see 'app/utils/limits.py')
+
+    The method and the headers are those of the flask request, unless given (e.g. by the ASGI app).
+    The client is None for the requests without a (valid) API key that need no authentication.
+    """
+    method = request.method if method is None else method
+    headers = request.headers if headers is None else headers
+    # Get Authorization (the client is identified even when the method needs no authentication)
+    authorization = headers.get(Config.FILE_MANAGER_API_KEY_HEADER)
+    client = identify(authorization)
     # Check if Auth is enabled
     if not should_be_authenticated():
-        return True
-    if not should_be_authenticated_for_incoming() and not should_be_authenticated_for_outgoing():
-        return True
+        return client
+    if not should_be_authenticated_for_incoming(method) and not should_be_authenticated_for_outgoing(method):
+        return client
     # Check if Authorization exist in request's header
-    if Config.FILE_MANAGER_API_KEY_HEADER not in request.headers:
+    if authorization is None:
         raise MyException.auth_not_found()
-    # Get Authorization
-    authorization = request.headers[Config.FILE_MANAGER_API_KEY_HEADER]
     # Check Authorization type
-    if Config.FILE_MANAGER_API_KEY != authorization:
+    if client is None:
         raise MyException.unauthorized()
-    return True
+    return client
 
 
 # ==================================================================================================
@@ -81,30 +92,52 @@ def authenticated():
 # ==================================================================================================
 #
 def files_required(f):
-    """This function extracts the files"""
+    """This function extracts the files
+
+    They are written to the files directory while the body is received (see
+    'app/utils/multipart.py') and their temporary files are removed once the request is handled.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
-        files = request.files.getlist('files[]')
-        files = [f for f in files if f.filename != '']
-        if len(files) == 0:
-            raise MyException.error('No files are given', 500)
-        return f(files, *args, **kwargs)
+        received = receive_files(request.stream, request.content_type, request.content_length)
+        try:
+            files = [f for f in received if f.filename != '']
+            if len(files) == 0:
+                raise MyException.error('No files are given', 500)
+            return f(files, *args, **kwargs)
+        finally:
+            for file in received:
+                file.close()
     return decorated
 
 
 def unique_filename(f):
-    """This function checks if a unique filename must be used"""
+    """This function checks if a unique filename must be used and when the file expires
+
+    The expiry is given by the 'ttl' (seconds) or the 'expires_at' (POSIX or ISO 8601) query
+    arguments, None when the file never expires.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
         unique_id = request.args.get('unique_id', type=lambda v: v.lower() == 'true')
-        return f(unique_id, *args, **kwargs)
+        expires = file_expiry(request.args.get('ttl'), request.args.get('expires_at'))
+        return f(unique_id, expires, *args, **kwargs)
     return decorated
 
 
 def auth_required(f):
-    """This function extracts the authorization for the request and validates it"""
+    """This function extracts the authorization for the request, validates it and checks the limits of its client
+
+    It must run before the body is read (i.e. be the outermost decorator after the route), so the
+    requests over a limit are refused at once. A request with a signed URL (see
+    'app/utils/signing.py') is authorized by its signature, as the client that issued it.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
-        is_eligible = authenticated()
+        if SIGNATURE_ARG in request.args:
+            g.client = verify(request.args, request.endpoint.rpartition('.')[2], request.method, kwargs.get('filename'))
+        else:
+            g.client = authenticated()
+        admit(g.client, request.method, request.content_length)
         return f(*args, **kwargs)
     return decorated
@@ -0,0 +1,115 @@
+# expiry.py ----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the reaper of the files that expire (stored with a 'ttl' or an
+#    'expires_at'). An expired file is served as missing at once, while its deletion is left to the
+#    reaper, which reads the due files from a partial index of the expiring files (in expiry order,
+#    so without a scan) and deletes them in batches. It runs with 'flask expire-files' or, every
+#    'FILE_MANAGER_EXPIRY_INTERVAL' seconds, inside the service.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import time
+import fcntl
+import threading
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+from app.utils import index, metrics
+from app.utils.general import remove_file
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Expired files read from the index at a time
+EXPIRY_BATCH_SIZE = 500
+# Lock file held by the process running the reaper of the service (one per files directory)
+LOCK_FILENAME = '.expiry.lock'
+# The reaper thread of the service
+_reaper = {'thread': None, 'stop': threading.Event()}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def expire_files(limit=None, stop=None):
+    """This function deletes the files that expired, returns their number
+
+    The files due by the start of the call are deleted in batches of 'EXPIRY_BATCH_SIZE', soonest
+    first. At most 'limit' files are deleted and it stops early when the 'stop' event is set. A
+    file overwritten meanwhile (without an expiry or with a later one) is kept.
+    """
+    timestamp = time.time()
+    deleted = 0
+    while stop is None or not stop.is_set():
+        size = EXPIRY_BATCH_SIZE if limit is None else min(EXPIRY_BATCH_SIZE, limit - deleted)
+        due = index.due(timestamp, size) if size > 0 else []
+        if not due:
+            break
+        for name, _ in due:
+            if remove_file(name, expired_by=timestamp):
+                deleted += 1
+                metrics.inc('file_manager_expired_files_total')
+    if deleted:
+        logger.info('Deleted {} expired files'.format(deleted))
+    return deleted
+
+
+def run_reaper(stop):
+    """This function deletes the expired files every 'FILE_MANAGER_EXPIRY_INTERVAL' seconds
+
+    Only one process per files directory reaps (the one holding the lock file), the rest wait for
+    it to exit.
+    """
+    with open(os.path.join(Config.FILES_DIR, LOCK_FILENAME), 'a') as lock:
+        while not stop.is_set():
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                stop.wait(Config.FILE_MANAGER_EXPIRY_INTERVAL)
+        while not stop.is_set():
+            try:
+                expire_files(stop=stop)
+            except Exception as e:
+                logger.exception(e)
+            stop.wait(Config.FILE_MANAGER_EXPIRY_INTERVAL)
+
+
+def start_reaper():
+    """This function starts the reaper of the service (a daemon thread), if enabled"""
+    if Config.FILE_MANAGER_EXPIRY_INTERVAL <= 0 or _reaper['thread'] is not None:
+        return
+    logger.info('Starting the reaper of the expired files (every {} seconds)'.format(
+        Config.FILE_MANAGER_EXPIRY_INTERVAL))
+    _reaper['stop'].clear()
+    _reaper['thread'] = threading.Thread(target=run_reaper, args=(_reaper['stop'],), name='reaper', daemon=True)
+    _reaper['thread'].start()
+
+
+def stop_reaper():
+    """This function stops the reaper of the service (after the file being deleted)"""
+    if _reaper['thread'] is None:
+        return
+    _reaper['stop'].set()
+    _reaper['thread'].join()
+    _reaper['thread'] = None
@@ -19,14 +19,136 @@ logger = logging.getLogger(__name__)
 # Imports
 # ==================================================================================================
 # Build-in
+import io
 import os
+import re
+import json
+import base64
 import hashlib
 import datetime
+import functools
+import itertools
+import mimetypes
+import tempfile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 # Installed
 from werkzeug.utils import secure_filename
 # Custom
 from app.config.settings import Config
 from app.responses import MyException
+from app.utils import index, journal, metrics
+from app.utils.limits import check_quota
+from app.utils.cache import file_cache
+from app.utils.compression import ENCODINGS, compressor, configured_encoding, has_compressed_magic
+from app.utils.compression import open_encoded
+from app.utils.storage import BLOBS_DIRNAME, storage
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# NOTE: The blobs of the content-addressed store are kept by the storage driver, keyed by their
+#       hash prefix (e.g. 'ab/cd/abcdef...')
+# Filenames generated by 'unique_filename' (hash, optional timestamp and extension)
+UNIQUE_FILENAME_PATTERN = re.compile(r'^([0-9a-f]{64})(?:_\d{8}T\d{6})?\.')
+# Extensions of the formats that are already compressed (compressing them again gains nothing)
+COMPRESSED_EXTENSIONS = {
+    '7z', 'apk', 'avi', 'br', 'bz2', 'docx', 'flac', 'gif', 'gz', 'heic', 'jar', 'jpeg', 'jpg',
+    'lz4', 'lzma', 'm4a', 'mkv', 'mov', 'mp3', 'mp4', 'odt', 'ogg', 'png', 'pptx', 'rar', 'tgz',
+    'webm', 'webp', 'whl', 'xlsx', 'xz', 'zip', 'zst',
+}
+# Number of attempts to store a file when its blob is released by a concurrent request
+STORE_ATTEMPTS = 3
+# Thread pool of the batch uploads (created on first use by each process)
+_batch_executor = {'pid': None, 'executor': None}
+_batch_executor_lock = threading.Lock()
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class BlobWriter(object):
+    """Writes the content of a file to a temporary file inside the files directory, as it arrives
+
+    The SHA-256 and the byte counter are fed while the content is written to disk, compressed when
+    'FILE_MANAGER_COMPRESSION' is set (judged by the first 'FILE_MANAGER_CHUNK_SIZE' bytes, which
+    are held until then). The hash and the size are always those of the uncompressed content. A
+    file larger than 'max_size' bytes is refused (413) as soon as the excess arrives.
+    """
+
+    def __init__(self, filename='', max_size=None):
+        self.filename = filename
+        self.max_size = max_size
+        self.sha256 = hashlib.sha256()
+        self.size, self.stored_size = 0, 0
+        self.first = bytearray()
+        self.encoding, self.encoder = None, None
+        # Time spent hashing, compressing and writing
+        self.timings = [0.0, 0.0, 0.0]
+        fd, self.tmp_location = tempfile.mkstemp(prefix='.tmp-', dir=Config.FILES_DIR)
+        self.tmp = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        """Writes a chunk of the content"""
+        if self.max_size and self.size + len(data) > self.max_size:
+            raise MyException.payload_too_large('file', self.max_size)
+        started = time.perf_counter()
+        self.sha256.update(data)
+        self.size += len(data)
+        self.timings[0] += time.perf_counter() - started
+        if self.first is None:
+            return self.store(data)
+        self.first += data
+        if len(self.first) >= Config.FILE_MANAGER_CHUNK_SIZE:
+            self.start()
+
+    def start(self):
+        """Chooses the encoding by the first chunk and writes it"""
+        first, self.first = bytes(self.first), None
+        self.encoding = compression_encoding(self.filename, first)
+        self.encoder = compressor(self.encoding) if self.encoding else None
+        self.store(first)
+
+    def store(self, data):
+        """Writes a chunk to disk (compressed)"""
+        started = time.perf_counter()
+        data = self.encoder.compress(data) if self.encoder else data
+        compressed = time.perf_counter()
+        self.tmp.write(data)
+        self.stored_size += len(data)
+        self.timings[1] += compressed - started
+        self.timings[2] += time.perf_counter() - compressed
+
+    def finish(self):
+        """Flushes the temporary file to disk, returns the hash, size, path and encoding of the content"""
+        if self.first is not None:
+            self.start()
+        if self.encoder:
+            data = self.encoder.flush()
+            self.tmp.write(data)
+            self.stored_size += len(data)
+        if Config.FILE_MANAGER_FSYNC:
+            self.tmp.flush()
+            os.fsync(self.tmp.fileno())
+        self.tmp.close()
+        os.chmod(self.tmp_location, 0o644)
+        metrics.record_io('hash', self.timings[0], self.size)
+        if self.encoder:
+            metrics.record_io('compress', self.timings[1], self.size)
+        metrics.record_io('write', self.timings[2], self.stored_size)
+        return self.sha256.hexdigest(), self.size, self.tmp_location, self.encoding
+
+    def abort(self):
+        """Removes the temporary file"""
+        self.tmp.close()
+        try:
+            os.remove(self.tmp_location)
+        except FileNotFoundError:
+            pass
 
 
 # ==================================================================================================
@@ -38,6 +160,55 @@ def now():
     return datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
 
 
+def timestamp_to_iso(timestamp):
+    """This function returns a POSIX timestamp as an ISO 8601 (UTC) string"""
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_timestamp(value):
+    """This function returns a POSIX timestamp from a POSIX or an ISO 8601 (UTC) string"""
+    try:
+        return float(value)
+    except ValueError:
+        timestamp = datetime.datetime.fromisoformat(value.rstrip('Z'))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        return timestamp.timestamp()
+
+
+def file_expiry(ttl=None, expires_at=None):
+    """This function returns when a file expires, given its 'ttl' (seconds) or its 'expires_at'
+
+    The 'expires_at' is a POSIX or an ISO 8601 (UTC) timestamp. Returns None when neither is given
+    (the file never expires) and raises 400 when both are given or the time is not in the future.
+    """
+    if ttl is None and expires_at is None:
+        return None
+    if ttl is not None and expires_at is not None:
+        raise MyException.warning("Give either 'ttl' or 'expires_at'", 400)
+    timestamp = time.time()
+    try:
+        expires = timestamp + float(ttl) if ttl is not None else parse_timestamp(expires_at)
+    except (ValueError, OverflowError):
+        expires = None
+    if expires is None or not timestamp < expires < float('inf'):
+        raise MyException.warning('Invalid expiry (it must be in the future)', 400)
+    return expires
+
+
+def encode_cursor(values):
+    """This function returns an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """This function returns the values of a pagination cursor"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise MyException.warning('Invalid cursor', 400)
+
+
 def file_extension(filename: str):
     """This function returns a file's extension"""
     try:
@@ -71,19 +242,46 @@ def file_to_blob(file):
     return blob
 
 
+def file_chunks(file, chunk_size=None):
+    """This function yields the file's content in fixed-size chunks"""
+    chunk_size = chunk_size or Config.FILE_MANAGER_CHUNK_SIZE
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
 def file_size(file):
     """This function returns the file's size"""
-    return len(file_to_blob(file))
+    size = sum(len(chunk) for chunk in file_chunks(file))
+    file.seek(0)  # Reset the file pointer to the beginning
+    return size
 
 
 def file_hash(file):
     """This function returns a hash calculated using the file content"""
-    return hashlib.sha256(file_to_blob(file)).hexdigest()
+    sha256 = hashlib.sha256()
+    size, started = 0, time.perf_counter()
+    for chunk in file_chunks(file):
+        sha256.update(chunk)
+        size += len(chunk)
+    metrics.record_io('hash', time.perf_counter() - started, size)
+    file.seek(0)  # Reset the file pointer to the beginning
+    return sha256.hexdigest()
 
 
-def unique_filename(file, timestamp=False):
+def unique_filename(file, timestamp=False, digest=None):
     """This function returns a unique filename"""
-    return "{}{}.{}".format(file_hash(file), '_' + now() if timestamp else '', file_extension(file.filename))
+    digest = digest if digest is not None else file_hash(file)
+    return "{}{}.{}".format(digest, '_' + now() if timestamp else '', file_extension(file.filename))
+
+
+def file_type(filename, content_type=None):
+    """This function returns the file's MIME type"""
+    if content_type and content_type != 'application/octet-stream':
+        return content_type
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
 
 
 def filepath(filename):
@@ -91,44 +289,398 @@ def filepath(filename):
     return os.path.join(Config.FILES_DIR, filename)
 
 
-def file_metadata(file, basename=None):
+def blob_key(digest, encoding=None):
+    """This function returns the key of a blob in the content-addressed store"""
+    return '{}/{}/{}{}'.format(digest[:2], digest[2:4], digest, ENCODINGS.get(encoding, ''))
+
+
+def blobpath(digest, encoding=None):
+    """This function returns the local path of a blob (None if the driver is not local)"""
+    return storage().path(blob_key(digest, encoding))
+
+
+def find_blob(digest):
+    """This function returns the key and the encoding of an existing blob (if any)"""
+    driver = storage()
+    for encoding in (None, *ENCODINGS):
+        key = blob_key(digest, encoding)
+        if driver.stat(key) is not None:
+            return key, encoding
+    return None, None
+
+
+def filename_hash(filename):
+    """This function returns the hash embedded in a unique filename (if any)"""
+    match = UNIQUE_FILENAME_PATTERN.match(filename)
+    return match.group(1) if match else None
+
+
+def is_compressed(filename):
+    """This function checks if a file's extension belongs to an already compressed format"""
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in COMPRESSED_EXTENSIONS
+
+
+def compression_encoding(filename, chunk):
+    """This function returns the encoding to store a file with, judged by its first chunk"""
+    encoding = configured_encoding()
+    if encoding is None or is_compressed(filename) or has_compressed_magic(chunk):
+        return None
+    # NOTE: A first chunk shorter than the minimum is the whole file
+    if len(chunk) < Config.FILE_MANAGER_COMPRESSION_MIN_SIZE:
+        return None
+    return encoding
+
+
+def open_file(record):
+    """This function opens the (decompressed) content of an indexed file for reading"""
+    # NOTE: Blobs are immutable, so the content stays consistent even if the file is overwritten
+    file = storage().get(blob_key(record['hash'], record['encoding']))
+    return open_encoded(file, record['encoding']) if record['encoding'] else file
+
+
+def read_file_content(record):
+    """This function returns the content of a small indexed file, using the read cache"""
+    data = file_cache.get(record['name'], record['hash'])
+    if data is None:
+        started = time.perf_counter()
+        with open_file(record) as file:
+            data = file.read()
+        metrics.record_io('read', time.perf_counter() - started, len(data))
+        file_cache.put(record['name'], record['hash'], data)
+    return data
+
+
+def file_metadata(file, basename=None, size=None, version=None, expires=None):
     """This function returns the file's metadata"""
     try:
         return {
             'name': file.filename,
             'type': file.content_type,
-            'size': file_size(file),
+            'size': size if size is not None else file_size(file),
             **({'filename': basename} if basename is not None else {}),
+            **({'version': version} if version is not None else {}),
+            **({'expires': timestamp_to_iso(expires)} if expires is not None else {}),
         }
     except:
         return None
 
 
-def store_file(file, unique_id=True):
-    """This function stores a file to filesystem"""
-    # Generate filename using file hash and timestamp
-    filename = unique_filename(file) if unique_id else check_filename(file)
-    metadata = file_metadata(file, filename)
-    # Write file to filesystem
-    file.save(filepath(filename))
+def ingest_file(file):
+    """This function streams a file to a temporary file inside the files directory
+
+    The upload is read once, in chunks of 'FILE_MANAGER_CHUNK_SIZE' bytes, and written by a
+    'BlobWriter'. Returns the hash, the size, the path of the temporary file (which the caller must
+    either rename or remove) and its encoding.
+    """
+    writer = BlobWriter(getattr(file, 'filename', None) or '')
+    try:
+        for chunk in file_chunks(file):
+            writer.write(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def commit_blob(tmp_location, digest, encoding=None, remove=True):
+    """This function moves a temporary file into the content-addressed store
+
+    When the content is already stored (with any encoding) the existing blob is kept. The temporary
+    file is removed, unless 'remove' is False (its owner removes it). Returns the key and the
+    encoding of the blob.
+    """
+    try:
+        key, existing = find_blob(digest)
+        if key is not None:
+            logger.debug("Blob '{}' already exists".format(digest))
+            return key, existing
+        key = blob_key(digest, encoding)
+        storage().put(key, tmp_location)
+        return key, encoding
+    finally:
+        if remove:
+            os.remove(tmp_location)
+
+
+def store_blob(file):
+    """This function stores a file's content to the content-addressed store
+
+    Uploads that are already held in memory are hashed first, so the disk write is skipped when
+    the blob already exists. Any other upload is streamed once to a temporary file. Returns the
+    hash, the size, the key and the encoding of the blob.
+    """
+    # NOTE: Uploads parsed by 'app/utils/multipart.py' are already hashed and written to disk
+    ingested = getattr(file, 'ingested', None)
+    if ingested is not None:
+        digest, size, tmp_location, encoding = ingested
+        return (digest, size, *commit_blob(tmp_location, digest, encoding, remove=False))
+    stream = getattr(file, 'stream', file)
+    if isinstance(stream, io.BytesIO):
+        started = time.perf_counter()
+        with stream.getbuffer() as buffer:
+            digest, size = hashlib.sha256(buffer).hexdigest(), len(buffer)
+        metrics.record_io('hash', time.perf_counter() - started, size)
+        key, encoding = find_blob(digest)
+        if key is not None:
+            return digest, size, key, encoding
+    digest, size, tmp_location, encoding = ingest_file(file)
+    return (digest, size, *commit_blob(tmp_location, digest, encoding))
+
+
+def release_blob(db, digest, encoding=None):
+    """This function removes a blob when no indexed file references it anymore
+
+    It runs inside the write transaction that removed the reference, so no other file can start
+    referencing the blob meanwhile.
+    """
+    if index.references(db, digest, encoding) == 0:
+        storage().delete(blob_key(digest, encoding))
+        logger.debug("Blob '{}' released".format(digest))
+
+
+def link_file(key, filename):
+    """This function (re)points a filename to a blob of the content-addressed store"""
+    storage().link(key, filename)
+
+
+def version_matches(record, etags):
+    """This function checks the 'If-Match' ETags against a file (its hash or its version)"""
+    if record is None:
+        return False
+    if etags.star_tag:
+        return True
+    return etags.contains(record['hash']) or etags.contains(str(record['version']))
+
+
+def precondition_failed(filename):
+    """This function returns the error of a failed 'If-Match' precondition"""
+    return MyException.warning("File '{}' does not match 'If-Match'".format(filename), 412)
+
+
+def file_quarantined(filename):
+    """This function returns the error of a file whose blob the scrubber quarantined"""
+    return MyException.error("File '{}' is corrupted and was quarantined".format(filename), 500)
+
+
+def finish_change(entry_id):
+    """This function completes a journaled change: frees the blobs left unreferenced by it"""
+    with index.transaction() as db:
+        for digest, encoding in journal.blobs(db, entry_id):
+            release_blob(db, digest, encoding)
+        journal.remove(db, entry_id)
+
+
+def replay_journal(pid=None):
+    """This function completes the changes interrupted by a crash (journal entries left behind)
+
+    Each filename is pointed back to the blob of its index record (or removed when it has none)
+    and the blobs of the change that no file references anymore are freed. Only the changes of
+    the given process are completed, if any.
+    """
+    entries = journal.abandoned(pid)
+    if entries:
+        logger.warning('Replaying {} journal entries'.format(len(entries)))
+    for entry in entries:
+        try:
+            with index.transaction() as db:
+                record = index.lookup(entry['name'], db)
+                if record is not None:
+                    link_file(blob_key(record['hash'], record['encoding']), entry['name'])
+                else:
+                    storage().unlink(entry['name'])
+        except FileNotFoundError:
+            logger.error("File '{}' has no blob".format(entry['name']))
+        finish_change(entry['id'])
+    return len(entries)
+
+
+def commit_file(key, digest, size, filename, content_type=None, original_name=None, encoding=None,
+                if_match=None, client=None, expires=None):
+    """This function indexes a file and links it to its blob in the same transaction
+
+    The change is journaled first, so a crash midway is completed at startup. When 'if_match' (the
+    'If-Match' ETags) is given, the file is only overwritten if it still matches them. The file is
+    owned by the 'client' (see 'app/utils/limits.py'), within its quota, and is deleted once it
+    'expires' (if ever, see 'app/utils/expiry.py'). Returns the version of the file.
+    """
+    timestamp = time.time()
+    entry_id = journal.begin(filename, [(digest, encoding)])
+    try:
+        with index.transaction() as db:
+            stored_size = storage().stat(key)
+            if stored_size is None:
+                # NOTE: The blob was released by a concurrent request after it was found
+                raise FileNotFoundError(key)
+            previous = index.lookup(filename, db)
+            if if_match is not None and not version_matches(previous, if_match):
+                raise precondition_failed(filename)
+            if client is not None:
+                replaced = previous is not None and previous['owner'] == client['name']
+                check_quota(client, size - (previous['size'] if replaced else 0), 0 if replaced else 1, db)
+            index.upsert(db, {
+                'name': filename,
+                'hash': digest,
+                'size': size,
+                'type': file_type(filename, content_type),
+                'original_name': original_name if original_name is not None else filename,
+                'created': timestamp,
+                'accessed': timestamp,
+                'encoding': encoding,
+                'stored_size': stored_size,
+                'owner': client['name'] if client is not None else None,
+                'expires': expires,
+            })
+            # NOTE: A blob is only stored again after its corrupted copy was quarantined
+            index.clear_quarantine(db, digest, encoding)
+            link_file(key, filename)
+            # Free the blob of the overwritten file when this was its last reference
+            if previous is not None and (previous['hash'], previous['encoding']) != (digest, encoding):
+                journal.add_blob(db, entry_id, previous['hash'], previous['encoding'])
+            version = previous['version'] + 1 if previous is not None else 1
+    finally:
+        finish_change(entry_id)
+    file_cache.invalidate(filename)
+    return version
+
+
+def store_file(file, unique_id=True, preconditions=None, client=None, expires=None):
+    """This function stores a file to filesystem
+
+    The 'preconditions' map filenames to the 'If-Match' ETags they must match to be overwritten.
+    The file is owned by the 'client' of the request (if any) and 'expires' at the given time (if
+    ever).
+    """
+    # Validate the filename before reading the upload
+    filename = None if unique_id else check_filename(file)
+    if unique_id:
+        file_extension(file.filename)
+    for attempt in range(STORE_ATTEMPTS):
+        # Write file to the content-addressed store while calculating its hash and size
+        digest, size, key, encoding = store_blob(file)
+        # Generate filename using file hash
+        filename = unique_filename(file, digest=digest) if unique_id else filename
+        try:
+            version = commit_file(
+                key, digest, size, filename, file.content_type, file.filename, encoding,
+                (preconditions or {}).get(filename), client, expires)
+            break
+        except FileNotFoundError:
+            # The blob was released by a concurrent request, so store it again
+            if attempt == STORE_ATTEMPTS - 1:
+                raise
+            file.seek(0)
+    metadata = file_metadata(file, filename, size=size, version=version, expires=expires)
     return metadata if metadata else filename
 
 
-def store_files(files, unique_id=True):
-    """This function stores multiple files to filesystem"""
+def batch_executor():
+    """This function returns the thread pool of the batch uploads"""
+    with _batch_executor_lock:
+        # NOTE: Threads do not survive a fork, so each worker process needs its own pool
+        if _batch_executor['pid'] != os.getpid():
+            _batch_executor['executor'] = ThreadPoolExecutor(
+                max_workers=Config.FILE_MANAGER_BATCH_MAX_IN_FLIGHT, thread_name_prefix='batch')
+            _batch_executor['pid'] = os.getpid()
+        return _batch_executor['executor']
+
+
+def store_batch_file(file, unique_id=True, preconditions=None, client=None, expires=None):
+    """This function stores a file of a batch and returns its own success or error entry"""
+    try:
+        return {'status': 'success', **store_file(file, unique_id, preconditions, client, expires)}
+    except MyException as e:
+        return {'status': 'error', 'name': file.filename, 'message': e.message}
+    except Exception as e:
+        logger.exception(e)
+        return {'status': 'error', 'name': file.filename, 'message': 'Failed to store the file!'}
+
+
+def store_files(files, unique_id=True, preconditions=None, client=None, expires=None):
+    """This function stores multiple files to filesystem
+
+    The files of a batch are hashed and written concurrently, at most
+    'FILE_MANAGER_BATCH_MAX_IN_FLIGHT' at a time, and each one gets its own entry in the result.
+    """
     if len(files) == 0:
         raise MyException.error('No files are given', 500)
     elif len(files) == 1:
-        return store_file(files[0], unique_id=unique_id)
+        return store_file(files[0], unique_id=unique_id, preconditions=preconditions, client=client, expires=expires)
     else:
-        return [store_file(f, unique_id=unique_id) for f in files]
+        return list(batch_executor().map(
+            functools.partial(
+                store_batch_file, unique_id=unique_id, preconditions=preconditions, client=client, expires=expires),
+            files))
 
 
-def remove_file(filename):
-    """This function deletes a file if exist"""
-    file_location = filepath(filename)
-    # Chech if the file exist
-    if os.path.exists(file_location):
-        os.remove(file_location)
-        return True
-    return False
+def batch_failed(result):
+    """This function checks if any file of a batch failed to be stored"""
+    return isinstance(result, list) and any(entry['status'] == 'error' for entry in result)
+
+
+def remove_file(filename, if_match=None, expired_by=None):
+    """This function deletes a file if exist (and matches the 'If-Match' ETags, when given)
+
+    With 'expired_by' (a timestamp) the file is only deleted if it had expired by then, so a file
+    overwritten after it was found expired is kept. Returns if a file was deleted (an expired one
+    counts as missing, unless it is deleted by 'expired_by').
+    """
+    entry_id = journal.begin(filename)
+    try:
+        # Remove the file from the index and the storage in the same transaction
+        with index.transaction() as db:
+            record = index.lookup(filename, db)
+            # Chech if the file exist
+            if record is None:
+                return False
+            if if_match is not None and not version_matches(record, if_match):
+                raise precondition_failed(filename)
+            if expired_by is not None and not index.expired(record, expired_by):
+                return False
+            index.delete(db, filename)
+            if not storage().unlink(filename):
+                logger.warning("File '{}' was indexed but not found".format(filename))
+            # Free the blob when this was its last reference
+            journal.add_blob(db, entry_id, record['hash'], record['encoding'])
+    finally:
+        finish_change(entry_id)
+    file_cache.invalidate(filename)
+    # NOTE: An expired file is deleted all the same, but it was already missing to the clients
+    return expired_by is not None or not index.expired(record)
+
+
+def scan_files():
+    """This function yields the index records of the files found on disk (by the 'local' driver)"""
+    # Map each blob's inode to its hash and encoding, so linked files are not hashed again
+    blobs = {}
+    suffixes = {suffix: encoding for encoding, suffix in ENCODINGS.items()}
+    for dirpath, _, filenames in os.walk(os.path.join(Config.FILES_DIR, BLOBS_DIRNAME)):
+        for name in filenames:
+            stat = os.stat(os.path.join(dirpath, name))
+            digest, suffix = os.path.splitext(name)
+            blobs[(stat.st_dev, stat.st_ino)] = (digest, suffixes.get(suffix))
+    for entry in os.scandir(Config.FILES_DIR):
+        # Skip the hidden entries (blob store, index, temporary files, etc.)
+        if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+            continue
+        stat = entry.stat()
+        digest, encoding = blobs.get((stat.st_dev, stat.st_ino), (None, None))
+        size = stat.st_size
+        if digest is None:
+            with open(entry.path, 'rb') as file:
+                digest = file_hash(file)
+        elif encoding is not None:
+            # The size of a compressed file is only known by decompressing it
+            with open_encoded(open(entry.path, 'rb'), encoding) as file:
+                size = sum(len(chunk) for chunk in file_chunks(file))
+        yield {
+            'name': entry.name,
+            'hash': digest,
+            'size': size,
+            'type': file_type(entry.name),
+            'original_name': entry.name,
+            'created': stat.st_mtime,
+            'accessed': stat.st_atime,
+            'encoding': encoding,
+            'stored_size': stat.st_size,
+        }
@@ -0,0 +1,503 @@
+# index.py -----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the metadata index (SQLite) of the stored files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Schema migrations, each one a list of statements (the index's 'user_version' is the number of
+# migrations applied)
+MIGRATIONS = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            name TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            type TEXT,
+            original_name TEXT,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS files_hash ON files (hash)',
+    ],
+    [
+        'ALTER TABLE files ADD COLUMN extension TEXT',
+        'UPDATE files SET extension = file_extension(name)',
+        'CREATE INDEX IF NOT EXISTS files_extension ON files (extension, name)',
+        'CREATE INDEX IF NOT EXISTS files_size ON files (size, name)',
+        'CREATE INDEX IF NOT EXISTS files_created ON files (created, name)',
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            hash TEXT,
+            type TEXT,
+            unique_id INTEGER NOT NULL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS uploads_updated ON uploads (updated)',
+        """
+        CREATE TABLE IF NOT EXISTS upload_ranges (
+            id TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            stop INTEGER NOT NULL
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS upload_ranges_id ON upload_ranges (id, start)',
+    ],
+    [
+        # NOTE: The encoding of the stored content (NULL when uncompressed) and its size on disk
+        'ALTER TABLE files ADD COLUMN encoding TEXT',
+        'ALTER TABLE files ADD COLUMN stored_size INTEGER',
+        'UPDATE files SET stored_size = size',
+    ],
+    [
+        # NOTE: Totals of the stored files kept by triggers, so they are read without a scan
+        """
+        CREATE TABLE IF NOT EXISTS storage (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            stored_bytes INTEGER NOT NULL
+        )
+        """,
+        'INSERT OR REPLACE INTO storage (id, files, bytes, stored_bytes) '
+        'SELECT 0, COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM files',
+        """
+        CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+            UPDATE storage SET files = files + 1, bytes = bytes + NEW.size,
+                stored_bytes = stored_bytes + COALESCE(NEW.stored_size, NEW.size);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+            UPDATE storage SET files = files - 1, bytes = bytes - OLD.size,
+                stored_bytes = stored_bytes - COALESCE(OLD.stored_size, OLD.size);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size, stored_size ON files BEGIN
+            UPDATE storage SET bytes = bytes - OLD.size + NEW.size,
+                stored_bytes = stored_bytes - COALESCE(OLD.stored_size, OLD.size)
+                    + COALESCE(NEW.stored_size, NEW.size);
+        END
+        """,
+    ],
+    [
+        # NOTE: The version of a file is incremented each time it is overwritten
+        'ALTER TABLE files ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        # NOTE: Write-ahead journal of the changes to the stored files (see 'app/utils/journal.py')
+        """
+        CREATE TABLE IF NOT EXISTS journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            blobs TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            created REAL NOT NULL
+        )
+        """,
+    ],
+    [
+        # NOTE: When the scrubber found the blob of a file corrupted or missing (NULL when intact)
+        'ALTER TABLE files ADD COLUMN quarantined REAL',
+        # NOTE: The pass of the integrity scrubber, resumed where it stopped (see 'app/utils/scrub.py')
+        """
+        CREATE TABLE IF NOT EXISTS scrub (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            hash TEXT,
+            encoding TEXT,
+            started REAL NOT NULL,
+            finished REAL,
+            last_finished REAL,
+            blobs INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            corrupted INTEGER NOT NULL,
+            missing INTEGER NOT NULL
+        )
+        """,
+    ],
+    [
+        # NOTE: The client (the name of its API key) that stored a file, NULL when anonymous
+        'ALTER TABLE files ADD COLUMN owner TEXT',
+        # NOTE: Totals of the files of each client kept by triggers, so quotas are checked without a
+        #       scan ('INSERT OR IGNORE' would take the conflict policy of the upsert that fired them)
+        """
+        CREATE TABLE IF NOT EXISTS owners (
+            owner TEXT PRIMARY KEY,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS files_owner_insert AFTER INSERT ON files WHEN NEW.owner IS NOT NULL BEGIN
+            INSERT INTO owners (owner, files, bytes) SELECT NEW.owner, 0, 0
+                WHERE NOT EXISTS (SELECT 1 FROM owners WHERE owner = NEW.owner);
+            UPDATE owners SET files = files + 1, bytes = bytes + NEW.size WHERE owner = NEW.owner;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS files_owner_delete AFTER DELETE ON files WHEN OLD.owner IS NOT NULL BEGIN
+            UPDATE owners SET files = files - 1, bytes = bytes - OLD.size WHERE owner = OLD.owner;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS files_owner_update AFTER UPDATE OF size, owner ON files BEGIN
+            UPDATE owners SET files = files - 1, bytes = bytes - OLD.size WHERE owner = OLD.owner;
+            INSERT INTO owners (owner, files, bytes) SELECT NEW.owner, 0, 0
+                WHERE NEW.owner IS NOT NULL AND NOT EXISTS (SELECT 1 FROM owners WHERE owner = NEW.owner);
+            UPDATE owners SET files = files + 1, bytes = bytes + NEW.size WHERE owner = NEW.owner;
+        END
+        """,
+    ],
+    [
+        # NOTE: The time a file expires (NULL when it never does) and a partial index of the
+        #       expiring files only, in expiry order, so the due ones are read without a scan
+        'ALTER TABLE files ADD COLUMN expires REAL',
+        'CREATE INDEX IF NOT EXISTS files_expires ON files (expires) WHERE expires IS NOT NULL',
+        # NOTE: The expiry of the file of a resumable upload, set once it is finalized
+        'ALTER TABLE uploads ADD COLUMN expires REAL',
+    ],
+    [
+        # NOTE: The blobs on the cold tier (see 'app/utils/tiering.py'), so the tier of a blob is
+        #       looked up by its key, and the sampled count of their recent reads
+        """
+        CREATE TABLE IF NOT EXISTS cold_blobs (
+            key TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            encoding TEXT,
+            reads INTEGER NOT NULL,
+            moved REAL NOT NULL
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS cold_blobs_reads ON cold_blobs (reads)',
+        # NOTE: The files in the order they were last read, and the position of the mover in it
+        'CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed, name)',
+        """
+        CREATE TABLE IF NOT EXISTS tiering (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            accessed REAL NOT NULL,
+            name TEXT NOT NULL
+        )
+        """,
+    ],
+    [
+        # NOTE: When the process of a journal entry started, so a reused pid is not taken for it
+        'ALTER TABLE journal ADD COLUMN started INTEGER',
+    ],
+    [
+        # NOTE: The process finalizing an upload (its pid and start time), which holds the upload
+        #       until its file is committed
+        'ALTER TABLE uploads ADD COLUMN finalizer INTEGER',
+        'ALTER TABLE uploads ADD COLUMN finalizer_started INTEGER',
+    ],
+]
+# Columns that the files can be sorted by (ties are broken by name)
+SORT_COLUMNS = ('name', 'size', 'created')
+# Number of rows written per statement while rebuilding the index
+REBUILD_BATCH_SIZE = 1000
+# Connections are opened per thread (and per process, since they must not cross a fork)
+_local = threading.local()
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def index_path():
+    """This function returns the path of the index database"""
+    return Config.FILE_MANAGER_INDEX_PATH or os.path.join(Config.FILES_DIR, '.index.db')
+
+
+def file_extension(name):
+    """This function returns the (lowercase) extension of a filename, used by the index queries"""
+    _, dot, extension = name.rpartition('.')
+    return extension.lower() if dot else ''
+
+
+def migrate(db):
+    """This function applies the schema migrations that the index has not applied yet"""
+    with transaction(db):
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info("Migrating index to version {}".format(number))
+            for statement in migration:
+                db.execute(statement)
+            db.execute('PRAGMA user_version = {}'.format(number))
+
+
+def connection():
+    """This function returns the index connection of the current thread"""
+    path = index_path()
+    db = getattr(_local, 'db', None)
+    if db is not None and _local.pid == os.getpid() and _local.path == path:
+        return db
+    db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.create_function('file_extension', 1, file_extension, deterministic=True)
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA synchronous = NORMAL')
+    migrate(db)
+    _local.db, _local.pid, _local.path = db, os.getpid(), path
+    return db
+
+
+@contextlib.contextmanager
+def transaction(db=None):
+    """This function runs a block inside a write transaction of the index"""
+    db = db if db is not None else connection()
+    # NOTE: 'IMMEDIATE' takes the write lock up front, so concurrent writers wait instead of failing
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+
+def lookup(name, db=None):
+    """This function returns the index record of a file (if any)"""
+    db = db if db is not None else connection()
+    row = db.execute('SELECT * FROM files WHERE name = ?', (name,)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def expired(record, timestamp=None):
+    """This function checks if a file expired (it is served as missing until it is deleted)"""
+    return record['expires'] is not None and record['expires'] <= (timestamp or time.time())
+
+
+def lookup_live(name, db=None):
+    """This function returns the index record of a file, unless it is missing or expired"""
+    record = lookup(name, db)
+    return record if record is not None and not expired(record) else None
+
+
+def due(timestamp, limit=REBUILD_BATCH_SIZE):
+    """This function returns the (name, expires) of the files expired by 'timestamp', soonest first"""
+    rows = connection().execute(
+        'SELECT name, expires FROM files WHERE expires <= ? ORDER BY expires LIMIT ?', (timestamp, limit))
+    return [(row['name'], row['expires']) for row in rows]
+
+
+def is_cold(key, db=None):
+    """This function checks if a blob is on the cold tier"""
+    db = db if db is not None else connection()
+    return db.execute('SELECT 1 FROM cold_blobs WHERE key = ?', (key,)).fetchone() is not None
+
+
+def exists(name):
+    """This function checks if a file is indexed"""
+    return connection().execute('SELECT 1 FROM files WHERE name = ?', (name,)).fetchone() is not None
+
+
+def upsert(db, record):
+    """This function inserts or replaces the index record of a file"""
+    # NOTE: An upsert instead of 'INSERT OR REPLACE', whose implicit delete skips the triggers
+    db.execute(
+        'INSERT INTO files '
+        '(name, hash, size, type, original_name, created, accessed, encoding, stored_size, owner, '
+        'expires, extension) '
+        'VALUES (:name, :hash, :size, :type, :original_name, :created, :accessed, :encoding, '
+        ':stored_size, :owner, :expires, file_extension(:name)) '
+        'ON CONFLICT (name) DO UPDATE SET '
+        'hash = excluded.hash, size = excluded.size, type = excluded.type, '
+        'original_name = excluded.original_name, created = excluded.created, '
+        'accessed = excluded.accessed, encoding = excluded.encoding, '
+        'stored_size = excluded.stored_size, owner = excluded.owner, expires = excluded.expires, '
+        'version = files.version + 1, quarantined = NULL', {'owner': None, 'expires': None, **record})
+
+
+def delete(db, name):
+    """This function deletes the index record of a file and returns it (if any)"""
+    record = lookup(name, db)
+    if record is not None:
+        db.execute('DELETE FROM files WHERE name = ?', (name,))
+    return record
+
+
+def references(db, digest, encoding=None):
+    """This function returns the number of indexed files stored as the given blob"""
+    return db.execute(
+        'SELECT COUNT(*) FROM files WHERE hash = ? AND encoding IS ?', (digest, encoding)).fetchone()[0]
+
+
+def clear_quarantine(db, digest, encoding=None):
+    """This function clears the quarantine of the files stored as the given blob (stored again)"""
+    db.execute(
+        'UPDATE files SET quarantined = NULL WHERE hash = ? AND encoding IS ? AND quarantined IS NOT NULL',
+        (digest, encoding))
+
+
+def quarantine(db, digest, encoding=None):
+    """This function marks the files stored as the given blob as quarantined, returns their number"""
+    return db.execute(
+        'UPDATE files SET quarantined = ? WHERE hash = ? AND encoding IS ?',
+        (time.time(), digest, encoding)).rowcount
+
+
+def blobs_after(position=None, limit=REBUILD_BATCH_SIZE):
+    """This function returns the next (hash, encoding) blobs referenced by the index, in order
+
+    'position' is the last blob of the previous call. The blobs of the quarantined files are skipped.
+    """
+    digest, encoding = position if position is not None else ('', None)
+    rows = connection().execute(
+        'SELECT DISTINCT hash, encoding FROM files '
+        "WHERE (hash, COALESCE(encoding, '')) > (?, ?) AND quarantined IS NULL "
+        "ORDER BY hash, COALESCE(encoding, '') LIMIT ?", (digest, encoding or '', limit))
+    return [(row['hash'], row['encoding']) for row in rows]
+
+
+def touch(record):
+    """This function updates the access timestamp of a file
+
+    To avoid a write on every read, the timestamp is only updated when it is older than
+    'FILE_MANAGER_INDEX_ACCESS_RESOLUTION' seconds.
+    """
+    timestamp = time.time()
+    if timestamp - record['accessed'] < Config.FILE_MANAGER_INDEX_ACCESS_RESOLUTION:
+        return
+    with transaction() as db:
+        db.execute('UPDATE files SET accessed = ? WHERE name = ?', (timestamp, record['name']))
+
+
+def search(prefix=None, extension=None, min_size=None, max_size=None, created_after=None,
+           created_before=None, sort='name', descending=False, limit=100, after=None):
+    """This function returns a page of the indexed files that match the given filters
+
+    Pages are fetched by keyset pagination: 'after' is the (sort value, name) of the last file of
+    the previous page, so every page is a range scan of an index however deep it is.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError("Unknown sort column '{}'".format(sort))
+    # NOTE: The expired files are left out until they are deleted
+    conditions, params = ['(expires IS NULL OR expires > ?)'], [time.time()]
+    if prefix:
+        # NOTE: A range on the primary key instead of 'LIKE', which would scan the whole table
+        conditions.append('name >= ? AND name < ?')
+        params += [prefix, prefix + chr(0x10FFFF)]
+    if extension is not None:
+        conditions.append('extension = ?')
+        params.append(extension.lower().lstrip('.'))
+    if min_size is not None:
+        conditions.append('size >= ?')
+        params.append(min_size)
+    if max_size is not None:
+        conditions.append('size <= ?')
+        params.append(max_size)
+    if created_after is not None:
+        conditions.append('created >= ?')
+        params.append(created_after)
+    if created_before is not None:
+        conditions.append('created < ?')
+        params.append(created_before)
+    if after is not None:
+        if sort == 'name':
+            conditions.append('name {} ?'.format('<' if descending else '>'))
+            params.append(after[1])
+        else:
+            conditions.append('({}, name) {} (?, ?)'.format(sort, '<' if descending else '>'))
+            params += list(after)
+    direction = 'DESC' if descending else 'ASC'
+    order = 'name {}'.format(direction) if sort == 'name' else '{0} {1}, name {1}'.format(sort, direction)
+    query = 'SELECT * FROM files WHERE {} ORDER BY {} LIMIT ?'.format(' AND '.join(conditions), order)
+    return [dict(row) for row in connection().execute(query, params + [limit])]
+
+
+def owner_totals(owner, db=None):
+    """This function returns the number and the size of the indexed files of a client"""
+    db = db if db is not None else connection()
+    row = db.execute('SELECT files, bytes FROM owners WHERE owner = ?', (owner,)).fetchone()
+    return dict(row) if row is not None else {'files': 0, 'bytes': 0}
+
+
+def files_count():
+    """This function returns the number of indexed files"""
+    return storage_totals()['files']
+
+
+def storage_totals():
+    """This function returns the number of indexed files, their size and their size on disk"""
+    return dict(connection().execute('SELECT files, bytes, stored_bytes FROM storage').fetchone())
+
+
+def rebuild(records):
+    """This function rebuilds the index from the given records (the files found on disk)
+
+    The records are written in batches, each one in its own transaction, so the service can keep
+    writing to the index during a rebuild. The type, original name and timestamps of the files
+    whose content did not change are kept. Returns the number of records removed.
+    """
+    started = time.time()
+    db = connection()
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS seen (name TEXT PRIMARY KEY)')
+    db.execute('DELETE FROM seen')
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            _rebuild_batch(db, batch)
+            batch = []
+    _rebuild_batch(db, batch)
+    with transaction(db):
+        # NOTE: Files stored after the rebuild started may have been missed by the scan
+        removed = db.execute(
+            'DELETE FROM files WHERE created < ? AND name NOT IN (SELECT name FROM seen)',
+            (started,)).rowcount
+    db.execute('DROP TABLE seen')
+    return removed
+
+
+def _rebuild_batch(db, records):
+    """This function writes a batch of records while rebuilding the index"""
+    with transaction(db):
+        db.executemany(
+            'INSERT INTO files '
+            '(name, hash, size, type, original_name, created, accessed, encoding, stored_size, '
+            'extension) '
+            'VALUES (:name, :hash, :size, :type, :original_name, :created, :accessed, :encoding, '
+            ':stored_size, file_extension(:name)) '
+            'ON CONFLICT (name) DO UPDATE SET '
+            'hash = excluded.hash, size = excluded.size, type = excluded.type, '
+            'original_name = excluded.original_name, created = excluded.created, '
+            'encoding = excluded.encoding, stored_size = excluded.stored_size, '
+            'version = files.version + 1, quarantined = NULL '
+            'WHERE files.hash != excluded.hash OR files.encoding IS NOT excluded.encoding', records)
+        db.executemany('INSERT OR IGNORE INTO seen (name) VALUES (:name)', records)
@@ -0,0 +1,120 @@
+# journal.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the write-ahead journal of the changes to the stored files. Before a
+#    filename or a blob is changed, an entry naming them is committed to the index, and it is
+#    deleted once the change is complete. The entries left by a crashed process are replayed at
+#    startup (and by gunicorn's master when a worker exits), which brings the filename and the
+#    blobs back in line with the index.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import json
+import time
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.utils import index
+from app.utils.metrics import process_alive
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# The start time of the current process (set after a fork)
+_process = {'pid': None, 'started': None}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def process_started(pid):
+    """This function returns when a process started (in clock ticks since boot), or None if unknown
+
+    A pid is reused once its process exits, the start time tells the processes apart (Linux only).
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid), 'rb') as file:
+            # NOTE: The fields after the command (in parentheses), the start time is the 22nd field
+            return int(file.read().rpartition(b')')[2].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def current_started():
+    """This function returns when the current process started"""
+    if _process['pid'] != os.getpid():
+        _process.update(pid=os.getpid(), started=process_started(os.getpid()))
+    return _process['started']
+
+
+def running(pid, started):
+    """This function checks if the process of a journal entry is still running"""
+    if not process_alive(pid):
+        return False
+    if started is None:
+        # NOTE: An entry without a start time (older version, no '/proc') of the current pid is of a
+        #       previous process
+        return pid != os.getpid()
+    return process_started(pid) == started
+
+
+def begin(name, blobs=()):
+    """This function journals a change to a file and its (hash, encoding) blobs, returns its id
+
+    The entry is committed on its own, before the change starts.
+    """
+    with index.transaction() as db:
+        return db.execute(
+            'INSERT INTO journal (name, blobs, pid, started, created) VALUES (?, ?, ?, ?, ?)',
+            (name, json.dumps([list(blob) for blob in blobs]), os.getpid(), current_started(),
+             time.time())).lastrowid
+
+
+def add_blob(db, entry_id, digest, encoding=None):
+    """This function adds a blob to a journal entry (inside the transaction of the change)"""
+    blobs = json.loads(db.execute('SELECT blobs FROM journal WHERE id = ?', (entry_id,)).fetchone()[0])
+    blobs.append([digest, encoding])
+    db.execute('UPDATE journal SET blobs = ? WHERE id = ?', (json.dumps(blobs), entry_id))
+
+
+def blobs(db, entry_id):
+    """This function returns the (hash, encoding) blobs of a journal entry"""
+    row = db.execute('SELECT blobs FROM journal WHERE id = ?', (entry_id,)).fetchone()
+    return [tuple(blob) for blob in json.loads(row[0])] if row is not None else []
+
+
+def remove(db, entry_id):
+    """This function deletes a journal entry (the change is complete)"""
+    db.execute('DELETE FROM journal WHERE id = ?', (entry_id,))
+
+
+def abandoned(pid=None):
+    """This function returns the journal entries of the processes that are no longer running
+
+    Only those of the given process, if any (e.g. a worker that exited).
+    """
+    db = index.connection()
+    if pid is None:
+        rows = db.execute('SELECT * FROM journal ORDER BY id').fetchall()
+    else:
+        rows = db.execute('SELECT * FROM journal WHERE pid = ? ORDER BY id', (pid,)).fetchall()
+    # NOTE: The entries of the running processes (e.g. the other workers) are still in progress
+    return [dict(row) for row in rows if not running(row['pid'], row['started'])]
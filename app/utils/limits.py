@@ -0,0 +1,289 @@
+# limits.py ----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the limits of the clients (one per API key): token buckets of their
+#    request rate and of their upload and download bytes per second, and quotas of the total
+#    size and number of the files they store. A request over a rate gets a 429 (with
+#    'Retry-After') before its body is read. The buckets are kept in memory (per process) or in a
+#    SQLite database shared by the worker processes of the host.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import copy
+import math
+import time
+import hmac
+import sqlite3
+import hashlib
+import tempfile
+import threading
+# Installed
+from flask import g, request
+# Custom
+from app.config.settings import Config
+from app.responses import MyException
+from app.utils import index, metrics
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Methods whose request body is counted as uploaded bytes
+UPLOAD_METHODS = ('POST', 'PUT', 'PATCH')
+# Limits of a client (all optional, a missing one is not limited)
+LIMITS = (
+    'requests_per_second', 'requests_burst', 'upload_bytes_per_second', 'download_bytes_per_second',
+    'bytes_burst', 'max_bytes', 'max_files')
+# Context of the keys that sign the URLs of a client (derived from its API key)
+SIGNING_CONTEXT = b'file-manager signed urls'
+# The configured clients, by the SHA-256 of their API key and by their key id (re-created when the
+# settings change)
+_clients = {'settings': None, 'clients': {}, 'key_ids': {}}
+# The configured backend of the buckets (re-created when its settings change)
+_backend = {'settings': None, 'backend': None}
+_backend_lock = threading.Lock()
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class MemoryBackend(object):
+    """Keeps the buckets in the memory of the current process (each worker limits on its own)"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, capacity, amount, force=False):
+        """Takes tokens from a bucket, returns the seconds to wait for them (0 when taken)"""
+        with self.lock:
+            self.buckets[key], wait = take_tokens(self.buckets.get(key), rate, capacity, amount, force)
+        return wait
+
+
+class SQLiteBackend(object):
+    """Keeps the buckets in a SQLite database, shared by all the processes of the host"""
+
+    def __init__(self, path):
+        self.path = path
+        # NOTE: Connections are opened per thread (and per process, since they must not cross a fork)
+        self.local = threading.local()
+
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None and self.local.pid == os.getpid():
+            return db
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode = WAL')
+        # NOTE: The buckets refill by themselves, so losing the last updates on a crash is harmless
+        db.execute('PRAGMA synchronous = OFF')
+        db.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+        self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def take(self, key, rate, capacity, amount, force=False):
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            bucket = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            bucket, wait = take_tokens(bucket, rate, capacity, amount, force)
+            db.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, *bucket))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return wait
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def take_tokens(bucket, rate, capacity, amount, force=False):
+    """This function takes tokens from a (tokens, updated) bucket, returns it and the seconds to wait
+
+    The bucket refills at 'rate' tokens per second up to 'capacity'. An amount larger than the
+    capacity is taken from a full bucket, which goes into debt, so large bodies still average to
+    the rate. A 'force'd amount (e.g. the bytes already sent) is taken even when it goes into debt.
+    """
+    timestamp = time.time()
+    tokens = capacity if bucket is None else min(capacity, bucket[0] + (timestamp - bucket[1]) * rate)
+    required = min(amount, capacity)
+    if tokens < required and not force:
+        return (tokens, timestamp), (required - tokens) / rate
+    return (tokens - amount, timestamp), 0
+
+
+def client_settings():
+    """This function returns the settings of the clients"""
+    return Config.FILE_MANAGER_API_KEY, Config.FILE_MANAGER_API_KEYS
+
+
+def key_digest(key):
+    """This function returns the SHA-256 of an API key (the clients are looked up by it)"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def create_client(key, limits=None):
+    """This function creates a client from its API key and its limits"""
+    limits = limits or {}
+    client = {'name': limits.get('name') or 'key-{}'.format(key_digest(key)[:8])}
+    # NOTE: The signed URLs of a client name it by its key id and stop working with its API key
+    client['key_id'] = key_digest(key)[:16]
+    client['signing_key'] = hmac.new(key.encode('utf-8'), SIGNING_CONTEXT, hashlib.sha256).digest()
+    for limit in LIMITS:
+        client[limit] = limits.get(limit) or None
+    client['requests_burst'] = client['requests_burst'] or max(1, client['requests_per_second'] or 0)
+    client['limited'] = any(client[limit] for limit in LIMITS if limit not in ('requests_burst', 'bytes_burst'))
+    return client
+
+
+def clients():
+    """This function returns the configured clients, by the SHA-256 of their API key
+
+    The clients are the keys of 'FILE_MANAGER_API_KEYS' and 'FILE_MANAGER_API_KEY' (not limited,
+    unless it is also one of the former).
+    """
+    settings = client_settings()
+    if _clients['settings'] != settings:
+        api_key, api_keys = settings
+        configured = {key_digest(key): create_client(key, limits) for key, limits in api_keys.items()}
+        if api_key is not None and key_digest(api_key) not in configured:
+            configured[key_digest(api_key)] = create_client(api_key, {'name': 'default'})
+        # NOTE: A copy, so a change of the settings is noticed
+        _clients['clients'], _clients['settings'] = configured, copy.deepcopy(settings)
+        _clients['key_ids'] = {client['key_id']: client for client in configured.values()}
+    return _clients['clients']
+
+
+def identify(key):
+    """This function returns the client of an API key (None if it is not configured)"""
+    # NOTE: The lookup is by the hash of the key, so its time tells nothing about the keys
+    return clients().get(key_digest(key)) if key is not None else None
+
+
+def client_by_key_id(key_id):
+    """This function returns the client of a key id (None if it is not configured)"""
+    clients()
+    return _clients['key_ids'].get(key_id)
+
+
+def create_backend():
+    """This function creates the backend set by 'FILE_MANAGER_RATE_LIMIT_BACKEND'"""
+    name = Config.FILE_MANAGER_RATE_LIMIT_BACKEND
+    if name == 'sqlite':
+        return SQLiteBackend(
+            Config.FILE_MANAGER_RATE_LIMIT_PATH or os.path.join(tempfile.gettempdir(), 'file-manager-limits.db'))
+    if name != 'memory':
+        raise ValueError("Unknown rate limit backend '{}'".format(name))
+    return MemoryBackend()
+
+
+def backend():
+    """This function returns the configured backend of the buckets"""
+    settings = (Config.FILE_MANAGER_RATE_LIMIT_BACKEND, Config.FILE_MANAGER_RATE_LIMIT_PATH)
+    with _backend_lock:
+        if _backend['settings'] != settings:
+            _backend['backend'] = create_backend()
+            _backend['settings'] = settings
+        return _backend['backend']
+
+
+def throttled(client, limit, wait):
+    """This function returns the 429 of a request over a limit of its client"""
+    metrics.inc('file_manager_rate_limited_requests_total', (client['name'], limit))
+    return MyException.too_many_requests(max(1, math.ceil(wait)))
+
+
+def admit(client, method, content_length=None):
+    """This function checks the rates (and, for uploads, the quotas) of a client before a request
+
+    It runs before the body is read. Each request takes a token of the request rate, an upload
+    takes its 'Content-Length' from the upload rate and a download is refused while the download
+    rate is in debt (the bytes are taken once they are sent, see 'charge_download').
+    """
+    if client is None or not client['limited']:
+        return
+    buckets = backend()
+    if client['requests_per_second']:
+        wait = buckets.take(
+            '{}:requests'.format(client['name']), client['requests_per_second'], client['requests_burst'], 1)
+        if wait:
+            raise throttled(client, 'requests', wait)
+    if method in UPLOAD_METHODS and content_length:
+        if client['upload_bytes_per_second']:
+            rate = client['upload_bytes_per_second']
+            wait = buckets.take('{}:upload'.format(client['name']), rate, client['bytes_burst'] or rate, content_length)
+            if wait:
+                raise throttled(client, 'upload', wait)
+        # NOTE: A 'PUT' replaces a file, whose size is only known once it is committed
+        if method != 'PUT':
+            check_quota(client, content_length, 0)
+    elif method == 'GET' and client['download_bytes_per_second']:
+        rate = client['download_bytes_per_second']
+        wait = buckets.take('{}:download'.format(client['name']), rate, client['bytes_burst'] or rate, 0)
+        if wait:
+            raise throttled(client, 'download', wait)
+
+
+def charge_download(client, size):
+    """This function takes the bytes sent to a client from its download rate"""
+    if client is None or not client['download_bytes_per_second'] or not size:
+        return
+    rate = client['download_bytes_per_second']
+    backend().take('{}:download'.format(client['name']), rate, client['bytes_burst'] or rate, size, force=True)
+
+
+def count_download(response, client):
+    """This function yields a streamed response body while taking its bytes from the download rate"""
+    sent = 0
+    try:
+        for chunk in response:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        charge_download(client, sent)
+
+
+def finish_request(response):
+    """This function takes the bytes of a download from the rate of its client (after it is handled)"""
+    client = g.get('client')
+    if client is None or not client['download_bytes_per_second'] or request.method != 'GET':
+        return response
+    if response.content_length is not None:
+        charge_download(client, response.content_length)
+    elif response.is_streamed:
+        response.response = count_download(response.response, client)
+    return response
+
+
+def check_quota(client, size, files=1, db=None):
+    """This function checks that a client can store 'size' more bytes in 'files' more files
+
+    Without the transaction of the change ('db') it is the early check of an upload, by its
+    'Content-Length', so an upload over the remaining quota is refused before its body is read.
+    """
+    if client is None or not (client['max_bytes'] or client['max_files']):
+        return
+    used = index.owner_totals(client['name'], db)
+    if client['max_bytes'] and used['bytes'] + size > client['max_bytes']:
+        raise MyException.quota_exceeded('bytes', client['max_bytes'])
+    if client['max_files'] and used['files'] + files > client['max_files']:
+        raise MyException.quota_exceeded('files', client['max_files'])
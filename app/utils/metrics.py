@@ -0,0 +1,399 @@
+# metrics.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the metrics of the app (Prometheus text format). Each process writes its
+#    values to its own memory-mapped file (its threads share it under a lock) and the '/metrics'
+#    route of any worker process sums the files of all of them. The counters and histograms of an
+#    exited process are merged into a single file, so the number of files stays that of the
+#    running processes.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import json
+import fcntl
+import contextlib
+import mmap
+import time
+import bisect
+import shutil
+import struct
+import tempfile
+import threading
+# Installed
+from flask import g, request
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Metrics (name -> type, help, label names)
+METRICS = {
+    'file_manager_http_requests_total': (
+        'counter', 'Number of HTTP requests', ('endpoint', 'status')),
+    'file_manager_http_request_duration_seconds': (
+        'histogram', 'Latency of the HTTP requests', ('endpoint', 'status')),
+    'file_manager_http_requests_in_flight': (
+        'gauge', 'Number of HTTP requests being served', ()),
+    'file_manager_http_received_bytes_total': (
+        'counter', 'Bytes received in HTTP request bodies', ('endpoint',)),
+    'file_manager_http_sent_bytes_total': (
+        'counter', 'Bytes sent in HTTP response bodies', ('endpoint',)),
+    'file_manager_download_path_total': (
+        'counter', 'Number of file responses by the path their body took', ('path',)),
+    'file_manager_download_path_bytes_total': (
+        'counter', 'Bytes of the file responses by the path their body took', ('path',)),
+    'file_manager_io_seconds_total': (
+        'counter', 'Time spent hashing, compressing, writing and reading stored files', ('operation',)),
+    'file_manager_io_bytes_total': (
+        'counter', 'Bytes hashed, compressed, written and read of stored files', ('operation',)),
+    'file_manager_rate_limited_requests_total': (
+        'counter', 'Number of requests refused by a rate limit of their client', ('client', 'limit')),
+    'file_manager_scrub_blobs_total': (
+        'counter', 'Number of blobs verified by the scrubber by result', ('result',)),
+    'file_manager_scrub_bytes_total': (
+        'counter', 'Bytes read by the scrubber', ()),
+    'file_manager_expired_files_total': (
+        'counter', 'Number of expired files deleted by the reaper', ()),
+    'file_manager_tier_moves_total': (
+        'counter', 'Number of blobs moved between the storage tiers by destination', ('tier',)),
+}
+# Layout of the files: a header (bytes used) followed by entries, each one a (key length, number
+# of values) header, the JSON key (name, labels) padded to 8 bytes and the values (doubles)
+HEADER = struct.Struct('<Q')
+ENTRY = struct.Struct('<II')
+VALUE = struct.Struct('<d')
+INITIAL_FILE_SIZE = 64 * 1024
+FILE_SUFFIX = '.metrics'
+# File of the counters and histograms of the processes that have exited
+MERGED_FILENAME = 'merged' + FILE_SUFFIX
+# Lock file of the merges (exclusive) against the reads of all the files (shared)
+LOCK_FILENAME = '.metrics.lock'
+# File of the current process (re-opened after a fork)
+_process = {'values': None, 'lock': threading.Lock()}
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class MetricsFile(object):
+    """Memory-mapped file of metric values written by the threads of a single process
+
+    Entries are only appended, and the header is updated after the entry is complete, so readers
+    never see a partial entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        self.size = INITIAL_FILE_SIZE
+        os.ftruncate(self.fd, self.size)
+        self.mmap = mmap.mmap(self.fd, self.size)
+        self.used = HEADER.size
+        HEADER.pack_into(self.mmap, 0, self.used)
+        self.offsets = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, width, increments):
+        """This function adds the (index, value) increments to the values of a key, appending it if missing"""
+        with self.lock:
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self._append(key, width)
+            for index, value in increments:
+                position = offset + index * VALUE.size
+                VALUE.pack_into(self.mmap, position, VALUE.unpack_from(self.mmap, position)[0] + value)
+
+    def _append(self, key, width):
+        data = json.dumps(key).encode()
+        data += b' ' * (-len(data) % 8)
+        length = ENTRY.size + len(data) + width * VALUE.size
+        if self.used + length > self.size:
+            while self.used + length > self.size:
+                self.size *= 2
+            os.ftruncate(self.fd, self.size)
+            previous, self.mmap = self.mmap, mmap.mmap(self.fd, self.size)
+            previous.close()
+        ENTRY.pack_into(self.mmap, self.used, len(data), width)
+        self.mmap[self.used + ENTRY.size:self.used + ENTRY.size + len(data)] = data
+        offset = self.used + ENTRY.size + len(data)
+        self.used += length
+        HEADER.pack_into(self.mmap, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def metrics_dir():
+    """This function returns the directory of the metric files"""
+    return Config.FILE_MANAGER_METRICS_DIR or os.path.join(tempfile.gettempdir(), 'file-manager-metrics')
+
+
+def reset():
+    """This function deletes the metric files (when the server starts)"""
+    shutil.rmtree(metrics_dir(), ignore_errors=True)
+
+
+def process_path(pid):
+    """This function returns the metrics file of a process"""
+    return os.path.join(metrics_dir(), '{}{}'.format(pid, FILE_SUFFIX))
+
+
+def reset_after_fork():
+    """This function drops the metrics file inherited by a forked process (it is the parent's)"""
+    # NOTE: The lock may have been held by another thread of the parent at the time of the fork
+    _process.update(values=None, lock=threading.Lock())
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def _values():
+    """This function returns the metrics file of the current process"""
+    values = _process['values']
+    if values is None:
+        with _process['lock']:
+            if _process['values'] is None:
+                os.makedirs(metrics_dir(), exist_ok=True)
+                # NOTE: A file with the pid of this process was left by an exited one (pids are reused)
+                merge_process(os.getpid())
+                _process['values'] = MetricsFile(process_path(os.getpid()))
+            values = _process['values']
+    return values
+
+
+def inc(name, labels=(), value=1):
+    """This function increments a counter (or a gauge, by a negative value to decrement it)"""
+    if not Config.FILE_MANAGER_METRICS:
+        return
+    _values().add((name, labels), 1, ((0, value),))
+
+
+def observe(name, labels, value):
+    """This function records a value in a histogram"""
+    if not Config.FILE_MANAGER_METRICS:
+        return
+    # NOTE: The values are the count of each bucket (the last one is '+Inf') and the sum
+    _values().add((name, labels), len(LATENCY_BUCKETS) + 2, (
+        (bisect.bisect_left(LATENCY_BUCKETS, value), 1), (len(LATENCY_BUCKETS) + 1, value)))
+
+
+def record_io(operation, seconds, size):
+    """This function records the time and the bytes of a storage operation"""
+    if not Config.FILE_MANAGER_METRICS:
+        return
+    inc('file_manager_io_seconds_total', (operation,), seconds)
+    inc('file_manager_io_bytes_total', (operation,), size)
+
+
+def read_values(path):
+    """This function returns the (key, values) entries of a metrics file"""
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        return
+    used = min(HEADER.unpack_from(data, 0)[0], len(data))
+    position = HEADER.size
+    while position + ENTRY.size <= used:
+        length, width = ENTRY.unpack_from(data, position)
+        position += ENTRY.size
+        name, labels = json.loads(data[position:position + length])
+        position += length
+        yield (name, tuple(labels)), [VALUE.unpack_from(data, position + i * VALUE.size)[0] for i in range(width)]
+        position += width * VALUE.size
+
+
+def write_values(path, totals):
+    """This function replaces a metrics file with the (key -> values) totals"""
+    data = bytearray(HEADER.size)
+    for (name, labels), values in totals.items():
+        key = json.dumps((name, labels)).encode()
+        key += b' ' * (-len(key) % 8)
+        data += ENTRY.pack(len(key), len(values)) + key
+        data += b''.join(VALUE.pack(value) for value in values)
+    HEADER.pack_into(data, 0, len(data))
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+@contextlib.contextmanager
+def locked(operation):
+    """This function holds the lock of the metric files (shared to read them, exclusive to merge)"""
+    with open(os.path.join(metrics_dir(), LOCK_FILENAME), 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+def merge_process(pid):
+    """This function merges the counters and histograms of an exited process, deleting its file
+
+    Its gauges (e.g. the requests in flight) are dropped. It runs when a worker exits (in gunicorn's
+    master), when a process reuses the pid and when the metrics of a dead process are read.
+    """
+    path = process_path(pid)
+    if not os.path.exists(path):
+        return
+    with locked(fcntl.LOCK_EX):
+        if not os.path.exists(path):
+            return
+        merged = os.path.join(metrics_dir(), MERGED_FILENAME)
+        totals = dict(read_values(merged)) if os.path.exists(merged) else {}
+        for key, values in read_values(path):
+            if METRICS.get(key[0], ('counter',))[0] == 'gauge':
+                continue
+            current = totals.setdefault(key, [0.0] * len(values))
+            for i, value in enumerate(values):
+                current[i] += value
+        write_values(merged, totals)
+        os.remove(path)
+
+
+def process_alive(pid):
+    """This function checks if a process is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """This function returns the values of all the processes, summed by key
+
+    Counters and histograms include the processes that have exited, gauges only the running ones.
+    The files of the processes found dead are merged first (e.g. the workers of uvicorn).
+    """
+    totals = {}
+    if not os.path.isdir(metrics_dir()):
+        return totals
+    for name in os.listdir(metrics_dir()):
+        pid = name[:-len(FILE_SUFFIX)]
+        if name.endswith(FILE_SUFFIX) and pid.isdigit() and not process_alive(int(pid)):
+            merge_process(int(pid))
+    with locked(fcntl.LOCK_SH):
+        for entry in os.scandir(metrics_dir()):
+            if not entry.name.endswith(FILE_SUFFIX):
+                continue
+            for key, values in read_values(entry.path):
+                current = totals.setdefault(key, [0.0] * len(values))
+                for i, value in enumerate(values):
+                    current[i] += value
+    return totals
+
+
+def format_labels(names, values, extra=()):
+    """This function returns the labels of a sample (e.g. '{endpoint="files.read_file"}')"""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+def format_value(value):
+    """This function returns a sample's value (integers without a decimal point)"""
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def exposition(gauges=None):
+    """This function returns all the metrics in the Prometheus text format
+
+    The 'gauges' are extra (name -> (help, value)) gauges computed on each scrape.
+    """
+    totals = collect()
+    lines = []
+    for name, (kind, description, label_names) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        samples = sorted((key[1], values) for key, values in totals.items() if key[0] == name)
+        if kind == 'gauge' and not label_names and not samples:
+            samples = [((), [0.0])]
+        for labels, values in samples:
+            if kind != 'histogram':
+                lines.append('{}{} {}'.format(name, format_labels(label_names, labels), format_value(values[0])))
+                continue
+            cumulative = 0.0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(label_names, labels, [('le', bound)]), format_value(cumulative)))
+            lines.append('{}_sum{} {}'.format(name, format_labels(label_names, labels), format_value(values[-1])))
+            lines.append('{}_count{} {}'.format(name, format_labels(label_names, labels), format_value(cumulative)))
+    for name, (description, value) in (gauges or {}).items():
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('{} {}'.format(name, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def start_request():
+    """This function starts the metrics of a request (before it is handled)"""
+    g.metrics_started = time.perf_counter()
+    inc('file_manager_http_requests_in_flight')
+
+
+def count_sent_bytes(response, endpoint):
+    """This function yields a streamed response body while counting its bytes"""
+    sent = 0
+    try:
+        for chunk in response:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        inc('file_manager_http_sent_bytes_total', (endpoint,), sent)
+
+
+def finish_request(response):
+    """This function records the metrics of a request (after it is handled)"""
+    endpoint = request.endpoint or 'none'
+    inc('file_manager_http_requests_total', (endpoint, response.status_code))
+    observe('file_manager_http_request_duration_seconds', (endpoint, response.status_code),
+            time.perf_counter() - g.metrics_started)
+    if request.content_length:
+        inc('file_manager_http_received_bytes_total', (endpoint,), request.content_length)
+    if response.content_length is not None:
+        inc('file_manager_http_sent_bytes_total', (endpoint,), response.content_length)
+    elif response.is_streamed:
+        response.response = count_sent_bytes(response.response, endpoint)
+    g.metrics_finished = True
+    return response
+
+
+def teardown_request(error=None):
+    """This function ends the metrics of a request (even when it failed)"""
+    if 'metrics_started' not in g:
+        return
+    inc('file_manager_http_requests_in_flight', value=-1)
+    # NOTE: Unhandled exceptions skip 'finish_request'
+    if 'metrics_finished' not in g:
+        endpoint = request.endpoint or 'none'
+        inc('file_manager_http_requests_total', (endpoint, 500))
+        observe('file_manager_http_request_duration_seconds', (endpoint, 500),
+                time.perf_counter() - g.metrics_started)
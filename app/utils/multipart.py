@@ -0,0 +1,184 @@
+# multipart.py -------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the streaming parser of the uploaded files (multipart/form-data bodies).
+#    Each file is hashed and written, as it arrives, to a temporary file inside the files directory,
+#    so storing it is a single rename (instead of spooling it to the system's temporary directory
+#    and copying it again). The size of each file and of the whole body are limited while they are
+#    received.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+# Installed
+from werkzeug.datastructures import FileStorage
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NEED_DATA
+# Custom
+from app.config.settings import Config
+from app.responses import MyException
+from app.utils.compression import open_encoded
+from app.utils.general import BlobWriter, file_chunks
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# The form field of the uploaded files
+FILES_FIELD = 'files[]'
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class IngestedFile(FileStorage):
+    """An uploaded file, already hashed and written to a temporary file inside the files directory
+
+    'ingested' holds its hash, size, temporary file and encoding (see 'store_blob'). Its content is
+    only opened when it is read, and the temporary file is removed when it is closed.
+    """
+
+    def __init__(self, ingested, filename=None, name=None, content_type=None, headers=None):
+        self.ingested = ingested
+        self._stream = None
+        super().__init__(None, filename, name, content_type, None, headers)
+
+    @property
+    def stream(self):
+        if self._stream is None:
+            _, _, tmp_location, encoding = self.ingested
+            file = open(tmp_location, 'rb')
+            self._stream = open_encoded(file, encoding) if encoding else file
+        return self._stream
+
+    @stream.setter
+    def stream(self, value):
+        # NOTE: 'FileStorage' sets an empty stream, the temporary file is opened instead
+        pass
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+        try:
+            os.remove(self.ingested[2])
+        except FileNotFoundError:
+            pass
+
+
+class MultipartReceiver(object):
+    """Parses a multipart/form-data body fed in chunks, writing its files as they arrive
+
+    Only the parts of the 'files[]' field are kept (the other fields are skipped, as flask's
+    'request.files' does). Raises 413 as soon as a file exceeds 'FILE_MANAGER_MAX_FILE_SIZE' or the
+    body exceeds 'FILE_MANAGER_MAX_CONTENT_LENGTH' bytes.
+    """
+
+    def __init__(self, boundary):
+        self.decoder = MultipartDecoder(boundary)
+        self.files = []
+        self.part, self.writer = None, None
+        self.received = 0
+        self.finished = False
+
+    def receive(self, chunk):
+        """Parses a chunk of the body (None at its end), returns True once the last part is parsed"""
+        if chunk is not None:
+            self.received += len(chunk)
+            if Config.FILE_MANAGER_MAX_CONTENT_LENGTH and self.received > Config.FILE_MANAGER_MAX_CONTENT_LENGTH:
+                raise MyException.payload_too_large('request', Config.FILE_MANAGER_MAX_CONTENT_LENGTH)
+        self.decoder.receive_data(chunk)
+        while not self.finished:
+            try:
+                event = self.decoder.next_event()
+            except ValueError:
+                # NOTE: E.g. a body that ends before its last part
+                raise MyException.warning('Invalid multipart body', 400)
+            if event is NEED_DATA:
+                break
+            if isinstance(event, (File, Field, Epilogue)):
+                self.finish_part()
+            if isinstance(event, File) and event.name == FILES_FIELD:
+                self.part = event
+                self.writer = BlobWriter(event.filename or '', Config.FILE_MANAGER_MAX_FILE_SIZE)
+            elif isinstance(event, Data) and self.writer is not None:
+                self.writer.write(event.data)
+            elif isinstance(event, Epilogue):
+                self.finished = True
+        return self.finished
+
+    def finish_part(self):
+        """Flushes the file being written (if any) to disk"""
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        ingested = writer.finish()
+        self.files.append(IngestedFile(
+            ingested, filename=self.part.filename, name=self.part.name,
+            content_type=self.part.headers.get('Content-Type'), headers=self.part.headers))
+
+    def close(self):
+        """Parses the end of the body (raises 400 if it ends before its last part)"""
+        if not self.receive(None):
+            raise MyException.warning('Invalid multipart body', 400)
+
+    def abort(self):
+        """Removes the files written so far"""
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        for file in self.files:
+            file.close()
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def create_receiver(content_type, content_length=None):
+    """This function returns the receiver of a body (None if it is not multipart/form-data)
+
+    A body whose 'Content-Length' exceeds 'FILE_MANAGER_MAX_CONTENT_LENGTH' is refused before any
+    of it is read.
+    """
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != 'multipart/form-data' or 'boundary' not in options:
+        return None
+    if Config.FILE_MANAGER_MAX_CONTENT_LENGTH and (content_length or 0) > Config.FILE_MANAGER_MAX_CONTENT_LENGTH:
+        raise MyException.payload_too_large('request', Config.FILE_MANAGER_MAX_CONTENT_LENGTH)
+    return MultipartReceiver(options['boundary'].encode('latin-1'))
+
+
+def receive_files(stream, content_type, content_length=None):
+    """This function parses the uploaded files of a body (a binary stream), returns them
+
+    The caller must close the files (which removes their temporary files).
+    """
+    receiver = create_receiver(content_type, content_length)
+    if receiver is None:
+        return []
+    try:
+        for chunk in file_chunks(stream):
+            if receiver.receive(chunk):
+                break
+        else:
+            receiver.close()
+    except BaseException:
+        receiver.abort()
+        raise
+    return receiver.files
@@ -0,0 +1,377 @@
+# packing.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the packed store of the small blobs (Haystack-style). Instead of a file
+#    (and an inode) each, the blobs of at most 'FILE_MANAGER_PACK_MAX_SIZE' bytes are appended to
+#    large segment files and located by an in-memory index (key to segment, offset and size). The
+#    index is loaded at startup from a compact, append-only index file (one fixed-size entry per
+#    put or delete) and each blob is read with a single 'pread'. A deleted blob is only flagged, the
+#    compaction copies the live blobs of the segments that are mostly garbage and removes them.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import re
+import fcntl
+import time
+import struct
+import threading
+import contextlib
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Directory of the segments and the index file inside the files directory
+PACKS_DIRNAME = '.packs'
+INDEX_FILENAME = 'index'
+LOCK_FILENAME = '.lock'
+SEGMENT_FILENAME = 'segment-{:06d}.dat'
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{6})\.dat$')
+# Keys of the blobs that can be packed ('ab/cd/<hash>' and the suffix of their encoding)
+KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.gz|\.zst)?$')
+# NOTE: The index stores the position of the suffix, so new ones are only appended
+KEY_SUFFIXES = ('', '.gz', '.zst')
+# Header of a blob in a segment: magic, flags, suffix, hash and size (the content follows)
+HEADER = struct.Struct('<4sBB32sI')
+MAGIC = b'FMPK'
+FLAG_DELETED = 1
+# Entry of the index file: operation, suffix, hash, segment, offset (of the content) and size
+ENTRY = struct.Struct('<BB32sIQI')
+PUT, DELETE = 1, 2
+# Seconds a removed segment is kept open, for the reads that located a blob in it just before
+RETIRED_SECONDS = 60
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class PackStore(object):
+    """Appends small blobs to segment files, shared by all the processes of the host
+
+    The segments and the index file are only appended under an exclusive lock (a lock file). The
+    other processes follow the index file: a lookup that misses reads its new entries first and a
+    rewritten index file (by the compaction) is loaded again.
+    """
+
+    def __init__(self, root, segment_size):
+        self.root = root
+        self.directory = os.path.join(root, PACKS_DIRNAME)
+        self.segment_size = segment_size
+        # The blobs, by key: (segment, offset, size)
+        self.entries = {}
+        # The inode of the index file and the bytes of it read so far
+        self.inode, self.position = None, 0
+        # The segments opened for reading, by number, and the removed ones (closed a while later)
+        self.fds, self.retired = {}, []
+        self.lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def segment_path(self, segment):
+        return self.path(SEGMENT_FILENAME.format(segment))
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Holds the lock of the store (against the other threads and processes)"""
+        with self.lock:
+            with open(self.path(LOCK_FILENAME), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def segments(self):
+        """Returns the numbers of the segments, in order"""
+        names = (SEGMENT_PATTERN.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in names if match)
+
+    def load(self):
+        """Loads the index file (rebuilt from the segments if it is missing)"""
+        with self.lock:
+            if not os.path.exists(self.path(INDEX_FILENAME)):
+                with self.exclusive():
+                    if not os.path.exists(self.path(INDEX_FILENAME)):
+                        self.rebuild()
+            self.inode = None
+            self.refresh()
+            logger.info("Loaded {} packed blobs from '{}'".format(len(self.entries), self.directory))
+
+    def refresh(self):
+        """Reads the entries appended to the index file by the other processes (loads it if rewritten)"""
+        with self.lock:
+            if self.retired:
+                self.close_retired()
+            try:
+                with open(self.path(INDEX_FILENAME), 'rb') as file:
+                    stat = os.fstat(file.fileno())
+                    reloaded = stat.st_ino != self.inode
+                    position = 0 if reloaded else self.position
+                    if stat.st_size <= position:
+                        return
+                    file.seek(position)
+                    data = file.read()
+            except FileNotFoundError:
+                return
+            # NOTE: An entry torn by a crash (at the end of the file) is skipped (and cut off by 'log')
+            data = data[:len(data) - len(data) % ENTRY.size]
+            # NOTE: A rewritten index file is loaded aside, so the lookups never see a partial one
+            entries = {} if reloaded else self.entries
+            for operation, suffix, digest, segment, offset, size in ENTRY.iter_unpack(data):
+                key = blob_key(digest, suffix)
+                if operation == PUT:
+                    entries[key] = (segment, offset, size)
+                else:
+                    entries.pop(key, None)
+            self.entries, self.inode, self.position = entries, stat.st_ino, position + len(data)
+            if reloaded:
+                self.retire()
+
+    def retire(self):
+        """Sets aside the segments removed by a compaction, to be closed a while later"""
+        for segment in [segment for segment in self.fds if not os.path.exists(self.segment_path(segment))]:
+            self.retired.append((time.monotonic(), self.fds.pop(segment)))
+
+    def close_retired(self):
+        """Closes the removed segments once their last reads are surely done (so their space is freed)"""
+        while self.retired and time.monotonic() - self.retired[0][0] > RETIRED_SECONDS:
+            os.close(self.retired.pop(0)[1])
+
+    def locate(self, key):
+        """Returns the (segment, offset, size) of a blob, or None if it is not packed"""
+        location = self.entries.get(key)
+        if location is None:
+            self.refresh()
+            location = self.entries.get(key)
+        return location
+
+    def stat(self, key):
+        """Returns the size of a blob, or None if it is not packed (always up to date)"""
+        self.refresh()
+        location = self.entries.get(key)
+        return location[2] if location is not None else None
+
+    def read(self, key):
+        """Returns the content of a blob, with a single 'pread' (raises 'FileNotFoundError' if missing)"""
+        for attempt in range(2):
+            location = self.locate(key)
+            if location is None:
+                raise FileNotFoundError(key)
+            segment, offset, size = location
+            try:
+                return os.pread(self.fd(segment), size, offset)
+            except FileNotFoundError:
+                # NOTE: The segment was compacted by another process, so its index file was rewritten
+                self.refresh()
+        raise FileNotFoundError(key)
+
+    def fd(self, segment):
+        """Returns the file descriptor of a segment opened for reading"""
+        fd = self.fds.get(segment)
+        if fd is None:
+            with self.lock:
+                fd = self.fds.get(segment)
+                if fd is None:
+                    fd = self.fds[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def put(self, key, data):
+        """Appends a blob (unless it is already packed)"""
+        with self.exclusive():
+            self.refresh()
+            if key not in self.entries:
+                self.append(key, data)
+
+    def append(self, key, data):
+        """Appends a blob to the last segment and to the index file (the lock is held)"""
+        digest, suffix = parse_key(key)
+        segments = self.segments()
+        segment = segments[-1] if segments else 1
+        location = self.segment_path(segment)
+        offset = os.path.getsize(location) if segments else 0
+        if offset > 0 and offset + HEADER.size + len(data) > self.segment_size:
+            segment, offset = segment + 1, 0
+            location = self.segment_path(segment)
+        fd = os.open(location, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, HEADER.pack(MAGIC, 0, suffix, digest, len(data)) + data, offset)
+            if Config.FILE_MANAGER_FSYNC:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.log([index_entry(PUT, key, (segment, offset + HEADER.size, len(data)))])
+
+    def log(self, entries):
+        """Appends entries to the index file and reads them (the lock is held)"""
+        with open(self.path(INDEX_FILENAME), 'ab') as file:
+            # NOTE: An entry torn by a crash is cut off first, so the new ones are aligned
+            size = file.seek(0, os.SEEK_END)
+            if size % ENTRY.size:
+                logger.warning('Truncated a torn entry of the index of the packed blobs')
+                file.truncate(size - size % ENTRY.size)
+            file.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+            if Config.FILE_MANAGER_FSYNC:
+                file.flush()
+                os.fsync(file.fileno())
+        self.refresh()
+
+    def delete(self, key):
+        """Flags a blob as deleted (its space is reclaimed by the compaction), returns if it was packed"""
+        with self.exclusive():
+            self.refresh()
+            location = self.entries.get(key)
+            if location is None:
+                return False
+            segment, offset, size = location
+            fd = os.open(self.segment_path(segment), os.O_WRONLY)
+            try:
+                # NOTE: The flag of the header, so a rebuild from the segments skips the blob
+                os.pwrite(fd, bytes([FLAG_DELETED]), offset - HEADER.size + 4)
+            finally:
+                os.close(fd)
+            self.log([index_entry(DELETE, key, location)])
+            return True
+
+    def list(self, prefix=''):
+        """Yields the (key, size) of the packed blobs whose key starts with the prefix"""
+        self.refresh()
+        for key, (_, _, size) in list(self.entries.items()):
+            if key.startswith(prefix):
+                yield key, size
+
+    def scan(self, segment):
+        """Yields the (header, offset of the content) of the blobs of a segment, up to a torn one"""
+        fd = os.open(self.segment_path(segment), os.O_RDONLY)
+        try:
+            end, offset = os.fstat(fd).st_size, 0
+            while offset + HEADER.size <= end:
+                header = HEADER.unpack(os.pread(fd, HEADER.size, offset))
+                if header[0] != MAGIC or offset + HEADER.size + header[4] > end:
+                    break
+                yield header, offset + HEADER.size
+                offset += HEADER.size + header[4]
+        finally:
+            os.close(fd)
+
+    def rebuild(self):
+        """Writes the index file from the headers of the segments (the lock is held)"""
+        entries = {}
+        for segment in self.segments():
+            for (_, flags, suffix, digest, size), offset in self.scan(segment):
+                if flags & FLAG_DELETED:
+                    entries.pop((digest, suffix), None)
+                else:
+                    entries[(digest, suffix)] = (PUT, suffix, digest, segment, offset, size)
+        if entries:
+            logger.warning("Rebuilt the index of {} packed blobs from the segments".format(len(entries)))
+        self.write_index(entries.values())
+
+    def write_index(self, entries):
+        """Replaces the index file with the given entries (the lock is held)"""
+        tmp_location = self.path('.tmp-{}'.format(INDEX_FILENAME))
+        with open(tmp_location, 'wb') as file:
+            file.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_location, self.path(INDEX_FILENAME))
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def usage(self):
+        """Returns the (size, live bytes) of each segment"""
+        self.refresh()
+        live = {}
+        for segment, _, size in list(self.entries.values()):
+            live[segment] = live.get(segment, 0) + HEADER.size + size
+        return {
+            segment: (os.path.getsize(self.segment_path(segment)), live.get(segment, 0))
+            for segment in self.segments()}
+
+    def compact(self, ratio):
+        """Reclaims the space of the deleted blobs
+
+        The live blobs of each segment (but the last one) whose garbage is at least 'ratio' of its
+        size are appended to the last segment, then the segment is removed and the index file is
+        rewritten with the current entries. Returns the number of segments removed and the bytes
+        reclaimed.
+        """
+        removed, reclaimed = 0, 0
+        with self.exclusive():
+            usage = self.usage()
+            candidates = [
+                segment for segment, (size, live) in sorted(usage.items())[:-1]
+                if size == 0 or (size - live) / size >= ratio]
+            for segment in candidates:
+                moved = [(key, location) for key, location in self.entries.items() if location[0] == segment]
+                for key, (_, offset, size) in moved:
+                    self.append(key, os.pread(self.fd(segment), size, offset))
+                removed += 1
+                reclaimed += usage[segment][0] - usage[segment][1]
+            if candidates or self.position > len(self.entries) * ENTRY.size:
+                self.write_index(index_entry(PUT, key, location) for key, location in self.entries.items())
+                self.refresh()
+            for segment in candidates:
+                os.remove(self.segment_path(segment))
+            # NOTE: Other threads may be reading the removed segments, so they are closed a while later
+            self.retire()
+        return removed, reclaimed
+
+    def close(self):
+        """Closes the segments opened for reading"""
+        with self.lock:
+            for fd in [*self.fds.values(), *(fd for _, fd in self.retired)]:
+                os.close(fd)
+            self.fds, self.retired = {}, []
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def parse_key(key):
+    """This function returns the (hash, suffix position) of a key, or None if it cannot be packed"""
+    match = KEY_PATTERN.match(key)
+    if match is None:
+        return None
+    return bytes.fromhex(match.group(1)), KEY_SUFFIXES.index(match.group(2) or '')
+
+
+def blob_key(digest, suffix):
+    """This function returns the key of a blob from its (hash, suffix position)"""
+    digest = digest.hex()
+    return '{}/{}/{}{}'.format(digest[:2], digest[2:4], digest, KEY_SUFFIXES[suffix])
+
+
+def index_entry(operation, key, location):
+    """This function returns the entry of the index file of an operation on a blob"""
+    digest, suffix = parse_key(key)
+    return (operation, suffix, digest, *location)
+
+
+def packable(key, size):
+    """This function checks if a blob is packed (small enough, with the key of a blob)"""
+    return 0 < size <= Config.FILE_MANAGER_PACK_MAX_SIZE and KEY_PATTERN.match(key) is not None
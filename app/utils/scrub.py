@@ -0,0 +1,324 @@
+# scrub.py -----------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the integrity scrubber of the stored files. The blobs are named by the
+#    SHA-256 of their content, so the scrubber re-hashes them (decompressed) and quarantines the
+#    ones that do not match. A pass walks the blobs in hash order and saves its position in the
+#    index after each batch, so it resumes where it stopped. The reads are throttled to
+#    'FILE_MANAGER_SCRUB_BANDWIDTH' and run at the lowest CPU priority, so the requests are served
+#    first. It runs with 'flask scrub' or, every 'FILE_MANAGER_SCRUB_INTERVAL' seconds, inside the
+#    service.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import gzip
+import time
+import zlib
+import errno
+import fcntl
+import hashlib
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+from app.utils import index, metrics
+from app.utils.general import blob_key, file_chunks
+from app.utils.compression import open_encoded, zstandard
+from app.utils.storage import storage
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Blobs verified between two saves of the position of the pass
+SCRUB_BATCH_SIZE = 64
+# Niceness of the threads and processes that hash the blobs (the lowest priority)
+SCRUB_NICENESS = 19
+# Lock file held by the process running the scrubber of the service (one per files directory)
+LOCK_FILENAME = '.scrub.lock'
+# Errors of a blob that cannot be decoded (a corrupted or truncated stream)
+DECODING_ERRORS = (gzip.BadGzipFile, zlib.error, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+# The scrubber thread of the service
+_scrubber = {'thread': None, 'stop': threading.Event()}
+# Throttle of the reads of the current process (kept from one blob to the next)
+_throttle = {'throttle': None}
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class Throttle(object):
+    """Limits the bytes read per second (a token bucket holding one second of reads)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def wait(self, size):
+        """Takes the tokens of the bytes read, sleeping when they are exhausted"""
+        if not self.rate:
+            return
+        timestamp = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (timestamp - self.updated) * self.rate) - size
+        self.updated = timestamp
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+class ThrottledFile(object):
+    """Binary file whose reads are throttled (and counted)"""
+
+    def __init__(self, file, throttle):
+        self.file = file
+        self.throttle = throttle
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        self.throttle.wait(len(data))
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def lower_priority():
+    """This function lowers the priority of the current thread (on Linux, also its disk priority)
+
+    With the CFQ and BFQ I/O schedulers the disk priority of a thread follows its niceness.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), SCRUB_NICENESS)
+    except (AttributeError, OSError):
+        # NOTE: Only Linux sets the priority of a single thread
+        pass
+
+
+def throttle(rate):
+    """This function returns the throttle of the current process at the given rate"""
+    if _throttle['throttle'] is None or _throttle['throttle'].rate != rate:
+        _throttle['throttle'] = Throttle(rate)
+    return _throttle['throttle']
+
+
+def verify_blob(digest, encoding=None, rate=0):
+    """This function re-hashes the content of a blob
+
+    Returns the (hash, encoding, result, bytes read, error) of the blob, where the result is 'ok',
+    'corrupted' (the content does not match the hash, or cannot be decoded or read from the disk),
+    'missing' or 'error' (e.g. of the network, the blob is verified again by the next pass). It
+    runs inside the processes of the pool, so it touches neither the index, the metrics nor the logs.
+    """
+    try:
+        file = ThrottledFile(storage().get(blob_key(digest, encoding)), throttle(rate))
+    except FileNotFoundError:
+        return digest, encoding, 'missing', 0, None
+    except Exception as e:
+        return digest, encoding, 'error', 0, repr(e)
+    sha256 = hashlib.sha256()
+    try:
+        with open_encoded(file, encoding) if encoding else file as content:
+            for chunk in file_chunks(content):
+                sha256.update(chunk)
+    except Exception as e:
+        corrupted = isinstance(e, DECODING_ERRORS) or getattr(e, 'errno', None) == errno.EIO
+        return digest, encoding, 'corrupted' if corrupted else 'error', file.bytes_read, repr(e)
+    finally:
+        file.close()
+    if sha256.hexdigest() != digest:
+        return digest, encoding, 'corrupted', file.bytes_read, 'hash {}'.format(sha256.hexdigest())
+    return digest, encoding, 'ok', file.bytes_read, None
+
+
+def quarantine_blob(digest, encoding, result, error=None):
+    """This function quarantines a corrupted (or missing) blob and the files stored as it
+
+    The files fail to be read until their content is uploaded again. Returns their number.
+    """
+    key = blob_key(digest, encoding)
+    with index.transaction() as db:
+        if result == 'corrupted':
+            storage().quarantine(key)
+        elif storage().stat(key) is not None:
+            # NOTE: The blob was released and stored again meanwhile
+            return 0
+        count = index.quarantine(db, digest, encoding)
+    logger.error("Blob '{}' is {} ({}), quarantined with its {} files".format(key, result, error, count))
+    return count
+
+
+def scrub_state(restart=False):
+    """This function returns the state of the current pass, starting a new one when needed"""
+    db = index.connection()
+    row = db.execute('SELECT * FROM scrub WHERE id = 0').fetchone()
+    if row is not None and row['finished'] is None and not restart:
+        return dict(row)
+    state = {
+        'hash': None, 'encoding': None, 'started': time.time(), 'finished': None,
+        'last_finished': row['last_finished'] if row is not None else None, 'blobs': 0, 'bytes': 0,
+        'corrupted': 0, 'missing': 0,
+    }
+    save_state(state)
+    return state
+
+
+def save_state(state):
+    """This function saves the state (position and totals) of the current pass"""
+    with index.transaction() as db:
+        db.execute(
+            'INSERT OR REPLACE INTO scrub '
+            '(id, hash, encoding, started, finished, last_finished, blobs, bytes, corrupted, missing) '
+            'VALUES (0, :hash, :encoding, :started, :finished, :last_finished, :blobs, :bytes, :corrupted, '
+            ':missing)', state)
+
+
+def scrub_progress():
+    """This function returns the progress (0 to 1) of the current pass and when the last one finished
+
+    The hashes are uniformly distributed, so the position of a pass is the fraction of the hash
+    space below it.
+    """
+    row = index.connection().execute('SELECT * FROM scrub WHERE id = 0').fetchone()
+    if row is None:
+        return 0.0, None
+    if row['finished'] is not None:
+        return 1.0, row['finished']
+    return int(row['hash'][:8], 16) / 0xFFFFFFFF if row['hash'] else 0.0, row['last_finished']
+
+
+def scrub_blobs(processes=None, bandwidth=None, limit=None, restart=False, stop=None, progress=None):
+    """This function verifies the stored blobs, from where the previous pass stopped
+
+    The blobs are hashed by a pool of 'processes' (in the current thread when 1), sharing the
+    'bandwidth' (bytes per second, 0 for no limit). At most 'limit' blobs are verified, the pass
+    stops early when the 'stop' event is set and 'progress' is called with the state after each
+    batch. Returns the state of the pass.
+    """
+    processes = max(1, processes or Config.FILE_MANAGER_SCRUB_PROCESSES)
+    bandwidth = Config.FILE_MANAGER_SCRUB_BANDWIDTH if bandwidth is None else bandwidth
+    rate = bandwidth / processes if bandwidth else 0
+    state = scrub_state(restart)
+    if state['hash'] is None:
+        logger.info('Scrub pass started')
+    else:
+        logger.info("Scrub pass resumed after blob '{}'".format(state['hash']))
+    pool = ProcessPoolExecutor(processes, initializer=lower_priority) if processes > 1 else None
+    if pool is None:
+        lower_priority()
+    verified = 0
+    try:
+        while not (stop is not None and stop.is_set()):
+            size = SCRUB_BATCH_SIZE if limit is None else min(SCRUB_BATCH_SIZE, limit - verified)
+            if size <= 0:
+                break
+            position = (state['hash'], state['encoding']) if state['hash'] is not None else None
+            batch = index.blobs_after(position, size)
+            if not batch:
+                state['finished'] = state['last_finished'] = time.time()
+                logger.info('Scrub pass finished: {} blobs ({} bytes), {} corrupted, {} missing'.format(
+                    state['blobs'], state['bytes'], state['corrupted'], state['missing']))
+                break
+            digests, encodings = zip(*batch)
+            if pool is not None:
+                results = pool.map(verify_blob, digests, encodings, itertools.repeat(rate))
+            else:
+                results = map(verify_blob, digests, encodings, itertools.repeat(rate))
+            for digest, encoding, result, bytes_read, error in results:
+                metrics.inc('file_manager_scrub_blobs_total', (result,))
+                metrics.inc('file_manager_scrub_bytes_total', value=bytes_read)
+                state['blobs'] += 1
+                state['bytes'] += bytes_read
+                if result == 'error':
+                    logger.warning("Blob '{}' could not be verified: {}".format(digest, error))
+                elif result != 'ok':
+                    state[result] += 1
+                    quarantine_blob(digest, encoding, result, error)
+            state['hash'], state['encoding'] = batch[-1]
+            verified += len(batch)
+            save_state(state)
+            if progress is not None:
+                progress(state)
+        save_state(state)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return state
+
+
+def run_scrubber(stop):
+    """This function runs a scrub pass every 'FILE_MANAGER_SCRUB_INTERVAL' seconds
+
+    Only one process per files directory scrubs (the one holding the lock file), the rest wait for
+    it to exit.
+    """
+    with open(os.path.join(Config.FILES_DIR, LOCK_FILENAME), 'a') as lock:
+        while not stop.is_set():
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                stop.wait(Config.FILE_MANAGER_SCRUB_INTERVAL)
+        while not stop.is_set():
+            progress, finished = scrub_progress()
+            # NOTE: An interrupted pass is resumed at once
+            if progress == 1.0 and time.time() - finished < Config.FILE_MANAGER_SCRUB_INTERVAL:
+                stop.wait(Config.FILE_MANAGER_SCRUB_INTERVAL - (time.time() - finished))
+                continue
+            try:
+                scrub_blobs(stop=stop)
+            except Exception as e:
+                logger.exception(e)
+                stop.wait(Config.FILE_MANAGER_SCRUB_INTERVAL)
+
+
+def start_scrubber():
+    """This function starts the scrubber of the service (a daemon thread), if enabled"""
+    if Config.FILE_MANAGER_SCRUB_INTERVAL <= 0 or _scrubber['thread'] is not None:
+        return
+    logger.info('Starting the scrubber (every {} seconds, {} bytes/s)'.format(
+        Config.FILE_MANAGER_SCRUB_INTERVAL, Config.FILE_MANAGER_SCRUB_BANDWIDTH))
+    _scrubber['stop'].clear()
+    _scrubber['thread'] = threading.Thread(
+        target=run_scrubber, args=(_scrubber['stop'],), name='scrubber', daemon=True)
+    _scrubber['thread'].start()
+
+
+def stop_scrubber():
+    """This function stops the scrubber of the service (after the blobs being verified)"""
+    if _scrubber['thread'] is None:
+        return
+    _scrubber['stop'].set()
+    _scrubber['thread'].join()
+    _scrubber['thread'] = None
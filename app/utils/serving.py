@@ -0,0 +1,353 @@
+# serving.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the funtions that serve stored files over HTTP (ETag, conditional and
+#    range requests, content negotiation of the compressed files)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import ssl
+import mmap
+import uuid
+import datetime
+# Installed
+from flask import Response, request, send_file
+from werkzeug.http import is_resource_modified
+# Custom
+from app.config.settings import Config
+from app.utils import metrics
+from app.utils.cache import file_cache
+from app.utils.general import blob_key, file_chunks, file_quarantined, filename_hash, open_file, read_file_content
+from app.utils.storage import storage
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Requests with more ranges than this are served as a whole
+MAX_RANGES = 32
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class FileRange(object):
+    """A file limited to its bytes [start, stop), given to the server's 'wsgi.file_wrapper'
+
+    The position of the file is at 'start', so 'sendfile' (which reads the position from the file
+    descriptor) sends the range too.
+    """
+
+    def __init__(self, file, start, stop):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = stop - start
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size) if size > 0 else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def cache_control(filename, policy, expires=None):
+    """This function returns the 'Cache-Control' policy of a file"""
+    # Files named by their hash never change (unless they expire, which must not be cached past it)
+    if filename_hash(filename) is not None and expires is None:
+        return Config.FILE_MANAGER_CACHE_CONTROL_IMMUTABLE
+    return policy
+
+
+def satisfiable_ranges(ranges, size):
+    """This function returns the ranges of a 'Range' header as (start, stop) within the file"""
+    result = []
+    for start, stop in ranges:
+        # Suffix range (e.g. 'bytes=-500')
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            result.append((start, stop))
+    return result
+
+
+def range_length(size):
+    """This function returns the length for 'make_conditional' to serve a single range against
+
+    Multiple ranges are not served by it (they would fail with 416), so the 'Range' header is
+    ignored and the whole file is sent (RFC 9110 allows it).
+    """
+    ranges = request.range.ranges if request.range is not None else []
+    return size if len(ranges) <= 1 else None
+
+
+def if_range_matches(etag, last_modified):
+    """This function checks if the 'If-Range' header (if any) allows a partial response"""
+    if 'HTTP_IF_RANGE' not in request.environ:
+        return True
+    return not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified, ignore_if_range=False)
+
+
+def multipart_ranges(source, ranges, size, mimetype):
+    """This function returns a 'multipart/byteranges' response for the given ranges
+
+    The source is either the key of the blob or its content (bytes).
+    """
+    boundary = uuid.uuid4().hex
+    headers = [
+        '\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n'.format(
+            boundary, mimetype, start, stop - 1, size).encode('latin-1')
+        for start, stop in ranges]
+    trailer = '\r\n--{}--\r\n'.format(boundary).encode('latin-1')
+    length = sum(len(h) for h in headers) + sum(stop - start for start, stop in ranges) + len(trailer)
+
+    def generate():
+        if isinstance(source, bytes):
+            for header, (start, stop) in zip(headers, ranges):
+                yield header
+                yield source[start:stop]
+            yield trailer
+            return
+        driver = storage()
+        for header, (start, stop) in zip(headers, ranges):
+            yield header
+            for chunk in driver.stream(source, start, stop):
+                yield chunk
+        yield trailer
+
+    response = Response(generate(), status=206, direct_passthrough=True)
+    response.content_type = 'multipart/byteranges; boundary={}'.format(boundary)
+    response.content_length = length
+    return response
+
+
+def mmap_chunks(file, start, stop):
+    """This function yields the bytes [start, stop) of a file in blocks of a memory map"""
+    block_size = Config.FILE_MANAGER_MMAP_BLOCK_SIZE
+    try:
+        if stop > start:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for offset in range(start, stop, block_size):
+                    yield mapped[offset:min(offset + block_size, stop)]
+    finally:
+        file.close()
+
+
+def sends_file(environ):
+    """This function checks if the server sends the files given to its 'wsgi.file_wrapper' with 'sendfile'
+
+    Only gunicorn does (see 'app/server.py'), and not over TLS. The wrappers of the other servers
+    read the file through Python.
+    """
+    server_socket = environ.get('gunicorn.socket')
+    return environ.get('SERVER_SOFTWARE', '').startswith('gunicorn/') and server_socket is not None \
+        and not isinstance(server_socket, ssl.SSLSocket) and hasattr(os, 'sendfile')
+
+
+def open_blob(driver, key):
+    """This function opens a blob on a local filesystem, or returns None if it is not on one
+
+    A blob moved to the other tier (see 'app/utils/tiering.py') after its path was looked up is no
+    longer at that path, so it is opened at its new one.
+    """
+    try:
+        location = driver.path(key)
+        return open(location, 'rb') if location is not None else None
+    except FileNotFoundError:
+        location = driver.path(key)
+        return open(location, 'rb') if location is not None else None
+
+
+def file_body(file, start, stop):
+    """This function returns the body of the bytes [start, stop) of an open file and the path it takes
+
+    The file is given to the server's 'wsgi.file_wrapper' when the server sends it with 'sendfile'
+    (so the bytes never pass through Python), or else sent from a memory map.
+    """
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if Config.FILE_MANAGER_ZERO_COPY == 'auto' and file_wrapper is not None and sends_file(request.environ):
+        return file_wrapper(FileRange(file, start, stop), Config.FILE_MANAGER_MMAP_BLOCK_SIZE), 'sendfile'
+    return mmap_chunks(file, start, stop), 'mmap'
+
+
+def file_representation(record, accept_encodings):
+    """This function returns how a file is served to a client, as (path, key, size, etag)
+
+    The path is 'encoded' (a compressed file as it is stored, when the 'Accept-Encoding' of the
+    client allows it, with its own ETag), 'cache' (a small file, from the read cache), 'decoded'
+    (a compressed file, decompressed while it is sent) or 'stored'. Only the 'encoded' and
+    'stored' ones have the key of a blob.
+    """
+    encoding, digest = record['encoding'], record['hash']
+    if encoding is not None and accept_encodings[encoding]:
+        return 'encoded', blob_key(digest, encoding), record['stored_size'], '{}-{}'.format(digest, encoding)
+    if file_cache.cacheable(record['size']):
+        return 'cache', None, record['size'], digest
+    if encoding is not None:
+        return 'decoded', None, record['size'], digest
+    return 'stored', blob_key(digest), record['size'], digest
+
+
+def file_modified(record):
+    """This function returns when a file was last modified (stored)"""
+    return datetime.datetime.fromtimestamp(record['created'], tz=datetime.timezone.utc)
+
+
+def describe_file(response, record, etag, as_attachment):
+    """This function sets the validators of a file on a response (before it is made conditional)"""
+    response.set_etag(etag)
+    response.last_modified = file_modified(record)
+    response.accept_ranges = 'bytes'
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=record['name'])
+
+
+def file_headers(response, record, policy, path):
+    """This function sets the headers of a file's response that do not depend on its body"""
+    encoding = record['encoding']
+    if path == 'encoded':
+        response.content_encoding = encoding
+    if encoding is not None:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control(record['name'], policy, record['expires'])
+    response.headers['X-File-Version'] = str(record['version'])
+
+
+def send_stored(record, key, size, etag, as_attachment):
+    """This function returns the bytes of a blob as they are stored (whole or a single range)
+
+    Blobs that are not on a local filesystem (e.g. 's3' driver) are streamed by the driver.
+    """
+    driver = storage()
+    # NOTE: 'send_file' fails multiple ranges, so they are sent whole below
+    if Config.FILE_MANAGER_ZERO_COPY == 'off' and range_length(size) is not None:
+        try:
+            location = driver.path(key)
+            response = send_file(
+                location, mimetype=record['type'], as_attachment=as_attachment,
+                download_name=record['name'], etag=etag, last_modified=file_modified(record),
+                conditional=True) if location is not None else None
+        except FileNotFoundError:
+            # NOTE: The blob was moved to the other tier after its path was looked up, so it is sent below
+            response = None
+        if response is not None:
+            metrics.inc('file_manager_download_path_total', ('buffered',))
+            return response
+    response = Response(mimetype=record['type'], direct_passthrough=True)
+    response.content_length = size
+    describe_file(response, record, etag, as_attachment)
+    response.make_conditional(request.environ, accept_ranges=True, complete_length=range_length(size))
+    # NOTE: The body of 'HEAD' and 304 responses is never sent, so the file is not even opened
+    if request.method == 'HEAD' or response.status_code not in (200, 206):
+        return response
+    start, stop = (response.content_range.start, response.content_range.stop) \
+        if response.status_code == 206 else (0, size)
+    file = open_blob(driver, key)
+    if file is None:
+        response.response, path = driver.stream(key, start, stop), 'stream'
+    else:
+        response.response, path = file_body(file, start, stop)
+    metrics.inc('file_manager_download_path_total', (path,))
+    metrics.inc('file_manager_download_path_bytes_total', (path,), stop - start)
+    return response
+
+
+def send_decoded(record, as_attachment):
+    """This function returns the content of a compressed file, decompressed while it is streamed
+
+    A single range is served by skipping the content before it, multiple ranges are ignored (the
+    whole content is sent).
+    """
+    def generate():
+        with open_file(record) as file:
+            for chunk in file_chunks(file):
+                yield chunk
+
+    metrics.inc('file_manager_download_path_total', ('decoded',))
+    response = Response(generate(), mimetype=record['type'], direct_passthrough=True)
+    response.content_length = record['size']
+    describe_file(response, record, record['hash'], as_attachment)
+    return response.make_conditional(
+        request.environ, accept_ranges=True, complete_length=range_length(record['size']))
+
+
+def send_content(record, source, as_attachment):
+    """This function returns the (uncompressed) content of a file from its blob's key or its bytes"""
+    etag, size, last_modified = record['hash'], record['size'], file_modified(record)
+    # Multiple ranges (a single range is handled by 'make_conditional')
+    ranges = request.range.ranges if request.range is not None else []
+    if 1 < len(ranges) <= MAX_RANGES \
+            and is_resource_modified(request.environ, etag=etag, last_modified=last_modified) \
+            and if_range_matches(etag, last_modified):
+        ranges = satisfiable_ranges(ranges, size)
+        if not ranges:
+            response = Response(status=416)
+            response.headers['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+        response = multipart_ranges(source, ranges, size, record['type'])
+        metrics.inc('file_manager_download_path_total', ('multipart',))
+        describe_file(response, record, etag, as_attachment)
+        return response
+    if not isinstance(source, bytes):
+        return send_stored(record, source, size, etag, as_attachment)
+    metrics.inc('file_manager_download_path_total', ('cache',))
+    response = Response(source, mimetype=record['type'])
+    describe_file(response, record, etag, as_attachment)
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=range_length(size))
+
+
+def serve_file(record, policy, as_attachment=False):
+    """This function returns a stored file, honoring the conditional and range request headers
+
+    The strong ETag is the hash of the file's content. 'If-None-Match' and 'If-Modified-Since'
+    return 304, a single range returns 206 and multiple ranges return 206 'multipart/byteranges'.
+    The version of the file is sent as 'X-File-Version'. Small files are served from the read
+    cache (when enabled). Compressed files are sent as they are stored when the 'Accept-Encoding'
+    of the client allows it, or decompressed otherwise. The rest are sent without copying them
+    through Python ('FILE_MANAGER_ZERO_COPY'). Quarantined files (see 'app/utils/scrub.py') fail.
+    """
+    if record['quarantined'] is not None:
+        raise file_quarantined(record['name'])
+    path, key, size, etag = file_representation(record, request.accept_encodings)
+    if path == 'encoded':
+        # NOTE: Ranges apply to the compressed bytes
+        response = send_stored(record, key, size, etag, as_attachment)
+    elif path == 'cache':
+        response = send_content(record, read_file_content(record), as_attachment)
+    elif path == 'decoded':
+        response = send_decoded(record, as_attachment)
+    else:
+        response = send_content(record, key, as_attachment)
+    file_headers(response, record, policy, path)
+    return response
@@ -0,0 +1,107 @@
+# signing.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the presigned URLs of the files: URLs of 'read_file' and 'download_file'
+#    that carry an expiry time, a scope (a single file or a filename prefix, optionally a single
+#    method) and an HMAC-SHA256 of them signed by the key of the client that issued them. They are
+#    verified without any lookup beyond the configured clients, so they can be handed out (e.g. to
+#    browsers or to a CDN) instead of an API key.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import hmac
+import time
+import base64
+from urllib.parse import urlencode
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.responses import MyException
+from app.utils.limits import client_by_key_id
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# The endpoints (of the flask and the ASGI apps) served to the signed URLs
+SIGNED_ENDPOINTS = ('read_file', 'download_file')
+# The methods a signed URL can be scoped to
+SIGNED_METHODS = ('GET', 'HEAD')
+# The query arguments of a signed URL
+SIGNATURE_ARG = 'signature'
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def payload(key_id, endpoint, method, scope, expires):
+    """This function returns the signed content of a URL (its scope is 'file:<name>' or 'prefix:<prefix>')"""
+    return '{}\n{}\n{}\n{}\n{}'.format(key_id, endpoint, method or '', scope, expires).encode('utf-8')
+
+
+def sign(client, endpoint, method, scope, expires):
+    """This function returns the signature (URL-safe base64) of a URL by the key of a client"""
+    content = payload(client['key_id'], endpoint, method, scope, expires)
+    digest = hmac.digest(client['signing_key'], content, 'sha256')
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def signed_query(client, endpoint, filename=None, prefix=None, method=None, expires_in=3600):
+    """This function returns the query string that signs the URLs of an endpoint and its expiry time
+
+    The URL is valid for the given 'filename' or, with a 'prefix', for any file whose name starts
+    with it (the filename of the URL is not signed then) and, with a 'method', only for it.
+    """
+    expires = int(time.time() + expires_in)
+    scope = 'prefix:{}'.format(prefix) if prefix is not None else 'file:{}'.format(filename)
+    arguments = {'key_id': client['key_id'], 'expires': expires}
+    if prefix is not None:
+        arguments['prefix'] = prefix
+    if method is not None:
+        arguments['method'] = method
+    arguments[SIGNATURE_ARG] = sign(client, endpoint, method, scope, expires)
+    return urlencode(arguments), expires
+
+
+def verify(args, endpoint, method, filename):
+    """This function verifies the signed URL of a request and returns the client that issued it
+
+    The 'args' are the query arguments of the request. Raises 403 if the signature does not match
+    (compared in constant time), the URL is used outside its scope or it expired.
+    """
+    client = client_by_key_id(args.get('key_id'))
+    try:
+        expires = int(args.get('expires'))
+    except (TypeError, ValueError):
+        raise MyException.unauthorized()
+    prefix, scoped_method = args.get('prefix'), args.get('method')
+    if client is None or endpoint not in SIGNED_ENDPOINTS or filename is None:
+        raise MyException.unauthorized()
+    if prefix is not None and not filename.startswith(prefix):
+        raise MyException.unauthorized()
+    if scoped_method is not None and scoped_method != method:
+        raise MyException.unauthorized()
+    scope = 'prefix:{}'.format(prefix) if prefix is not None else 'file:{}'.format(filename)
+    signature = sign(client, endpoint, scoped_method, scope, expires).encode('ascii')
+    if not hmac.compare_digest(signature, args.get(SIGNATURE_ARG, '').encode('utf-8')):
+        raise MyException.unauthorized()
+    # NOTE: Checked once the signature matches, so a forged URL is never told it expired
+    if expires < time.time():
+        raise MyException.signed_url_expired()
+    return client
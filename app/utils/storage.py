@@ -0,0 +1,589 @@
+# storage.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the storage drivers of the content-addressed store. The blobs are
+#    addressed by a key (e.g. 'ab/cd/abcdef...gz') and a driver puts, gets, stats, deletes, lists
+#    and streams them: 'local' (the files directory), 'sharded' (many directories, e.g. one per
+#    disk, chosen by consistent hashing of the key) or 's3' (a bucket of an S3-compatible store).
+#    The small blobs can be packed into segment files instead (see 'app/utils/packing.py') and the
+#    cold ones moved to a slower directory (see 'app/utils/tiering.py'). Corrupted blobs are moved
+#    aside, into the quarantine of the driver.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import os
+import uuid
+import errno
+import bisect
+import shutil
+import hashlib
+import threading
+# Installed
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # NOTE: Optional, only needed for 'FILE_MANAGER_STORAGE_DRIVER=s3'
+    boto3 = None
+# Custom
+from app.config.settings import Config
+from app.utils import index
+from app.utils.packing import PackStore, packable
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Directory of the blobs inside a local root (the files directory or a shard)
+BLOBS_DIRNAME = '.blobs'
+# Directory (or key prefix) of the quarantined blobs, next to the blobs
+QUARANTINE_DIRNAME = '.quarantine'
+# The configured driver (re-created when its settings change)
+_driver = {'settings': None, 'driver': None}
+_driver_lock = threading.Lock()
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class StorageDriver(object):
+    """Interface of the storage drivers
+
+    'named' drivers also keep a hard link of each file under its name inside the files directory,
+    which the 'dedup' and 'reindex' commands rely on.
+    """
+
+    name = None
+    named = False
+
+    def put(self, key, location):
+        """Stores a local file as the given key (the first writer wins, the file is left in place)"""
+        raise NotImplementedError()
+
+    def get(self, key):
+        """Opens a blob for reading (raises 'FileNotFoundError' if it does not exist)"""
+        raise NotImplementedError()
+
+    def stat(self, key):
+        """Returns the size of a blob, or None if it does not exist"""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Deletes a blob (if it exists)"""
+        raise NotImplementedError()
+
+    def list(self, prefix=''):
+        """Yields the (key, size) of the blobs whose key starts with the prefix"""
+        raise NotImplementedError()
+
+    def stream(self, key, start=0, stop=None):
+        """Yields the bytes [start, stop) of a blob in chunks of 'FILE_MANAGER_CHUNK_SIZE'"""
+        with self.get(key) as file:
+            file.seek(start)
+            remaining = stop - start if stop is not None else None
+            while remaining is None or remaining > 0:
+                size = Config.FILE_MANAGER_CHUNK_SIZE
+                if remaining is not None:
+                    size = min(size, remaining)
+                chunk = file.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def quarantine(self, key):
+        """Moves a (corrupted) blob aside, out of the store, so it is neither served nor reused"""
+        raise NotImplementedError()
+
+    def path(self, key):
+        """Returns the local path of a blob, or None if it is not on a local filesystem"""
+        return None
+
+    def link(self, key, filename):
+        """Points a filename to a blob (only for 'named' drivers)"""
+
+    def unlink(self, filename):
+        """Removes a filename (only for 'named' drivers), returns if it existed"""
+        return True
+
+
+class LocalDriver(StorageDriver):
+    """Stores the blobs in a local directory ('<root>/.blobs/<key>')"""
+
+    name = 'local'
+
+    def __init__(self, root, named=False):
+        self.root = root
+        self.named = named
+
+    def path(self, key):
+        return os.path.join(self.root, BLOBS_DIRNAME, key)
+
+    def put(self, key, location):
+        blob = self.path(key)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # NOTE: Linking fails if the blob already exists, so the first writer wins
+            os.link(location, blob)
+        except FileExistsError:
+            logger.debug("Blob '{}' already exists".format(key))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # The file is on another filesystem (e.g. another disk), so it is copied next to the
+            # blob first
+            tmp_location = os.path.join(os.path.dirname(blob), '.tmp-{}'.format(uuid.uuid4().hex))
+            shutil.copyfile(location, tmp_location)
+            try:
+                os.chmod(tmp_location, 0o644)
+                if Config.FILE_MANAGER_FSYNC:
+                    fsync_file(tmp_location)
+                os.link(tmp_location, blob)
+            except FileExistsError:
+                logger.debug("Blob '{}' already exists".format(key))
+            finally:
+                os.remove(tmp_location)
+        if Config.FILE_MANAGER_FSYNC:
+            fsync_file(os.path.dirname(blob))
+
+    def get(self, key):
+        return open(self.path(key), 'rb')
+
+    def stat(self, key):
+        try:
+            return os.stat(self.path(key)).st_size
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def quarantine(self, key):
+        location = os.path.join(self.root, QUARANTINE_DIRNAME, key)
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        try:
+            os.replace(self.path(key), location)
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=''):
+        directory = os.path.join(self.root, BLOBS_DIRNAME)
+        for dirpath, _, filenames in os.walk(directory):
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                location = os.path.join(dirpath, name)
+                key = os.path.relpath(location, directory).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key, os.stat(location).st_size
+
+    def link(self, key, filename):
+        if not self.named:
+            return
+        file_location = os.path.join(self.root, filename)
+        tmp_location = os.path.join(self.root, '.tmp-{}'.format(uuid.uuid4().hex))
+        os.link(self.path(key), tmp_location)
+        try:
+            # Atomically replace the previous file (if any)
+            os.replace(tmp_location, file_location)
+        except:
+            os.remove(tmp_location)
+            raise
+        # NOTE: Renaming a link over another link of the same blob does nothing (e.g. the same
+        #       content stored again under the same name), so the temporary link is left behind
+        if os.path.lexists(tmp_location):
+            os.remove(tmp_location)
+        if Config.FILE_MANAGER_FSYNC:
+            fsync_file(self.root)
+
+    def unlink(self, filename):
+        if not self.named:
+            return True
+        try:
+            os.remove(os.path.join(self.root, filename))
+        except FileNotFoundError:
+            return False
+        if Config.FILE_MANAGER_FSYNC:
+            fsync_file(self.root)
+        return True
+
+
+class ShardedDriver(StorageDriver):
+    """Spreads the blobs over many local directories (e.g. one per disk)
+
+    Each key is placed on a shard by consistent hashing (a ring of 'vnodes' points per shard), so
+    adding a shard moves only about 1/N of the keys. Blobs that are not on their shard (e.g. after
+    a shard was added) are still found on the others.
+    """
+
+    name = 'sharded'
+
+    def __init__(self, roots, vnodes):
+        if not roots:
+            raise ValueError("The 'sharded' driver needs at least one shard")
+        self.shards = [LocalDriver(root) for root in roots]
+        self.ring = sorted(
+            (self.point('{}#{}'.format(root, i)), shard)
+            for shard, root in enumerate(roots) for i in range(vnodes))
+        self.points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def point(value):
+        """Returns the position of a value on the ring"""
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def shard(self, key):
+        """Returns the shard of a key"""
+        position = bisect.bisect(self.points, self.point(key)) % len(self.ring)
+        return self.shards[self.ring[position][1]]
+
+    def locate(self, key):
+        """Returns the shard holding a blob (its own shard when no shard holds it)"""
+        primary = self.shard(key)
+        if primary.stat(key) is not None:
+            return primary
+        for shard in self.shards:
+            if shard is not primary and shard.stat(key) is not None:
+                return shard
+        return primary
+
+    def put(self, key, location):
+        if self.locate(key).stat(key) is None:
+            self.shard(key).put(key, location)
+
+    def get(self, key):
+        return self.locate(key).get(key)
+
+    def stat(self, key):
+        return self.locate(key).stat(key)
+
+    def delete(self, key):
+        for shard in self.shards:
+            shard.delete(key)
+
+    def quarantine(self, key):
+        self.locate(key).quarantine(key)
+
+    def list(self, prefix=''):
+        for shard in self.shards:
+            yield from shard.list(prefix)
+
+    def path(self, key):
+        return self.locate(key).path(key)
+
+
+class S3Driver(StorageDriver):
+    """Stores the blobs in a bucket of an S3-compatible object store (AWS S3, MinIO, etc.)"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None):
+        if boto3 is None:
+            raise RuntimeError("The 's3' driver requires the 'boto3' package")
+        if not bucket:
+            raise ValueError("The 's3' driver needs a bucket ('FILE_MANAGER_S3_BUCKET')")
+        self.bucket = bucket
+        self.prefix = prefix
+        # NOTE: The clients of boto3 are thread-safe, so one is shared by all the threads
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region, aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key)
+
+    def put(self, key, location):
+        # NOTE: The content of a key never changes, so an existing object is not uploaded again
+        if self.stat(key) is None:
+            self.client.upload_file(location, self.bucket, self.prefix + key)
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(key)
+            raise
+
+    def stat(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)['ContentLength']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def quarantine(self, key):
+        # NOTE: Objects cannot be renamed, so the blob is copied (inside the store) and deleted
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key='{}{}/{}'.format(self.prefix, QUARANTINE_DIRNAME, key),
+                CopySource={'Bucket': self.bucket, 'Key': self.prefix + key})
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return
+            raise
+        self.delete(key)
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for entry in page.get('Contents', []):
+                key = entry['Key'][len(self.prefix):]
+                if not key.startswith(QUARANTINE_DIRNAME + '/'):
+                    yield key, entry['Size']
+
+    def stream(self, key, start=0, stop=None):
+        if stop is not None and stop <= start:
+            return
+        # NOTE: Only the requested range is fetched
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.prefix + key,
+            Range='bytes={}-{}'.format(start, '' if stop is None else stop - 1))
+        body = response['Body']
+        try:
+            for chunk in body.iter_chunks(Config.FILE_MANAGER_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+
+class PackedDriver(StorageDriver):
+    """Packs the small blobs into the segment files of a 'PackStore', the rest go to another driver
+
+    The packed blobs have no local path (they are streamed) and no filename on disk, so the
+    'dedup' and 'reindex' commands are not available.
+    """
+
+    named = False
+
+    def __init__(self, driver, store):
+        self.driver = driver
+        self.store = store
+        self.name = '{}+packed'.format(driver.name)
+
+    def put(self, key, location):
+        if not packable(key, os.path.getsize(location)) or self.driver.stat(key) is not None:
+            return self.driver.put(key, location)
+        with open(location, 'rb') as file:
+            self.store.put(key, file.read())
+
+    def get(self, key):
+        try:
+            return io.BytesIO(self.store.read(key))
+        except FileNotFoundError:
+            return self.driver.get(key)
+
+    def stat(self, key):
+        size = self.store.stat(key)
+        return size if size is not None else self.driver.stat(key)
+
+    def delete(self, key):
+        if not self.store.delete(key):
+            self.driver.delete(key)
+
+    def list(self, prefix=''):
+        yield from self.driver.list(prefix)
+        yield from self.store.list(prefix)
+
+    def stream(self, key, start=0, stop=None):
+        if self.store.locate(key) is None:
+            return self.driver.stream(key, start, stop)
+        return super().stream(key, start, stop)
+
+    def quarantine(self, key):
+        try:
+            content = self.store.read(key)
+        except FileNotFoundError:
+            return self.driver.quarantine(key)
+        location = os.path.join(self.store.root, QUARANTINE_DIRNAME, key)
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        with open(location, 'wb') as file:
+            file.write(content)
+        self.store.delete(key)
+
+    def path(self, key):
+        return self.driver.path(key) if self.store.locate(key) is None else None
+
+    def link(self, key, filename):
+        if self.store.locate(key) is None:
+            return self.driver.link(key, filename)
+        # NOTE: A packed blob has no filename, so the link to the previous content (if any) is removed
+        self.driver.unlink(filename)
+
+    def unlink(self, filename):
+        self.driver.unlink(filename)
+        return True
+
+    def compact(self):
+        """Reclaims the space of the deleted packed blobs, returns the segments removed and the bytes"""
+        return self.store.compact(Config.FILE_MANAGER_PACK_COMPACT_RATIO)
+
+
+class TieredDriver(StorageDriver):
+    """Keeps the blobs on a hot driver, except the cold ones, moved to a local directory (the cold tier)
+
+    The blobs on the cold tier are listed in the index ('cold_blobs'), so the tier of a key is
+    looked up there instead of probing both. New blobs are always hot. The cold blobs have no
+    filename on disk, so the 'dedup' and 'reindex' commands are not available.
+    """
+
+    named = False
+
+    def __init__(self, hot, cold):
+        self.hot = hot
+        self.cold = cold
+        self.name = '{}+tiered'.format(hot.name)
+
+    def tier(self, key):
+        """Returns the driver of the tier of a blob"""
+        return self.cold if index.is_cold(key) else self.hot
+
+    def put(self, key, location):
+        # NOTE: The first writer wins, as with the other drivers, even when it is on the cold tier
+        if self.tier(key).stat(key) is None:
+            self.hot.put(key, location)
+
+    def get(self, key):
+        try:
+            return self.tier(key).get(key)
+        except FileNotFoundError:
+            # NOTE: The blob was moved to the other tier after it was looked up
+            return self.tier(key).get(key)
+
+    def stat(self, key):
+        return self.tier(key).stat(key)
+
+    def delete(self, key):
+        driver = self.tier(key)
+        driver.delete(key)
+        if driver is self.cold:
+            index.connection().execute('DELETE FROM cold_blobs WHERE key = ?', (key,))
+
+    def list(self, prefix=''):
+        yield from self.hot.list(prefix)
+        yield from self.cold.list(prefix)
+
+    def stream(self, key, start=0, stop=None):
+        streamed = False
+        try:
+            for chunk in self.tier(key).stream(key, start, stop):
+                streamed = True
+                yield chunk
+        except FileNotFoundError:
+            if streamed:
+                raise
+            # NOTE: The blob was moved to the other tier after it was looked up
+            yield from self.tier(key).stream(key, start, stop)
+
+    def quarantine(self, key):
+        driver = self.tier(key)
+        driver.quarantine(key)
+        if driver is self.cold:
+            index.connection().execute('DELETE FROM cold_blobs WHERE key = ?', (key,))
+
+    def path(self, key):
+        return self.tier(key).path(key)
+
+    def link(self, key, filename):
+        if self.tier(key) is self.hot:
+            return self.hot.link(key, filename)
+        # NOTE: A cold blob has no filename, so the link to the previous content (if any) is removed
+        self.hot.unlink(filename)
+
+    def unlink(self, filename):
+        self.hot.unlink(filename)
+        return True
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def fsync_file(location):
+    """This function flushes a file (or a directory, i.e. the names inside it) to disk"""
+    fd = os.open(location, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def driver_settings():
+    """This function returns the settings of the configured driver"""
+    return (
+        Config.FILE_MANAGER_STORAGE_DRIVER, Config.FILES_DIR, tuple(Config.FILE_MANAGER_STORAGE_SHARDS),
+        Config.FILE_MANAGER_STORAGE_VNODES, Config.FILE_MANAGER_S3_BUCKET, Config.FILE_MANAGER_S3_PREFIX,
+        Config.FILE_MANAGER_S3_ENDPOINT_URL, Config.FILE_MANAGER_S3_REGION, Config.FILE_MANAGER_PACK_MAX_SIZE > 0,
+        Config.FILE_MANAGER_PACK_SEGMENT_SIZE, Config.FILE_MANAGER_COLD_DIR)
+
+
+def create_driver():
+    """This function creates the driver set by 'FILE_MANAGER_STORAGE_DRIVER'
+
+    The small blobs are packed and the cold ones moved to the cold tier, if set.
+    """
+    driver = create_blob_driver()
+    if Config.FILE_MANAGER_PACK_MAX_SIZE > 0:
+        driver = PackedDriver(driver, PackStore(Config.FILES_DIR, Config.FILE_MANAGER_PACK_SEGMENT_SIZE))
+    if Config.FILE_MANAGER_COLD_DIR:
+        driver = TieredDriver(driver, LocalDriver(Config.FILE_MANAGER_COLD_DIR))
+    return driver
+
+
+def create_blob_driver():
+    """This function creates the driver of the blobs set by 'FILE_MANAGER_STORAGE_DRIVER'"""
+    name = Config.FILE_MANAGER_STORAGE_DRIVER
+    if name == 'sharded':
+        return ShardedDriver(Config.FILE_MANAGER_STORAGE_SHARDS, Config.FILE_MANAGER_STORAGE_VNODES)
+    if name == 's3':
+        return S3Driver(
+            Config.FILE_MANAGER_S3_BUCKET, Config.FILE_MANAGER_S3_PREFIX, Config.FILE_MANAGER_S3_ENDPOINT_URL,
+            Config.FILE_MANAGER_S3_REGION, Config.FILE_MANAGER_S3_ACCESS_KEY_ID,
+            Config.FILE_MANAGER_S3_SECRET_ACCESS_KEY)
+    if name != 'local':
+        raise ValueError("Unknown storage driver '{}'".format(name))
+    return LocalDriver(Config.FILES_DIR, named=True)
+
+
+def storage():
+    """This function returns the configured storage driver"""
+    settings = driver_settings()
+    with _driver_lock:
+        if _driver['settings'] != settings:
+            _driver['driver'] = create_driver()
+            _driver['settings'] = settings
+            logger.info("Storage driver: '{}'".format(_driver['driver'].name))
+        return _driver['driver']
+
+
+def reset_after_fork():
+    """This function drops the driver inherited by a forked process (its connections are shared)"""
+    global _driver_lock
+    # NOTE: The lock may have been held by another thread of the parent at the time of the fork
+    _driver_lock = threading.Lock()
+    _driver.update(settings=None, driver=None)
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
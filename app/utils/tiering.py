@@ -0,0 +1,273 @@
+# tiering.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the mover of the hot/cold storage tiers. The blobs of the files not read
+#    for 'FILE_MANAGER_TIER_COLD_AFTER' seconds are moved to the cold tier (the directory
+#    'FILE_MANAGER_COLD_DIR', e.g. a HDD or a network mount) and moved back once they are read
+#    often again. The recency of the reads is the access timestamp of the index (updated at most
+#    once per 'FILE_MANAGER_INDEX_ACCESS_RESOLUTION') and their frequency a counter of the cold
+#    blobs, updated by one in 'FILE_MANAGER_TIER_SAMPLE_RATE' reads, so the reads are not written
+#    each time. The mover walks the files in the order they were last read, from where it stopped,
+#    so each run only reads the files that turned cold since the previous one. It runs with
+#    'flask tier' or, every 'FILE_MANAGER_TIER_INTERVAL' seconds, inside the service.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import time
+import fcntl
+import random
+import tempfile
+import threading
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+from app.utils import index, metrics
+from app.utils.general import blob_key
+from app.utils.storage import TieredDriver, storage
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Files read from the index at a time (the position of the mover is saved after each batch)
+TIER_BATCH_SIZE = 256
+# Lock file held by the process running the mover of the service (one per files directory)
+LOCK_FILENAME = '.tier.lock'
+# The mover thread of the service
+_mover = {'thread': None, 'stop': threading.Event()}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def tiered_storage():
+    """This function returns the configured storage driver if it is tiered (None otherwise)"""
+    driver = storage()
+    return driver if isinstance(driver, TieredDriver) else None
+
+
+def count_read(record):
+    """This function counts a read of a file whose blob is on the cold tier
+
+    Only one in 'FILE_MANAGER_TIER_SAMPLE_RATE' reads is counted (by that many), so most reads
+    write nothing.
+    """
+    rate = max(1, Config.FILE_MANAGER_TIER_SAMPLE_RATE)
+    if random.randrange(rate) or tiered_storage() is None:
+        return
+    key = blob_key(record['hash'], record['encoding'])
+    if not index.is_cold(key):
+        return
+    with index.transaction() as db:
+        db.execute('UPDATE cold_blobs SET reads = reads + ? WHERE key = ?', (rate, key))
+
+
+def blob_files(db, digest, encoding):
+    """This function returns the names of the indexed files stored as the given blob"""
+    return [row[0] for row in db.execute(
+        'SELECT name FROM files WHERE hash = ? AND encoding IS ?', (digest, encoding))]
+
+
+def demote_blob(driver, digest, encoding):
+    """This function moves a blob to the cold tier, returns if it was moved
+
+    The blob is copied first and switched to the cold tier in the transaction that checks it is
+    still referenced, so a concurrent release either happens before (and it is not moved) or after
+    (and the cold copy is deleted). The filenames of the blob are removed, so its space is freed.
+    """
+    key = blob_key(digest, encoding)
+    location, tmp_location = driver.hot.path(key), None
+    if location is None:
+        # NOTE: Blobs that are not on a local filesystem (e.g. packed) are streamed to the cold tier
+        fd, tmp_location = tempfile.mkstemp(prefix='.tmp-', dir=driver.cold.root)
+        with os.fdopen(fd, 'wb') as file:
+            for chunk in driver.hot.stream(key):
+                file.write(chunk)
+        location = tmp_location
+    try:
+        driver.cold.put(key, location)
+    except FileNotFoundError:
+        # NOTE: The blob was released meanwhile
+        return False
+    finally:
+        if tmp_location is not None:
+            os.remove(tmp_location)
+    with index.transaction() as db:
+        moved = index.references(db, digest, encoding) > 0 and driver.hot.stat(key) is not None
+        if moved:
+            db.execute(
+                'INSERT OR REPLACE INTO cold_blobs (key, hash, encoding, reads, moved) VALUES (?, ?, ?, 0, ?)',
+                (key, digest, encoding, time.time()))
+            for name in blob_files(db, digest, encoding):
+                driver.hot.unlink(name)
+            driver.hot.delete(key)
+    if not moved:
+        driver.cold.delete(key)
+    return moved
+
+
+def promote_blob(driver, key, digest, encoding):
+    """This function moves a blob back to the hot tier, returns if it was moved
+
+    As 'demote_blob' does, the blob is copied first and switched back (and its filenames linked
+    again) in the transaction that checks it is still on the cold tier.
+    """
+    location = driver.cold.path(key)
+    try:
+        driver.hot.put(key, location)
+    except FileNotFoundError:
+        # NOTE: The blob was released meanwhile
+        return False
+    with index.transaction() as db:
+        moved = db.execute('DELETE FROM cold_blobs WHERE key = ?', (key,)).rowcount > 0
+        if moved:
+            for name in blob_files(db, digest, encoding):
+                driver.hot.link(key, name)
+            driver.cold.delete(key)
+        elif index.references(db, digest, encoding) == 0:
+            driver.hot.delete(key)
+    return moved
+
+
+def mover_position():
+    """This function returns the (accessed, name) of the last file checked by the mover"""
+    row = index.connection().execute('SELECT accessed, name FROM tiering WHERE id = 0').fetchone()
+    return (row['accessed'], row['name']) if row is not None else (0.0, '')
+
+
+def save_position(position):
+    """This function saves the position of the mover"""
+    with index.transaction() as db:
+        db.execute('INSERT OR REPLACE INTO tiering (id, accessed, name) VALUES (0, ?, ?)', position)
+
+
+def demote_blobs(driver, limit=None, stop=None):
+    """This function moves to the cold tier the blobs whose files turned cold, returns their number
+
+    A blob is moved once none of its files was read for 'FILE_MANAGER_TIER_COLD_AFTER' seconds. A
+    blob still read through another file is checked again when that file turns cold.
+    """
+    db = index.connection()
+    cutoff = time.time() - Config.FILE_MANAGER_TIER_COLD_AFTER
+    position = mover_position()
+    demoted = 0
+    finished = False
+    while not finished:
+        rows = db.execute(
+            'SELECT name, hash, encoding, accessed FROM files '
+            'WHERE (accessed, name) > (?, ?) AND accessed < ? ORDER BY accessed, name LIMIT ?',
+            (*position, cutoff, TIER_BATCH_SIZE)).fetchall()
+        finished = len(rows) < TIER_BATCH_SIZE
+        for row in rows:
+            if (stop is not None and stop.is_set()) or (limit is not None and demoted >= limit):
+                finished = True
+                break
+            position = (row['accessed'], row['name'])
+            last_read, quarantined = db.execute(
+                'SELECT MAX(accessed), COUNT(quarantined) FROM files WHERE hash = ? AND encoding IS ?',
+                (row['hash'], row['encoding'])).fetchone()
+            if last_read is None or last_read >= cutoff or quarantined:
+                continue
+            if index.is_cold(blob_key(row['hash'], row['encoding']), db):
+                continue
+            if demote_blob(driver, row['hash'], row['encoding']):
+                demoted += 1
+                metrics.inc('file_manager_tier_moves_total', ('cold',))
+        save_position(position)
+    return demoted
+
+
+def promote_blobs(driver, limit=None, stop=None):
+    """This function moves back to the hot tier the cold blobs read often again, returns their number
+
+    A blob is moved once its sampled reads reach 'FILE_MANAGER_TIER_PROMOTE_READS'. The reads of the
+    rest are halved afterwards, so only the recent ones count.
+    """
+    db = index.connection()
+    rows = db.execute(
+        'SELECT key, hash, encoding FROM cold_blobs WHERE reads >= ? LIMIT ?',
+        (max(1, Config.FILE_MANAGER_TIER_PROMOTE_READS), limit if limit is not None else -1)).fetchall()
+    promoted = 0
+    for row in rows:
+        if stop is not None and stop.is_set():
+            break
+        if promote_blob(driver, row['key'], row['hash'], row['encoding']):
+            promoted += 1
+            metrics.inc('file_manager_tier_moves_total', ('hot',))
+    with index.transaction() as db:
+        db.execute('UPDATE cold_blobs SET reads = reads / 2 WHERE reads > 0')
+    return promoted
+
+
+def move_blobs(limit=None, stop=None):
+    """This function runs the mover, returns the number of blobs moved to the cold and the hot tier
+
+    At most 'limit' blobs are moved each way and it stops early when the 'stop' event is set.
+    """
+    driver = tiered_storage()
+    if driver is None:
+        raise ValueError("Tiering requires a cold tier ('FILE_MANAGER_COLD_DIR')")
+    promoted = promote_blobs(driver, limit, stop)
+    demoted = demote_blobs(driver, limit, stop)
+    if demoted or promoted:
+        logger.info('Moved {} blobs to the cold tier and {} to the hot tier'.format(demoted, promoted))
+    return demoted, promoted
+
+
+def run_mover(stop):
+    """This function runs the mover every 'FILE_MANAGER_TIER_INTERVAL' seconds
+
+    Only one process per files directory moves the blobs (the one holding the lock file), the rest
+    wait for it to exit.
+    """
+    with open(os.path.join(Config.FILES_DIR, LOCK_FILENAME), 'a') as lock:
+        while not stop.is_set():
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                stop.wait(Config.FILE_MANAGER_TIER_INTERVAL)
+        while not stop.is_set():
+            try:
+                move_blobs(stop=stop)
+            except Exception as e:
+                logger.exception(e)
+            stop.wait(Config.FILE_MANAGER_TIER_INTERVAL)
+
+
+def start_mover():
+    """This function starts the mover of the service (a daemon thread), if a cold tier is set"""
+    if not Config.FILE_MANAGER_COLD_DIR or Config.FILE_MANAGER_TIER_INTERVAL <= 0 or _mover['thread'] is not None:
+        return
+    logger.info("Starting the mover of the cold tier '{}' (every {} seconds)".format(
+        Config.FILE_MANAGER_COLD_DIR, Config.FILE_MANAGER_TIER_INTERVAL))
+    _mover['stop'].clear()
+    _mover['thread'] = threading.Thread(target=run_mover, args=(_mover['stop'],), name='mover', daemon=True)
+    _mover['thread'].start()
+
+
+def stop_mover():
+    """This function stops the mover of the service (after the blob being moved)"""
+    if _mover['thread'] is None:
+        return
+    _mover['stop'].set()
+    _mover['thread'].join()
+    _mover['thread'] = None
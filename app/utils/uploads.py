@@ -0,0 +1,317 @@
+# uploads.py ---------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the funtions of the resumable (chunked) uploads. The chunks of an upload
+#    are written, in any order, to a data file inside the files directory and the received ranges
+#    are kept in the metadata index. On finalization the data file is moved to the blob store, and
+#    the session is only deleted once the file is committed.
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Logging
+# ==================================================================================================
+#
+# Load Logging
+from app.app import logging
+logger = logging.getLogger(__name__)
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import re
+import time
+import uuid
+import threading
+# Installed
+from werkzeug.datastructures import FileStorage
+# Custom
+from app.config.settings import Config
+from app.responses import MyException
+from app.utils import index, journal
+from app.utils.compression import configured_encoding
+from app.utils.general import STORE_ATTEMPTS, check_filename, commit_blob, commit_file, file_extension, file_hash
+from app.utils.general import file_metadata, file_type, ingest_file, timestamp_to_iso, unique_filename
+from app.utils.limits import check_quota
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+UPLOADS_DIRNAME = '.uploads'
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Timestamp of the last collection of the expired uploads (per process)
+_last_collection = {'timestamp': 0.0}
+_last_collection_lock = threading.Lock()
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def upload_path(upload_id):
+    """This function returns the path of an upload's data file"""
+    return os.path.join(Config.FILES_DIR, UPLOADS_DIRNAME, upload_id)
+
+
+def merge_ranges(ranges):
+    """This function merges overlapping and adjacent (start, stop) ranges"""
+    merged = []
+    for start, stop in sorted(tuple(r) for r in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def lookup_upload(upload_id, db=None):
+    """This function returns an upload session, or raises 404 if it does not exist"""
+    db = db if db is not None else index.connection()
+    row = db.execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+    if row is None:
+        raise MyException.warning("Upload '{}' not found".format(upload_id), 404)
+    return dict(row)
+
+
+def finalizing(upload):
+    """This function checks if an upload is being finalized (by a process that is still running)"""
+    return upload['finalizer'] is not None and journal.running(upload['finalizer'], upload['finalizer_started'])
+
+
+def check_not_finalizing(upload):
+    """This function raises 409 if an upload is being finalized"""
+    if finalizing(upload):
+        raise MyException.warning("Upload '{}' is being finalized".format(upload['id']), 409)
+
+
+def upload_status(upload_id):
+    """This function returns an upload session and the byte ranges received so far"""
+    db = index.connection()
+    upload = lookup_upload(upload_id, db)
+    ranges = merge_ranges(db.execute(
+        'SELECT start, stop FROM upload_ranges WHERE id = ?', (upload_id,)).fetchall())
+    return {
+        'id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        **({'sha256': upload['hash']} if upload['hash'] else {}),
+        # NOTE: Ranges are inclusive, as in the 'Content-Range' header
+        'received': [[start, stop - 1] for start, stop in ranges],
+        'complete': upload['size'] == 0 or ranges == [[0, upload['size']]],
+        'expires': timestamp_to_iso(upload['updated'] + Config.FILE_MANAGER_UPLOAD_TTL),
+    }
+
+
+def create_upload(filename, size, digest=None, content_type=None, unique_id=False, client=None, expires=None):
+    """This function creates an upload session (refused when the file would exceed the quota of the client)
+
+    The file 'expires' at the given time (if ever), even when the upload is finalized after it. As
+    a multipart upload, it is refused (413) above 'FILE_MANAGER_MAX_FILE_SIZE'.
+    """
+    file = FileStorage(filename=filename, content_type=content_type)
+    # Validate the upload before any chunk is sent
+    if unique_id:
+        file_extension(filename)
+    else:
+        check_filename(file)
+    if not isinstance(size, int) or size < 0:
+        raise MyException.warning('Invalid size', 400)
+    if Config.FILE_MANAGER_MAX_FILE_SIZE and size > Config.FILE_MANAGER_MAX_FILE_SIZE:
+        raise MyException.payload_too_large('file', Config.FILE_MANAGER_MAX_FILE_SIZE)
+    if digest is not None and not HASH_PATTERN.match(digest):
+        raise MyException.warning('Invalid SHA-256', 400)
+    check_quota(client, size)
+    upload_id = uuid.uuid4().hex
+    location = upload_path(upload_id)
+    os.makedirs(os.path.dirname(location), exist_ok=True)
+    # NOTE: The data file is sparse, so chunks can be written at any offset in any order
+    with open(location, 'wb') as data:
+        data.truncate(size)
+    timestamp = time.time()
+    with index.transaction() as db:
+        db.execute(
+            'INSERT INTO uploads (id, filename, size, hash, type, unique_id, created, updated, expires) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (upload_id, filename, size, digest, content_type, bool(unique_id), timestamp, timestamp, expires))
+    logger.info("Upload '{}' created for '{}' ({} bytes)".format(upload_id, filename, size))
+    collect_expired_uploads()
+    return upload_status(upload_id)
+
+
+def write_chunk(upload_id, start, stop, stream, length=None):
+    """This function writes the bytes [start, stop) of an upload, read from a stream"""
+    upload = lookup_upload(upload_id)
+    # NOTE: The data file is being hashed and committed
+    check_not_finalizing(upload)
+    if start < 0 or stop > upload['size'] or start >= stop or length not in (None, upload['size']):
+        raise MyException.warning('Invalid range', 400)
+    # NOTE: The limit may have been lowered since the upload was created
+    if Config.FILE_MANAGER_MAX_FILE_SIZE and stop > Config.FILE_MANAGER_MAX_FILE_SIZE:
+        raise MyException.payload_too_large('file', Config.FILE_MANAGER_MAX_FILE_SIZE)
+    offset = start
+    fd = os.open(upload_path(upload_id), os.O_WRONLY)
+    try:
+        while offset < stop:
+            chunk = stream.read(min(Config.FILE_MANAGER_CHUNK_SIZE, stop - offset))
+            if not chunk:
+                break
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+    finally:
+        os.close(fd)
+        # Record what was written, even if the chunk was cut short
+        with index.transaction() as db:
+            if offset > start:
+                db.execute(
+                    'INSERT INTO upload_ranges (id, start, stop) VALUES (?, ?, ?)',
+                    (upload_id, start, offset))
+            db.execute('UPDATE uploads SET updated = ? WHERE id = ?', (time.time(), upload_id))
+    if offset < stop:
+        message = 'Incomplete chunk ({} of {} bytes)'.format(offset - start, stop - start)
+        raise MyException.warning(message, 400)
+    return upload_status(upload_id)
+
+
+def delete_upload(db, upload_id):
+    """This function deletes the records of an upload session and returns if it existed"""
+    db.execute('DELETE FROM upload_ranges WHERE id = ?', (upload_id,))
+    return db.execute('DELETE FROM uploads WHERE id = ?', (upload_id,)).rowcount > 0
+
+
+def claim_upload(upload_id):
+    """This function marks an upload as being finalized by the current process, returns the upload
+
+    A concurrent finalization (or chunk or abort) of the upload is refused with 409 until it is
+    released, while the claim of a process that died is taken over.
+    """
+    with index.transaction() as db:
+        upload = lookup_upload(upload_id, db)
+        check_not_finalizing(upload)
+        db.execute(
+            'UPDATE uploads SET finalizer = ?, finalizer_started = ? WHERE id = ?',
+            (os.getpid(), journal.current_started(), upload_id))
+    return upload
+
+
+def release_upload(upload_id):
+    """This function unmarks an upload that failed to be finalized, so it can be finalized again"""
+    with index.transaction() as db:
+        db.execute(
+            'UPDATE uploads SET finalizer = NULL, finalizer_started = NULL WHERE id = ? AND finalizer = ?',
+            (upload_id, os.getpid()))
+
+
+def finalize_upload(upload_id, digest=None, client=None):
+    """This function verifies a complete upload and stores it using the naming rules of 'store_file'
+
+    The file is owned by the 'client' that finalized it (if any). The upload is claimed while it is
+    finalized and only deleted once its file is committed, so a failed finalization can be retried.
+    """
+    status = upload_status(upload_id)
+    if not status['complete']:
+        raise MyException.warning('Upload is incomplete', 409, data=status)
+    upload = claim_upload(upload_id)
+    data_location = upload_path(upload_id)
+    location = data_location
+    try:
+        expected = digest or upload['hash']
+        if expected is None:
+            raise MyException.warning('Missing SHA-256', 400)
+        with open(data_location, 'rb') as data:
+            if configured_encoding() is None:
+                actual, encoding = file_hash(data), None
+                if Config.FILE_MANAGER_FSYNC:
+                    os.fsync(data.fileno())
+            else:
+                # NOTE: The data file is compressed to a new file while it is hashed
+                actual, _, location, encoding = ingest_file(FileStorage(data, upload['filename']))
+        if actual != expected:
+            raise MyException.warning('SHA-256 mismatch', 400, data={'sha256': actual})
+        content_type = file_type(upload['filename'], upload['type'])
+        file = FileStorage(filename=upload['filename'], content_type=content_type)
+        filename = unique_filename(file, digest=actual) if upload['unique_id'] else check_filename(file)
+        for attempt in range(STORE_ATTEMPTS):
+            # NOTE: The data file (or its compressed copy) is already inside the files directory, so
+            #       the 'local' driver links it instead of copying it, and it is kept for a retry
+            key, stored_encoding = commit_blob(location, actual, encoding, remove=False)
+            try:
+                version = commit_file(
+                    key, actual, upload['size'], filename, upload['type'], upload['filename'], stored_encoding,
+                    client=client, expires=upload['expires'])
+                break
+            except FileNotFoundError:
+                # The blob was released by a concurrent request, so store it again
+                if attempt == STORE_ATTEMPTS - 1:
+                    raise
+    except BaseException:
+        release_upload(upload_id)
+        raise
+    finally:
+        if location != data_location:
+            os.remove(location)
+    with index.transaction() as db:
+        delete_upload(db, upload_id)
+    os.remove(data_location)
+    logger.info("Upload '{}' stored as '{}'".format(upload_id, filename))
+    return file_metadata(file, filename, size=upload['size'], version=version, expires=upload['expires'])
+
+
+def abort_upload(upload_id):
+    """This function deletes an upload session and its data (refused while it is being finalized)"""
+    with index.transaction() as db:
+        row = db.execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+        if row is None:
+            return False
+        check_not_finalizing(dict(row))
+        delete_upload(db, upload_id)
+    try:
+        os.remove(upload_path(upload_id))
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def collect_expired_uploads(force=False):
+    """This function deletes the uploads without any chunk for 'FILE_MANAGER_UPLOAD_TTL' seconds
+
+    Unless forced, it runs at most once every 'FILE_MANAGER_UPLOAD_GC_INTERVAL' seconds per process.
+    A forced collection also deletes the data files left without a session (e.g. after a crash).
+    """
+    timestamp = time.time()
+    with _last_collection_lock:
+        elapsed = timestamp - _last_collection['timestamp']
+        if not force and elapsed < Config.FILE_MANAGER_UPLOAD_GC_INTERVAL:
+            return 0
+        _last_collection['timestamp'] = timestamp
+    cutoff = timestamp - Config.FILE_MANAGER_UPLOAD_TTL
+    with index.transaction() as db:
+        expired = [
+            row['id'] for row in db.execute('SELECT * FROM uploads WHERE updated < ?', (cutoff,))
+            if not finalizing(row)]
+        for upload_id in expired:
+            delete_upload(db, upload_id)
+    if force:
+        directory = os.path.join(Config.FILES_DIR, UPLOADS_DIRNAME)
+        sessions = {row[0] for row in index.connection().execute('SELECT id FROM uploads')}
+        if os.path.isdir(directory):
+            expired += [
+                entry.name for entry in os.scandir(directory)
+                if entry.name not in sessions and entry.name not in expired
+                and entry.stat().st_mtime < cutoff]
+    for upload_id in expired:
+        try:
+            os.remove(upload_path(upload_id))
+        except FileNotFoundError:
+            pass
+    if expired:
+        logger.info('Deleted {} expired uploads'.format(len(expired)))
+    return len(expired)
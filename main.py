@@ -24,6 +24,8 @@ logger = logging.getLogger('app')
 # Custom
 from app.app import create_app
 from app.config.settings import Config
+from app.utils import metrics
+from app.utils.background import start_background, stop_background
 
 
 # ==================================================================================================
@@ -39,4 +41,31 @@ app = create_app()
 #
 if __name__ == "__main__":
     logger.info('Starting Server...')
-    app.run(host="0.0.0.0", port=int(Config.FILE_MANAGER_PORT))
+    # Start the metrics from zero (the files of the previous run are left in the metrics directory)
+    metrics.reset()
+    if Config.FILE_MANAGER_SERVER == 'gunicorn':
+        from app.server import ProductionServer
+        logger.info("Server: gunicorn ({} workers x {} threads)".format(
+            Config.FILE_MANAGER_WORKERS, Config.FILE_MANAGER_THREADS))
+        # NOTE: The master starts and stops the background process (scrubber, reaper, mover) in its
+        #       'when_ready' and 'on_exit' hooks
+        ProductionServer(app).run()
+    else:
+        # NOTE: The scrubber, the reaper and the mover run in a background process, not in the workers
+        start_background()
+        try:
+            if Config.FILE_MANAGER_SERVER == 'uvicorn':
+                import uvicorn
+                logger.info("Server: uvicorn ({} workers, {} I/O threads each)".format(
+                    Config.FILE_MANAGER_WORKERS, Config.FILE_MANAGER_ASGI_IO_THREADS))
+                # NOTE: Each worker process creates its own app (the logging of 'logging.conf' is kept)
+                uvicorn.run(
+                    'app.asgi:create_asgi_app', factory=True, host='0.0.0.0',
+                    port=int(Config.FILE_MANAGER_PORT), workers=Config.FILE_MANAGER_WORKERS,
+                    timeout_keep_alive=Config.FILE_MANAGER_KEEPALIVE, backlog=Config.FILE_MANAGER_BACKLOG,
+                    log_config=None)
+            else:
+                logger.info('Server: werkzeug')
+                app.run(host="0.0.0.0", port=int(Config.FILE_MANAGER_PORT))
+        finally:
+            stop_background()
@@ -0,0 +1,40 @@
+# conftest.py --------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the fixtures shared by the tests
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+# NOTE: Add here the Build-in modules
+# Installed
+import pytest
+# Custom
+# NOTE: The app is imported first, as the modules of 'app.utils' expect it loaded
+from app.app import create_app
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def files_dir(tmp_path, monkeypatch):
+    """Points the files directory (and the index inside it) to a temporary directory"""
+    directory = tmp_path / 'files'
+    directory.mkdir()
+    monkeypatch.setattr(Config, 'FILES_DIR', str(directory))
+    monkeypatch.setattr(Config, 'FILE_MANAGER_INDEX_PATH', None)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_FSYNC', False)
+    return directory
+
+
+@pytest.fixture
+def client(files_dir):
+    """Returns a test client of the app storing its files in a temporary directory"""
+    return create_app().test_client()
@@ -0,0 +1,88 @@
+# test_archives.py ---------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the archives (zip, tar and tar.gz) streamed from many files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import tarfile
+import zipfile
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+FILES = {
+    'a.txt': b'text ' * 2000,
+    'b.png': bytes(range(256)) * 8,
+}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def store(client):
+    """This function stores the files of the tests"""
+    for name, content in FILES.items():
+        client.post('/storage/v1/file', data={'files[]': (io.BytesIO(content), name)})
+
+
+def archive(client, archive_format, files=tuple(FILES)):
+    """This function requests an archive of the given files"""
+    return client.post('/storage/v1/files/archive', json={'files': list(files), 'format': archive_format})
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_zip(client):
+    store(client)
+    response = archive(client, 'zip')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as result:
+        assert {name: result.read(name) for name in result.namelist()} == FILES
+        # NOTE: Files of already compressed formats are stored as they are
+        assert result.getinfo('a.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert result.getinfo('b.png').compress_type == zipfile.ZIP_STORED
+        assert result.getinfo('a.txt').date_time[0] > 1980
+
+
+def test_zip_compression_level(client, monkeypatch):
+    store(client)
+    sizes = []
+    for level in (0, 9):
+        monkeypatch.setattr(Config, 'FILE_MANAGER_ARCHIVE_COMPRESSION_LEVEL', level)
+        with zipfile.ZipFile(io.BytesIO(archive(client, 'zip', ['a.txt']).data)) as result:
+            sizes.append(result.getinfo('a.txt').compress_size)
+    assert sizes[0] > sizes[1]
+
+
+@pytest.mark.parametrize('archive_format', ['tar', 'tar.gz'])
+def test_tar(client, archive_format):
+    store(client)
+    response = archive(client, archive_format)
+    assert response.status_code == 200
+    with tarfile.open(fileobj=io.BytesIO(response.data)) as result:
+        assert {member.name: result.extractfile(member).read() for member in result} == FILES
+
+
+def test_missing_files(client):
+    store(client)
+    response = archive(client, 'zip', ['a.txt', 'missing.txt'])
+    assert response.status_code == 404
+    assert response.get_json()['data'] == ['missing.txt']
+    assert archive(client, 'rar').status_code == 400
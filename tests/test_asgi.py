@@ -0,0 +1,92 @@
+# test_asgi.py -------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the file routes served as coroutines (ASGI)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import asyncio
+# Installed
+import pytest
+# Custom
+from app.asgi import AsyncFileApp
+from app.config.settings import Config
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+CONTENT = bytes(range(256)) * 64
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def asgi_request(app, method, path, headers=None, query=b''):
+    """This function sends a request (without a body) to an ASGI app, returns its (status, headers, body)"""
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in (headers or {}).items()]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = next(message for message in messages if message['type'] == 'http.response.start')
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in start['headers']}
+    body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+    return start['status'], headers, body
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def asgi_app(client):
+    return AsyncFileApp(client.application)
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_authenticated_before_the_arguments(asgi_app, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_API_KEY', 'secret')
+    status, _, _ = asgi_request(asgi_app, 'POST', '/storage/v1/file', query=b'ttl=invalid')
+    assert status == 401
+
+
+def test_decoded_ranges(client, asgi_app, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COMPRESSION', 'gzip')
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    status, headers, body = asgi_request(asgi_app, 'GET', '/storage/v1/file/a.bin', {'Range': 'bytes=100-199'})
+    assert status == 206 and body == CONTENT[100:200]
+    assert headers['content-range'] == 'bytes 100-199/{}'.format(len(CONTENT))
+    status, _, body = asgi_request(asgi_app, 'GET', '/storage/v1/file/a.bin', {'Range': 'bytes=0-9,20-29'})
+    assert status == 200 and body == CONTENT
+
+
+@pytest.mark.parametrize('accept_encoding', ['gzip', 'identity'])
+def test_same_headers_as_the_flask_route(client, asgi_app, monkeypatch, accept_encoding):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COMPRESSION', 'gzip')
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    names = ['content-length', 'content-encoding', 'etag', 'last-modified', 'vary', 'cache-control',
+             'x-file-version', 'content-disposition']
+    response = client.get('/storage/v1/file/download/a.bin', headers={'Accept-Encoding': accept_encoding})
+    _, headers, body = asgi_request(
+        asgi_app, 'GET', '/storage/v1/file/download/a.bin', {'Accept-Encoding': accept_encoding})
+    assert {name: headers.get(name) for name in names} == {name: response.headers.get(name) for name in names}
+    assert body == response.data
@@ -0,0 +1,94 @@
+# test_background.py -------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the background process of the service
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import os
+import time
+import signal
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.utils import index, journal
+from app.utils.background import background_enabled, run_background
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def loops(monkeypatch):
+    """Runs the reaper and the replay of the journal every second, and neither the scrubber nor the mover"""
+    monkeypatch.setattr(Config, 'FILE_MANAGER_SCRUB_INTERVAL', 0)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_EXPIRY_INTERVAL', 1)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_JOURNAL_INTERVAL', 1)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COLD_DIR', None)
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def in_child(function, *args):
+    """This function runs a function in a forked process, returns its pid"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            function(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def wait_until(condition, timeout=10):
+    """This function waits for a condition, returns whether it was met before the timeout"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_enabled_by_any_loop(loops, monkeypatch):
+    assert background_enabled()
+    monkeypatch.setattr(Config, 'FILE_MANAGER_EXPIRY_INTERVAL', 0)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_JOURNAL_INTERVAL', 0)
+    assert not background_enabled()
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COLD_DIR', '/cold')
+    assert background_enabled()
+
+
+def test_reaps_and_replays_until_terminated(client, loops):
+    client.post('/storage/v1/file', query_string={'ttl': 3600}, data={'files[]': (io.BytesIO(b'a'), 'a.txt')})
+    with index.transaction() as db:
+        db.execute("UPDATE files SET expires = ? WHERE name = 'a.txt'", (time.time() - 1,))
+    # NOTE: A change of a process that crashed (e.g. a uvicorn worker)
+    os.waitpid(in_child(journal.begin, 'b.txt'), 0)
+    pid = in_child(run_background, os.getpid())
+    try:
+        assert wait_until(lambda: index.lookup('a.txt') is None and journal.abandoned() == [])
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_exits_when_orphaned(files_dir, loops):
+    # NOTE: The parent of the process is not the given one (as once the server was killed)
+    pid = in_child(run_background, os.getpid() + 1)
+    assert wait_until(lambda: os.waitpid(pid, os.WNOHANG)[0] == pid)
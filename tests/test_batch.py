@@ -0,0 +1,51 @@
+# test_batch.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the batch uploads (many files in a request)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.utils import index
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def batch(client, files):
+    """This function uploads many (filename, content) files in a request"""
+    return client.post('/storage/v1/file', data={
+        'files[]': [(io.BytesIO(content), filename) for filename, content in files]})
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_batch_returns_a_result_per_file(client):
+    files = [('{}.txt'.format(number), str(number).encode() * 100) for number in range(20)]
+    response = batch(client, files)
+    assert response.status_code == 200
+    entries = response.get_json()
+    # NOTE: Stored concurrently, yet in the order of the request
+    assert [entry['name'] for entry in entries] == [filename for filename, _ in files]
+    assert all(entry['status'] == 'success' for entry in entries)
+    assert all(index.lookup(filename) is not None for filename, _ in files)
+
+
+def test_failed_file_does_not_fail_the_batch(client):
+    response = batch(client, [('a.txt', b'a'), ('..', b'b'), ('c.txt', b'c')])
+    assert response.status_code == 207
+    entries = response.get_json()
+    assert [entry['status'] for entry in entries] == ['success', 'error', 'success']
+    assert entries[1]['name'] == '..' and entries[1]['message']
+    assert client.get('/storage/v1/file/c.txt').data == b'c'
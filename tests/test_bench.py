@@ -0,0 +1,71 @@
+# test_bench.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the helpers of the load test ('flask bench')
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import random
+# Installed
+import pytest
+# Custom
+from app.utils.bench import compare, multipart_body, parse_distribution, parse_size, percentile, sample_size
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def result(operation='download', **fields):
+    """This function returns a result of a benchmark case"""
+    return {'operation': operation, 'size': '1MB', 'concurrency': 8, 'batch': 1, **fields}
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+@pytest.mark.parametrize('text, size', [
+    ('512B', 512), ('64KB', 64 * 1024), ('1.5mb', 3 * 512 * 1024), ('1 GB', 1024 ** 3)])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize('text', ['', '10', '1TB', 'KB', '-1KB'])
+def test_invalid_size(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
+
+
+def test_distribution():
+    assert parse_distribution('1MB') == (1024 ** 2, 1024 ** 2)
+    low, high = parse_distribution('1KB-1MB')
+    rng = random.Random(0)
+    assert all(low <= sample_size((low, high), rng) <= high for _ in range(1000))
+
+
+def test_percentile_is_the_nearest_rank():
+    values = list(range(1, 101))
+    random.Random(0).shuffle(values)
+    assert [percentile(values, fraction) for fraction in (0.5, 0.95, 0.99, 1)] == [50, 95, 99, 100]
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
+
+
+def test_multipart_body_length():
+    content_type, length, body = multipart_body([('a.bin', 10), ('b.bin', 100000)], b'x' * 4096)
+    assert content_type.startswith('multipart/form-data; boundary=')
+    assert len(b''.join(body)) == length
+
+
+def test_compare_with_a_baseline():
+    baseline = {'results': [result(throughput_mib_s=100, p99_ms=20), result('upload', throughput_mib_s=50)]}
+    report = {'results': [result(throughput_mib_s=110, p99_ms=25), result(concurrency=64, throughput_mib_s=1)]}
+    # NOTE: Higher throughput and lower latency are improvements, the cases new to the report are skipped
+    changes = compare(report, baseline)
+    assert [change['change_pct'] for change in changes] == [{'throughput_mib_s': 10.0, 'p99_ms': -25.0}]
@@ -0,0 +1,70 @@
+# test_cache.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the in-memory read cache of the small files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+# Installed
+import pytest
+# Custom
+from app.utils.cache import FileCache, file_cache
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def read_cache(monkeypatch):
+    """Enables the read cache of the app, empty"""
+    monkeypatch.setattr(file_cache, 'max_bytes', 1024)
+    monkeypatch.setattr(file_cache, 'max_file_size', 512)
+    file_cache.clear()
+    yield file_cache
+    file_cache.clear()
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_least_recently_used_are_evicted():
+    cache = FileCache(10, 10)
+    cache.put('a', 'hash-a', b'aaaa')
+    cache.put('b', 'hash-b', b'bbbb')
+    assert cache.get('a', 'hash-a') == b'aaaa'
+    cache.put('c', 'hash-c', b'cccc')
+    assert cache.get('b', 'hash-b') is None
+    assert cache.get('a', 'hash-a') == b'aaaa' and cache.get('c', 'hash-c') == b'cccc'
+    assert cache.stats()['bytes'] == 8 and cache.stats()['evictions'] == 1
+    cache.put('d', 'hash-d', b'd' * 11)
+    assert cache.get('d', 'hash-d') is None
+
+
+def test_entry_of_another_content_is_dropped():
+    cache = FileCache(10, 10)
+    cache.put('a', 'old', b'old')
+    # NOTE: E.g. the file was overwritten by another process
+    assert cache.get('a', 'new') is None
+    assert cache.stats()['files'] == 0
+
+
+def test_overwritten_and_deleted_files_are_invalidated(client, read_cache):
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(b'old'), 'a.txt')})
+    assert client.get('/storage/v1/file/a.txt').data == b'old'
+    assert read_cache.stats()['files'] == 1
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(b'new'), 'a.txt')})
+    assert read_cache.stats()['files'] == 0
+    assert client.get('/storage/v1/file/a.txt').data == b'new'
+    assert client.get('/storage/v1/file/a.txt').data == b'new'
+    assert read_cache.stats()['hits'] >= 1
+    client.delete('/storage/v1/file/a.txt')
+    assert read_cache.stats()['files'] == 0
+    assert client.get('/storage/v1/file/a.txt').status_code == 404
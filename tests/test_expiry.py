@@ -0,0 +1,90 @@
+# test_expiry.py -----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the files that expire and their reaper
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import time
+# Installed
+import pytest
+# Custom
+from app.utils import index
+from app.utils.expiry import expire_files
+from app.utils.general import blob_key, remove_file
+from app.utils.storage import storage
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def store(client, filename, content, **args):
+    """This function stores a file (with its 'ttl' or 'expires_at', if any), returns the response"""
+    return client.post('/storage/v1/file', query_string=args, data={'files[]': (io.BytesIO(content), filename)})
+
+
+def expire(filename):
+    """This function makes a file expire (as if its time had come)"""
+    with index.transaction() as db:
+        db.execute('UPDATE files SET expires = ? WHERE name = ?', (time.time() - 1, filename))
+
+
+def listed(client):
+    """This function returns the filenames of the listing"""
+    return [entry['filename'] for entry in client.get('/storage/v1/files').get_json()['files']]
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_expired_file_is_missing_until_it_is_deleted(client, files_dir):
+    store(client, 'a.txt', b'expires', ttl=3600)
+    store(client, 'b.txt', b'kept')
+    assert client.get('/storage/v1/file/a.txt').status_code == 200
+    expire('a.txt')
+    assert client.get('/storage/v1/file/a.txt').status_code == 404
+    assert listed(client) == ['b.txt']
+    assert expire_files() == 1
+    assert not (files_dir / 'a.txt').exists()
+    assert index.lookup('a.txt') is None
+    assert storage().stat(blob_key(index.lookup('b.txt')['hash'])) is not None
+    assert expire_files() == 0
+
+
+def test_reaped_in_batches(client):
+    for number in range(5):
+        store(client, '{}.txt'.format(number), str(number).encode(), ttl=3600)
+        expire('{}.txt'.format(number))
+    assert expire_files(limit=2) == 2
+    assert expire_files() == 3
+
+
+def test_file_stored_again_is_kept(client):
+    store(client, 'a.txt', b'old', ttl=3600)
+    timestamp = time.time()
+    # NOTE: Overwritten after the reaper found it expired, without an expiry
+    store(client, 'a.txt', b'new')
+    assert index.lookup('a.txt')['expires'] is None
+    assert not remove_file('a.txt', expired_by=timestamp)
+    assert client.get('/storage/v1/file/a.txt').data == b'new'
+
+
+def test_expires_at(client):
+    assert store(client, 'a.txt', b'a', expires_at='2999-01-01T00:00:00Z').status_code == 200
+    assert index.lookup('a.txt')['expires'] == 32472144000
+
+
+@pytest.mark.parametrize('args', [
+    {'ttl': '-1'}, {'ttl': 'soon'}, {'ttl': 'inf'}, {'expires_at': '2000-01-01T00:00:00Z'},
+    {'ttl': '60', 'expires_at': '2999-01-01T00:00:00Z'}])
+def test_invalid_expiry(client, args):
+    assert store(client, 'a.txt', b'a', **args).status_code == 400
+    assert index.lookup('a.txt') is None
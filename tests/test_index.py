@@ -0,0 +1,58 @@
+# test_index.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the metadata index of the stored files (SQLite)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import hashlib
+import sqlite3
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.utils import index
+from app.utils.general import scan_files
+from app.utils.storage import storage
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_migrations_of_an_older_index(files_dir):
+    # NOTE: An index created by the first version, with a file in it
+    with sqlite3.connect(index.index_path()) as db:
+        for statement in index.MIGRATIONS[0]:
+            db.execute(statement)
+        db.execute('PRAGMA user_version = 1')
+        db.execute(
+            "INSERT INTO files (name, hash, size, created, accessed) VALUES ('a.TXT', 'digest', 7, 1.0, 1.0)")
+    db = index.connection()
+    assert db.execute('PRAGMA user_version').fetchone()[0] == len(index.MIGRATIONS)
+    record = index.lookup('a.TXT')
+    assert (record['hash'], record['extension'], record['version']) == ('digest', 'txt', 1)
+    assert [record['name'] for record in index.search(extension='txt')] == ['a.TXT']
+    # NOTE: A migrated index is not migrated again
+    index.migrate(db)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == len(index.MIGRATIONS)
+
+
+def test_rebuild_from_the_files_on_disk(client, files_dir):
+    for name in ('a.txt', 'b.txt'):
+        client.post('/storage/v1/file', data={'files[]': (io.BytesIO(name.encode()), name)})
+    created = index.lookup('a.txt')['created']
+    # NOTE: A file copied to the directory, and a file deleted from it, behind the service's back
+    (files_dir / 'c.txt').write_bytes(b'copied')
+    storage().unlink('b.txt')
+    assert index.rebuild(scan_files()) == 1
+    assert index.lookup('b.txt') is None
+    assert index.lookup('c.txt')['hash'] == hashlib.sha256(b'copied').hexdigest()
+    # NOTE: The files whose content did not change keep their metadata
+    assert index.lookup('a.txt')['created'] == created
+    assert index.lookup('a.txt')['version'] == 1
@@ -0,0 +1,87 @@
+# test_journal.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the write-ahead journal of the changes to the stored files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import os
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.utils import index, journal
+from app.utils.general import blob_key, link_file, replay_journal
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def crash_in_child(change):
+    """This function runs a change in a forked process that exits without completing it, returns its pid"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            change()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+def journal_ids():
+    """This function returns the ids of the journal entries"""
+    return [row[0] for row in index.connection().execute('SELECT id FROM journal')]
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_replay_after_a_crash(client, files_dir):
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(b'content'), 'a.txt')})
+    record = index.lookup('a.txt')
+
+    def change():
+        # NOTE: The filename is linked, but the process dies before it is indexed
+        journal.begin('b.txt', [(record['hash'], record['encoding'])])
+        link_file(blob_key(record['hash'], record['encoding']), 'b.txt')
+
+    pid = crash_in_child(change)
+    assert (files_dir / 'b.txt').exists()
+    assert len(journal.abandoned(pid)) == 1
+    assert replay_journal(pid) == 1
+    assert not (files_dir / 'b.txt').exists()
+    assert journal_ids() == []
+    # NOTE: The blob is still referenced by 'a.txt', so it is kept
+    assert client.get('/storage/v1/file/a.txt').data == b'content'
+
+
+def test_replay_restores_an_overwritten_file(client, files_dir):
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(b'old'), 'a.txt')})
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(b'new'), 'b.txt')})
+    new = index.lookup('b.txt')
+
+    def change():
+        journal.begin('a.txt')
+        link_file(blob_key(new['hash'], new['encoding']), 'a.txt')
+
+    crash_in_child(change)
+    assert (files_dir / 'a.txt').read_bytes() == b'new'
+    assert replay_journal() == 1
+    assert (files_dir / 'a.txt').read_bytes() == b'old'
+
+
+def test_entries_of_running_processes_are_kept(files_dir):
+    entry_id = journal.begin('a.txt')
+    assert journal.abandoned() == []
+    # NOTE: An entry of a previous process with the same pid (e.g. a restarted container)
+    with index.transaction() as db:
+        db.execute('UPDATE journal SET started = started - 1 WHERE id = ?', (entry_id,))
+    assert [entry['id'] for entry in journal.abandoned()] == [entry_id]
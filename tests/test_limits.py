@@ -0,0 +1,108 @@
+# test_limits.py -----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the per-API-key rate limits and storage quotas
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import uuid
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.utils import limits
+from app.utils.limits import MemoryBackend, SQLiteBackend, take_tokens
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the token buckets with one that only moves when told"""
+    now = [1000.0]
+    monkeypatch.setattr(limits.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def api_key(monkeypatch):
+    """Returns a function that configures the limits of a new API key and returns its headers"""
+    def configure(**key_limits):
+        key = uuid.uuid4().hex
+        # NOTE: A new name per key, so the buckets kept by the backend are new too
+        key_limits.setdefault('name', 'client-{}'.format(key[:8]))
+        monkeypatch.setattr(Config, 'FILE_MANAGER_API_KEYS', {key: key_limits})
+        return {Config.FILE_MANAGER_API_KEY_HEADER: key}
+    return configure
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_bucket_refills_at_its_rate(clock):
+    bucket, wait = take_tokens(None, 10, 20, 20)
+    assert bucket == (0, 1000.0) and wait == 0
+    bucket, wait = take_tokens(bucket, 10, 20, 5)
+    assert wait == pytest.approx(0.5)
+    clock[0] += 0.5
+    bucket, wait = take_tokens(bucket, 10, 20, 5)
+    assert wait == 0 and bucket[0] == pytest.approx(0)
+    # NOTE: The bucket never holds more than its capacity
+    clock[0] += 100
+    bucket, wait = take_tokens(bucket, 10, 20, 0)
+    assert bucket[0] == 20
+
+
+def test_bucket_goes_into_debt(clock):
+    # NOTE: An amount above the capacity is taken from a full bucket
+    bucket, wait = take_tokens(None, 10, 20, 50)
+    assert wait == 0 and bucket[0] == -30
+    bucket, wait = take_tokens(bucket, 10, 20, 1)
+    assert wait == pytest.approx(3.1)
+    bucket, wait = take_tokens(bucket, 10, 20, 5, force=True)
+    assert wait == 0 and bucket[0] == -35
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_backends(clock, tmp_path, backend):
+    buckets = MemoryBackend() if backend == 'memory' else SQLiteBackend(str(tmp_path / 'limits.db'))
+    assert [buckets.take('a', 1, 2, 1) for _ in range(3)] == [0, 0, 1]
+    assert buckets.take('b', 1, 2, 1) == 0
+    clock[0] += 1
+    assert buckets.take('a', 1, 2, 1) == 0
+
+
+def test_request_rate(client, api_key):
+    headers = api_key(requests_per_second=1, requests_burst=2)
+    statuses = [client.get('/storage/v1/file/a.txt', headers=headers).status_code for _ in range(3)]
+    assert statuses == [404, 404, 429]
+    response = client.get('/storage/v1/file/a.txt', headers=headers)
+    assert response.status_code == 429 and int(response.headers['Retry-After']) >= 1
+    # NOTE: The other clients are not limited
+    assert client.get('/storage/v1/file/a.txt', headers=api_key()).status_code == 404
+
+
+def test_quota_of_files(client, api_key):
+    headers = api_key(max_files=1)
+    response = client.post('/storage/v1/file', headers=headers, data={'files[]': (io.BytesIO(b'a'), 'a.txt')})
+    assert response.status_code == 200
+    response = client.post('/storage/v1/file', headers=headers, data={'files[]': (io.BytesIO(b'b'), 'b.txt')})
+    assert response.status_code == 403 and response.json['data'] == {'limit': 'files', 'max': 1}
+    assert client.get('/storage/v1/file/b.txt').status_code == 404
+
+
+def test_quota_of_bytes_before_the_body(client, api_key):
+    headers = api_key(max_bytes=1000)
+    data = {'files[]': (io.BytesIO(b'x' * 2000), 'a.txt')}
+    response = client.post('/storage/v1/file', headers=headers, data=data)
+    assert response.status_code == 403 and response.json['data'] == {'limit': 'bytes', 'max': 1000}
+    assert client.get('/storage/v1/file/a.txt').status_code == 404
@@ -0,0 +1,80 @@
+# test_listing.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the paginated and filtered listing of the stored files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+# Installed
+import pytest
+# Custom
+# NOTE: Add here the Custom modules
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+# Filename -> size
+FILES = {'a.txt': 30, 'b.json': 10, 'c.txt': 20, 'd.TXT': 50, 'logs-1.txt': 40, 'logs-2.txt': 5}
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def store(client):
+    """This function stores the files of the tests"""
+    for name, size in FILES.items():
+        client.post('/storage/v1/file', data={'files[]': (io.BytesIO(name[0].encode() * size), name)})
+
+
+def list_all(client, **args):
+    """This function follows the cursors of a listing, returns the filenames of all its pages"""
+    names, cursor = [], None
+    while True:
+        query = dict(args, **({'cursor': cursor} if cursor else {}))
+        data = client.get('/storage/v1/files', query_string=query).get_json()
+        names += [entry['filename'] for entry in data['files']]
+        cursor = data['next_cursor']
+        if cursor is None:
+            return names
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+@pytest.mark.parametrize('limit', [1, 2, 6, 100])
+def test_pages_by_name(client, limit):
+    store(client)
+    assert list_all(client, limit=limit) == sorted(FILES)
+    assert list_all(client, limit=limit, order='desc') == sorted(FILES, reverse=True)
+
+
+def test_pages_by_size(client):
+    store(client)
+    by_size = sorted(FILES, key=FILES.get)
+    assert list_all(client, limit=2, sort='size') == by_size
+    assert list_all(client, limit=4, sort='size', order='desc') == by_size[::-1]
+
+
+def test_filters(client):
+    store(client)
+    assert list_all(client, prefix='logs-') == ['logs-1.txt', 'logs-2.txt']
+    # NOTE: The extension is matched regardless of its case
+    assert list_all(client, extension='txt') == ['a.txt', 'c.txt', 'd.TXT', 'logs-1.txt', 'logs-2.txt']
+    assert list_all(client, min_size=20, max_size=40, limit=1) == ['a.txt', 'c.txt', 'logs-1.txt']
+    assert list_all(client, created_after='2000-01-01T00:00:00+00:00', extension='json') == ['b.json']
+    assert list_all(client, created_before='2000-01-01T00:00:00+00:00') == []
+
+
+@pytest.mark.parametrize('query', [{'sort': 'hash'}, {'order': 'up'}, {'limit': 0}, {'cursor': 'invalid'}])
+def test_invalid_listing(client, query):
+    assert client.get('/storage/v1/files', query_string=query).status_code == 400
@@ -0,0 +1,75 @@
+# test_logs.py -------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the logging pipeline
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import time
+import logging
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.logs import APP_LOGGER, SamplingFilter, WriterHandler, restore_records, route_records, serve_records
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_sampling_is_shared_by_the_handlers():
+    sampling = SamplingFilter(['app.routes'], 4)
+    kept = {'stdout': [], 'file': []}
+    for number in range(40):
+        record = logging.LogRecord('app.routes.alive', logging.INFO, __file__, 1, str(number), None, None)
+        for handler in kept:
+            if sampling.filter(record):
+                kept[handler].append(number)
+    assert kept['stdout'] == kept['file'] == list(range(0, 40, 4))
+
+
+def test_sampling_keeps_the_warnings_and_other_loggers():
+    sampling = SamplingFilter(['app.routes'], 4)
+    warning = logging.LogRecord('app.routes.alive', logging.WARNING, __file__, 1, 'warning', None, None)
+    other = logging.LogRecord('app.utils.index', logging.INFO, __file__, 1, 'info', None, None)
+    assert all(sampling.filter(warning) and sampling.filter(other) for _ in range(8))
+
+
+def test_records_are_written_by_a_single_writer(tmp_path, monkeypatch):
+    location = tmp_path / 'rest-api.log'
+    handler = logging.FileHandler(str(location))
+    handler.setFormatter(logging.Formatter('%(name)s | %(funcName)s | %(message)s'))
+    monkeypatch.setattr(logging.getLogger(APP_LOGGER), 'handlers', [handler])
+    address = str(tmp_path / 'log.sock')
+    writer = serve_records(address)
+    route_records(address)
+    try:
+        assert isinstance(logging.getLogger(APP_LOGGER).handlers[0], WriterHandler)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # NOTE: The connection of the parent is not shared, the child opens its own
+                try:
+                    raise ValueError('failed')
+                except ValueError:
+                    logging.getLogger('app.worker').exception('Worker %s', 'error')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        deadline = time.monotonic() + 5
+        while 'ValueError' not in location.read_text() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        lines = location.read_text().splitlines()
+        assert lines[0] == 'app.worker | test_records_are_written_by_a_single_writer | Worker error'
+        assert lines[-1] == 'ValueError: failed'
+    finally:
+        restore_records()
+        writer.shutdown()
+        writer.server_close()
+    assert logging.getLogger(APP_LOGGER).handlers == [handler]
@@ -0,0 +1,110 @@
+# test_metrics.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the metrics shared by the threads and the worker processes
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import threading
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.utils import metrics
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    """Points the metric files to a temporary directory, with a new file for this process"""
+    directory = tmp_path / 'metrics'
+    monkeypatch.setattr(Config, 'FILE_MANAGER_METRICS', True)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_METRICS_DIR', str(directory))
+    monkeypatch.setitem(metrics._process, 'values', None)
+    return directory
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def in_child(function):
+    """This function runs a function in a forked process, returns its pid once it has exited"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            function()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_threads_share_the_file_of_the_process(metrics_dir):
+    def requests():
+        for _ in range(1000):
+            metrics.inc('file_manager_http_requests_total', ('files.read_file', 200))
+            metrics.observe('file_manager_http_request_duration_seconds', ('files.read_file', 200), 0.003)
+
+    threads = [threading.Thread(target=requests) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    totals = metrics.collect()
+    assert sorted(os.listdir(metrics_dir)) == [metrics.LOCK_FILENAME, '{}.metrics'.format(os.getpid())]
+    assert totals[('file_manager_http_requests_total', ('files.read_file', 200))] == [8000]
+    histogram = totals[('file_manager_http_request_duration_seconds', ('files.read_file', 200))]
+    assert histogram[2] == 8000
+    assert histogram[-1] == pytest.approx(24.0)
+
+
+def test_file_grows(metrics_dir):
+    for i in range(5000):
+        metrics.inc('file_manager_io_bytes_total', ('operation-{}'.format(i),), i)
+    assert metrics._process['values'].size > metrics.INITIAL_FILE_SIZE
+    totals = metrics.collect()
+    assert len(totals) == 5000
+    assert totals[('file_manager_io_bytes_total', ('operation-4999',))] == [4999]
+
+
+def test_exited_process_is_merged(metrics_dir):
+    metrics.inc('file_manager_http_requests_total', ('files.read_file', 200))
+
+    def worker():
+        metrics.inc('file_manager_http_requests_total', ('files.read_file', 200), 2)
+        metrics.inc('file_manager_http_requests_in_flight')
+
+    first, second = in_child(worker), in_child(worker)
+    metrics.merge_process(first)
+    assert not (metrics_dir / '{}.metrics'.format(first)).exists()
+    assert (metrics_dir / metrics.MERGED_FILENAME).exists()
+    # NOTE: The second one is merged when read, and the requests in flight of both are dropped
+    totals = metrics.collect()
+    assert not (metrics_dir / '{}.metrics'.format(second)).exists()
+    assert totals[('file_manager_http_requests_total', ('files.read_file', 200))] == [5]
+    assert ('file_manager_http_requests_in_flight', ()) not in totals
+    assert sorted(os.listdir(metrics_dir)) == [
+        metrics.LOCK_FILENAME, '{}.metrics'.format(os.getpid()), metrics.MERGED_FILENAME]
+
+
+def test_reused_pid_is_merged(metrics_dir):
+    # NOTE: A file left with the pid of this process (by an exited one) is merged before it is replaced
+    metrics_dir.mkdir()
+    metrics.write_values(str(metrics_dir / '{}.metrics'.format(os.getpid())), {
+        ('file_manager_expired_files_total', ()): [3.0]})
+    metrics.inc('file_manager_expired_files_total')
+    assert metrics.collect()[('file_manager_expired_files_total', ())] == [4]
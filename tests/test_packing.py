@@ -0,0 +1,155 @@
+# test_packing.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the packed store of the small blobs
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import hashlib
+import threading
+# Installed
+import pytest
+# Custom
+from app.utils.packing import ENTRY, INDEX_FILENAME, PackStore
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def key_of(content, suffix=''):
+    """This function returns the key of a blob as the blob store names it"""
+    digest = hashlib.sha256(content).hexdigest()
+    return '{}/{}/{}{}'.format(digest[:2], digest[2:4], digest, suffix)
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_put_read_delete(files_dir):
+    store = PackStore(str(files_dir), 1024)
+    key = key_of(b'one')
+    store.put(key, b'one')
+    assert store.read(key) == b'one'
+    assert store.stat(key) == 3
+    assert store.delete(key)
+    assert store.stat(key) is None
+    with pytest.raises(FileNotFoundError):
+        store.read(key)
+
+
+def test_reopen_reads_the_index(files_dir):
+    store = PackStore(str(files_dir), 1024)
+    store.put(key_of(b'one'), b'one')
+    store.put(key_of(b'two', '.gz'), b'two')
+    store.close()
+    store = PackStore(str(files_dir), 1024)
+    assert store.read(key_of(b'one')) == b'one'
+    assert store.read(key_of(b'two', '.gz')) == b'two'
+
+
+def test_other_store_follows_the_index(files_dir):
+    writer, reader = PackStore(str(files_dir), 1024), PackStore(str(files_dir), 1024)
+    writer.put(key_of(b'one'), b'one')
+    assert reader.read(key_of(b'one')) == b'one'
+
+
+def test_torn_entry_is_cut_off(files_dir):
+    store = PackStore(str(files_dir), 1024)
+    store.put(key_of(b'one'), b'one')
+    store.close()
+    # NOTE: A crash in the middle of an append leaves part of an entry at the end of the index
+    location = os.path.join(store.directory, INDEX_FILENAME)
+    with open(location, 'ab') as file:
+        file.write(b'\x01' * 7)
+    store = PackStore(str(files_dir), 1024)
+    assert store.read(key_of(b'one')) == b'one'
+    store.put(key_of(b'two'), b'two')
+    assert os.path.getsize(location) % ENTRY.size == 0
+    assert store.read(key_of(b'two')) == b'two'
+    store.close()
+    store = PackStore(str(files_dir), 1024)
+    assert store.read(key_of(b'one')) == b'one'
+    assert store.read(key_of(b'two')) == b'two'
+
+
+def test_rebuild_from_the_segments(files_dir):
+    store = PackStore(str(files_dir), 1024)
+    store.put(key_of(b'one'), b'one')
+    store.put(key_of(b'two'), b'two')
+    store.delete(key_of(b'one'))
+    store.close()
+    os.remove(os.path.join(store.directory, INDEX_FILENAME))
+    store = PackStore(str(files_dir), 1024)
+    assert store.stat(key_of(b'one')) is None
+    assert store.read(key_of(b'two')) == b'two'
+
+
+def test_compaction_keeps_the_live_blobs(files_dir):
+    store = PackStore(str(files_dir), 300)
+    contents = [bytes([i]) * 100 for i in range(6)]
+    for content in contents:
+        store.put(key_of(content), content)
+    assert len(store.segments()) == 3
+    for content in contents[:3]:
+        store.delete(key_of(content))
+    other = PackStore(str(files_dir), 300)
+    removed, reclaimed = store.compact(0.5)
+    assert removed >= 1 and reclaimed > 0
+    for content in contents[3:]:
+        assert store.read(key_of(content)) == content
+        # NOTE: Another process follows the rewritten index
+        assert other.read(key_of(content)) == content
+    for content in contents[:3]:
+        assert store.stat(key_of(content)) is None
+    store.close()
+    store = PackStore(str(files_dir), 300)
+    for content in contents[3:]:
+        assert store.read(key_of(content)) == content
+
+
+def test_reads_during_compaction(files_dir):
+    store = PackStore(str(files_dir), 300)
+    contents = [i.to_bytes(2, 'big') * 50 for i in range(60)]
+    for content in contents:
+        store.put(key_of(content), content)
+    live = contents[1::2]
+    for content in contents[::2]:
+        store.delete(key_of(content))
+    # NOTE: The segments are opened before the compaction, as by the reads in progress
+    fds = [store.fd(segment) for segment in store.segments()]
+    stop, errors = threading.Event(), []
+
+    def reads():
+        while not stop.is_set():
+            for content in live:
+                try:
+                    if store.read(key_of(content)) != content:
+                        errors.append(content)
+                except Exception as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=reads) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        removed, _ = store.compact(0.4)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert removed > 0
+    assert errors == []
+    # NOTE: The removed segments are set aside, still open, instead of being closed under the reads
+    assert len(store.retired) == removed
+    for fd in fds:
+        os.fstat(fd)
+    for content in live:
+        assert store.read(key_of(content)) == content
@@ -0,0 +1,78 @@
+# test_scrub.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the integrity scrubber of the stored blobs
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import os
+# Installed
+import pytest
+# Custom
+from app.utils import index, scrub
+from app.utils.general import blob_key
+from app.utils.scrub import scrub_blobs, scrub_progress, verify_blob
+from app.utils.storage import storage
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def stored(client, monkeypatch):
+    """Stores three files and returns their hashes (the test process keeps its priority)"""
+    monkeypatch.setattr(scrub, 'lower_priority', lambda: None)
+    for name in ('a.txt', 'b.txt', 'c.txt'):
+        client.post('/storage/v1/file', data={'files[]': (io.BytesIO(name.encode() * 100), name)})
+    return {name: index.lookup(name)['hash'] for name in ('a.txt', 'b.txt', 'c.txt')}
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_intact_blobs(stored):
+    state = scrub_blobs(processes=1)
+    assert (state['blobs'], state['corrupted'], state['missing']) == (3, 0, 0)
+    assert state['finished'] is not None
+    assert scrub_progress() == (1.0, state['finished'])
+
+
+def test_corrupted_blob_is_quarantined(client, stored):
+    key = blob_key(stored['a.txt'])
+    # NOTE: A bit flipped on the disk
+    with open(storage().path(key), 'r+b') as file:
+        file.write(b'A')
+    assert verify_blob(stored['a.txt'])[2] == 'corrupted'
+    state = scrub_blobs(processes=1)
+    assert (state['corrupted'], state['missing']) == (1, 0)
+    assert storage().stat(key) is None
+    assert index.lookup('a.txt')['quarantined'] is not None
+    assert client.get('/storage/v1/file/a.txt').status_code == 500
+    assert client.get('/storage/v1/file/b.txt').status_code == 200
+    # NOTE: Uploading the content again heals the file
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(b'a.txt' * 100), 'a.txt')})
+    assert index.lookup('a.txt')['quarantined'] is None
+    assert client.get('/storage/v1/file/a.txt').data == b'a.txt' * 100
+
+
+def test_missing_blob_is_quarantined(stored):
+    os.remove(storage().path(blob_key(stored['b.txt'])))
+    state = scrub_blobs(processes=1)
+    assert (state['corrupted'], state['missing']) == (0, 1)
+    assert index.lookup('b.txt')['quarantined'] is not None
+
+
+def test_pass_resumes_where_it_stopped(stored):
+    state = scrub_blobs(processes=1, limit=2)
+    assert state['blobs'] == 2 and state['finished'] is None
+    assert 0 < scrub_progress()[0] < 1
+    state = scrub_blobs(processes=1)
+    assert state['blobs'] == 3 and state['finished'] is not None
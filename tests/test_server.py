@@ -0,0 +1,79 @@
+# test_server.py -----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the production server (gunicorn) and its hooks
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import types
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app import server
+from app.config.settings import Config
+from app.utils import journal, metrics
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def exited_child(change):
+    """This function runs a change in a forked process that exits without completing it, returns its pid"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            change()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_server_options(client, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_WORKERS', 3)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_THREADS', 5)
+    options = server.server_options()
+    assert (options['workers'], options['threads'], options['worker_class']) == (3, 5, 'gthread')
+    assert options['preload_app'] and options['sendfile']
+    assert options['max_requests_jitter'] == Config.FILE_MANAGER_MAX_REQUESTS // 10
+    production = server.ProductionServer(client.application, options)
+    assert production.cfg.workers == 3 and production.cfg.preload_app
+    assert production.cfg.when_ready is server.server_ready and production.cfg.child_exit is server.worker_exited
+    assert production.load() is client.application
+
+
+def test_background_process_follows_the_master(monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, 'start_background', lambda: calls.append('start'))
+    monkeypatch.setattr(server, 'stop_background', lambda: calls.append('stop'))
+    server.server_ready(None)
+    server.server_exiting(None)
+    assert calls == ['start', 'stop']
+
+
+def test_exited_worker_is_completed(files_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_METRICS', True)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_METRICS_DIR', str(tmp_path / 'metrics'))
+    monkeypatch.setitem(metrics._process, 'values', None)
+
+    def worker():
+        journal.begin('a.txt')
+        metrics.inc('file_manager_expired_files_total', value=2)
+
+    pid = exited_child(worker)
+    server.worker_exited(None, types.SimpleNamespace(pid=pid))
+    # NOTE: The change of the worker is completed and its metrics are kept
+    assert journal.abandoned() == []
+    assert not os.path.exists(metrics.process_path(pid))
+    assert metrics.collect()[('file_manager_expired_files_total', ())] == [2]
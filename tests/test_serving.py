@@ -0,0 +1,98 @@
+# test_serving.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the file serving (conditional and range requests)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import os
+import ssl
+import socket
+import hashlib
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.utils.serving import FileRange, sends_file
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+CONTENT = bytes(range(256)) * 64
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_etag_and_conditional_requests(client):
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    response = client.get('/storage/v1/file/a.bin')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert etag == '"{}"'.format(hashlib.sha256(CONTENT).hexdigest())
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert client.get('/storage/v1/file/a.bin', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/storage/v1/file/a.bin', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get('/storage/v1/file/a.bin', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_single_range(client):
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    response = client.get('/storage/v1/file/a.bin', headers={'Range': 'bytes=-16'})
+    assert response.status_code == 206 and response.data == CONTENT[-16:]
+    assert response.headers['Content-Range'] == 'bytes {}-{}/{}'.format(len(CONTENT) - 16, len(CONTENT) - 1, len(CONTENT))
+    response = client.get('/storage/v1/file/a.bin', headers={'Range': 'bytes={}-'.format(len(CONTENT))})
+    assert response.status_code == 416
+    # NOTE: A range of another version of the file (see 'If-Range') returns the whole file
+    response = client.get('/storage/v1/file/a.bin', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200 and response.data == CONTENT
+
+
+@pytest.mark.parametrize('compression, cache', [('none', 0), ('gzip', 0), ('gzip', 1024 * 1024)])
+def test_multiple_ranges_are_never_unsatisfiable(client, monkeypatch, compression, cache):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COMPRESSION', compression)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_READ_CACHE_MAX_BYTES', cache)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_READ_CACHE_MAX_FILE_SIZE', cache)
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    response = client.get('/storage/v1/file/a.bin', headers={'Range': 'bytes=10-19,30-39'})
+    assert response.status_code in (200, 206)
+    if response.status_code == 200:
+        assert response.data == CONTENT
+    else:
+        assert response.mimetype == 'multipart/byteranges'
+        assert CONTENT[10:20] in response.data and CONTENT[30:40] in response.data
+    response = client.get('/storage/v1/file/a.bin', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206 and response.data == CONTENT[10:20]
+
+
+def test_encoded_multiple_ranges_are_sent_whole(client, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COMPRESSION', 'gzip')
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    response = client.get(
+        '/storage/v1/file/a.bin', headers={'Range': 'bytes=0-9,20-29', 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200 and response.content_encoding == 'gzip'
+
+
+def test_file_range_is_limited(tmp_path):
+    location = tmp_path / 'a.bin'
+    location.write_bytes(CONTENT)
+    body = FileRange(open(location, 'rb'), 10, 1000)
+    assert os.lseek(body.fileno(), 0, os.SEEK_CUR) == 10
+    assert b''.join(iter(lambda: body.read(300), b'')) == CONTENT[10:1000]
+    body.close()
+
+
+def test_sendfile_only_on_gunicorn_without_tls():
+    with socket.socket() as server_socket:
+        assert sends_file({'SERVER_SOFTWARE': 'gunicorn/21.2.0', 'gunicorn.socket': server_socket})
+    tls_socket = ssl.SSLSocket.__new__(ssl.SSLSocket)
+    assert not sends_file({'SERVER_SOFTWARE': 'gunicorn/21.2.0', 'gunicorn.socket': tls_socket})
+    assert not sends_file({'SERVER_SOFTWARE': 'Werkzeug/2.2.2', 'wsgi.file_wrapper': object})
@@ -0,0 +1,131 @@
+# test_signing.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the presigned URLs of the files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+from urllib.parse import parse_qsl
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.responses import MyException
+from app.utils import signing
+from app.utils.limits import identify
+from app.utils.signing import signed_query, verify
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+API_KEY = 'signing-key'
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def signer(monkeypatch):
+    """Returns the client that signs the URLs"""
+    monkeypatch.setattr(Config, 'FILE_MANAGER_API_KEYS', {API_KEY: {'name': 'signer'}})
+    return identify(API_KEY)
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def signed_args(client, *args, **kwargs):
+    """This function returns the query arguments of a signed URL"""
+    return dict(parse_qsl(signed_query(client, *args, **kwargs)[0]))
+
+
+def refused(args, endpoint, method, filename):
+    """This function returns the message of the refusal of a signed URL (None if it is accepted)"""
+    try:
+        verify(args, endpoint, method, filename)
+    except MyException as e:
+        return e.message
+    return None
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_file_scope(signer):
+    args = signed_args(signer, 'read_file', filename='a.txt')
+    assert verify(args, 'read_file', 'GET', 'a.txt') is signer
+    assert verify(args, 'read_file', 'HEAD', 'a.txt') is signer
+    assert refused(args, 'read_file', 'GET', 'b.txt') == 'Unauthorized'
+    assert refused(args, 'download_file', 'GET', 'a.txt') == 'Unauthorized'
+    assert refused(args, 'delete_file', 'DELETE', 'a.txt') == 'Unauthorized'
+
+
+def test_prefix_scope(signer):
+    args = signed_args(signer, 'download_file', prefix='reports/')
+    assert verify(args, 'download_file', 'GET', 'reports/2024.pdf') is signer
+    assert refused(args, 'download_file', 'GET', 'other/2024.pdf') == 'Unauthorized'
+    # NOTE: The prefix is signed, so it cannot be widened
+    assert refused({**args, 'prefix': ''}, 'download_file', 'GET', 'other/2024.pdf') == 'Unauthorized'
+
+
+def test_method_scope(signer):
+    args = signed_args(signer, 'read_file', filename='a.txt', method='HEAD')
+    assert verify(args, 'read_file', 'HEAD', 'a.txt') is signer
+    assert refused(args, 'read_file', 'GET', 'a.txt') == 'Unauthorized'
+    assert refused({key: value for key, value in args.items() if key != 'method'}, 'read_file', 'GET', 'a.txt') \
+        == 'Unauthorized'
+
+
+def test_tampered_and_revoked(signer, monkeypatch):
+    args = signed_args(signer, 'read_file', filename='a.txt')
+    assert refused({**args, 'expires': str(int(args['expires']) + 3600)}, 'read_file', 'GET', 'a.txt') \
+        == 'Unauthorized'
+    assert refused({**args, 'signature': args['signature'][:-2] + 'AA'}, 'read_file', 'GET', 'a.txt') \
+        == 'Unauthorized'
+    # NOTE: The URLs stop working with the API key that signed them
+    monkeypatch.setattr(Config, 'FILE_MANAGER_API_KEYS', {'another-key': {'name': 'signer'}})
+    assert refused(args, 'read_file', 'GET', 'a.txt') == 'Unauthorized'
+
+
+def test_expiry(signer, monkeypatch):
+    args = signed_args(signer, 'read_file', filename='a.txt', expires_in=60)
+    monkeypatch.setattr(signing.time, 'time', lambda: int(args['expires']) + 1)
+    assert refused(args, 'read_file', 'GET', 'a.txt') == 'Signed URL expired'
+    # NOTE: A forged URL is never told that it expired
+    assert refused({**args, 'signature': 'forged'}, 'read_file', 'GET', 'a.txt') == 'Unauthorized'
+
+
+def test_presigned_url(client, signer):
+    client.post('/storage/v1/file', headers={Config.FILE_MANAGER_API_KEY_HEADER: API_KEY},
+                data={'files[]': (io.BytesIO(b'content'), 'a.txt')})
+    response = client.post('/storage/v1/files/presign', headers={Config.FILE_MANAGER_API_KEY_HEADER: API_KEY},
+                           json={'filename': 'a.txt', 'expires_in': 60})
+    assert response.status_code == 200
+    assert client.get(response.json['url']).data == b'content'
+    assert client.get(response.json['url'].replace('a.txt', 'b.txt')).status_code == 403
+
+
+@pytest.mark.parametrize('body', [
+    {'filename': ['a.txt'], 'prefix': 'a'},
+    {'filename': 'a.txt', 'prefix': 1},
+    {'prefix': {'a': 1}},
+    {'filename': 'a.txt', 'expires_in': True},
+    {'filename': 'a.txt', 'expires_in': 1.5},
+    {'filename': 'a.txt', 'prefix': 'b'},
+    {},
+])
+def test_invalid_presign_request(client, signer, body):
+    response = client.post(
+        '/storage/v1/files/presign', headers={Config.FILE_MANAGER_API_KEY_HEADER: API_KEY}, json=body)
+    assert response.status_code == 400
@@ -0,0 +1,108 @@
+# test_storage.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the storage drivers ('s3' against a stand-in of the object
+#    store, so it needs the 'boto3' and 'moto' packages)
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import hashlib
+# Installed
+import pytest
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+# Custom
+from app.config.settings import Config
+from app.utils.storage import QUARANTINE_DIRNAME, S3Driver, storage
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+BUCKET = 'file-manager'
+CONTENT = bytes(range(256)) * 1024
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def s3(monkeypatch):
+    """Returns a client of an in-memory S3 stand-in with an empty bucket"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def driver(s3):
+    return S3Driver(BUCKET, 'blobs/', region='us-east-1')
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_s3_put_get_stat(driver, s3, tmp_path):
+    location = tmp_path / 'blob'
+    location.write_bytes(CONTENT)
+    driver.put('ab/cd/abcd', str(location))
+    assert s3.head_object(Bucket=BUCKET, Key='blobs/ab/cd/abcd')['ContentLength'] == len(CONTENT)
+    assert driver.stat('ab/cd/abcd') == len(CONTENT)
+    assert driver.get('ab/cd/abcd').read() == CONTENT
+    assert driver.stat('ab/cd/missing') is None
+    with pytest.raises(FileNotFoundError):
+        driver.get('ab/cd/missing')
+
+
+def test_s3_stream_ranges(driver, tmp_path):
+    location = tmp_path / 'blob'
+    location.write_bytes(CONTENT)
+    driver.put('ab/cd/abcd', str(location))
+    assert b''.join(driver.stream('ab/cd/abcd')) == CONTENT
+    assert b''.join(driver.stream('ab/cd/abcd', 100, 200)) == CONTENT[100:200]
+    assert b''.join(driver.stream('ab/cd/abcd', 1000)) == CONTENT[1000:]
+    assert b''.join(driver.stream('ab/cd/abcd', 10, 10)) == b''
+
+
+def test_s3_list_delete_quarantine(driver, s3, tmp_path):
+    location = tmp_path / 'blob'
+    for key in ('ab/cd/one', 'ab/ef/two', 'cd/ef/three'):
+        location.write_bytes(key.encode())
+        driver.put(key, str(location))
+    assert sorted(driver.list('ab/')) == [('ab/cd/one', 9), ('ab/ef/two', 9)]
+    driver.quarantine('ab/cd/one')
+    assert driver.stat('ab/cd/one') is None
+    assert s3.head_object(Bucket=BUCKET, Key='blobs/{}/ab/cd/one'.format(QUARANTINE_DIRNAME))
+    # NOTE: The quarantined blobs are not listed
+    assert sorted(key for key, _ in driver.list()) == ['ab/ef/two', 'cd/ef/three']
+    driver.delete('ab/ef/two')
+    assert sorted(key for key, _ in driver.list()) == ['cd/ef/three']
+
+
+def test_s3_app_round_trip(client, s3, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_STORAGE_DRIVER', 's3')
+    monkeypatch.setattr(Config, 'FILE_MANAGER_S3_BUCKET', BUCKET)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_S3_PREFIX', '')
+    monkeypatch.setattr(Config, 'FILE_MANAGER_S3_REGION', 'us-east-1')
+    response = client.post('/storage/v1/file', data={'files[]': (io.BytesIO(CONTENT), 'a.bin')})
+    assert response.status_code == 200
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    assert [key for key, _ in storage().list()] == ['{}/{}/{}'.format(digest[:2], digest[2:4], digest)]
+    assert client.get('/storage/v1/file/a.bin').data == CONTENT
+    response = client.get('/storage/v1/file/a.bin', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206 and response.data == CONTENT[10:20]
+    assert client.delete('/storage/v1/file/a.bin').status_code == 200
+    assert list(storage().list()) == []
@@ -0,0 +1,119 @@
+# test_store.py ------------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the storing of the uploaded files
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+import os
+import gzip
+import hashlib
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.responses import MyException
+from app.utils import index
+from app.utils.general import BlobWriter, blob_key, ingest_file
+from app.utils.storage import storage
+
+
+# ==================================================================================================
+# Constants
+# ==================================================================================================
+#
+CONTENT = b'line of text\n' * 10000
+
+
+# ==================================================================================================
+# Classes
+# ==================================================================================================
+#
+class ReadOnce(io.RawIOBase):
+    """An upload that fails when it is read twice (e.g. seeked back to be hashed and then written)"""
+
+    def __init__(self, content, filename='a.txt'):
+        self.content = io.BytesIO(content)
+        self.filename = filename
+        self.reads = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        self.reads += 1
+        return self.content.read(size)
+
+    def seek(self, offset, whence=0):
+        raise AssertionError('The upload was seeked')
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def store(client, filename, content):
+    """This function stores (or overwrites) a file under its own name"""
+    response = client.post('/storage/v1/file', data={'files[]': (io.BytesIO(content), filename)})
+    assert response.status_code == 200
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_upload_is_read_once(files_dir):
+    upload = ReadOnce(CONTENT)
+    digest, size, tmp_location, encoding = ingest_file(upload)
+    assert (digest, size, encoding) == (hashlib.sha256(CONTENT).hexdigest(), len(CONTENT), None)
+    # NOTE: One read per chunk and the last (empty) one
+    assert upload.reads == -(-len(CONTENT) // Config.FILE_MANAGER_CHUNK_SIZE) + 1
+    with open(tmp_location, 'rb') as file:
+        assert file.read() == CONTENT
+
+
+def test_compressed_while_written(files_dir, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COMPRESSION', 'gzip')
+    digest, size, tmp_location, encoding = ingest_file(ReadOnce(CONTENT))
+    # NOTE: The hash and the size are those of the content, not of the stored bytes
+    assert (digest, size, encoding) == (hashlib.sha256(CONTENT).hexdigest(), len(CONTENT), 'gzip')
+    assert os.path.getsize(tmp_location) < len(CONTENT)
+    with gzip.open(tmp_location) as file:
+        assert file.read() == CONTENT
+
+
+def test_too_large_upload_is_refused_as_it_arrives(files_dir):
+    writer = BlobWriter('a.txt', max_size=10)
+    writer.write(b'0123456789')
+    with pytest.raises(MyException) as error:
+        writer.write(b'a')
+    assert error.value.code == 413
+    writer.abort()
+    assert os.listdir(files_dir) == []
+
+
+def test_same_content_is_stored_once(client, files_dir):
+    store(client, 'a.txt', CONTENT)
+    store(client, 'b.txt', CONTENT)
+    key = blob_key(hashlib.sha256(CONTENT).hexdigest())
+    assert index.lookup('a.txt')['hash'] == index.lookup('b.txt')['hash']
+    # NOTE: Both filenames are links to the same blob
+    assert os.stat(files_dir / 'a.txt').st_ino == os.stat(files_dir / 'b.txt').st_ino
+    assert client.delete('/storage/v1/file/a.txt').status_code == 200
+    assert storage().stat(key) == len(CONTENT)
+    assert client.get('/storage/v1/file/b.txt').data == CONTENT
+    assert client.delete('/storage/v1/file/b.txt').status_code == 200
+    assert storage().stat(key) is None
+
+
+def test_overwritten_content_is_released(client):
+    store(client, 'a.txt', CONTENT)
+    store(client, 'a.txt', b'new content')
+    assert storage().stat(blob_key(hashlib.sha256(CONTENT).hexdigest())) is None
+    assert client.get('/storage/v1/file/a.txt').data == b'new content'
@@ -0,0 +1,104 @@
+# test_tiering.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the hot/cold storage tiers and their mover
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import io
+# Installed
+import pytest
+# Custom
+from app.config.settings import Config
+from app.utils import index
+from app.utils.general import blob_key
+from app.utils.serving import open_blob
+from app.utils.storage import storage
+from app.utils.tiering import demote_blob, move_blobs
+
+
+# ==================================================================================================
+# Fixtures
+# ==================================================================================================
+#
+@pytest.fixture
+def cold_dir(tmp_path, monkeypatch):
+    """Adds a cold tier, to which the files not read since they were stored are moved"""
+    directory = tmp_path / 'cold'
+    directory.mkdir()
+    monkeypatch.setattr(Config, 'FILE_MANAGER_COLD_DIR', str(directory))
+    monkeypatch.setattr(Config, 'FILE_MANAGER_TIER_COLD_AFTER', 0)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_TIER_SAMPLE_RATE', 1)
+    monkeypatch.setattr(Config, 'FILE_MANAGER_TIER_PROMOTE_READS', 2)
+    return directory
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def stored_key(client, content, filename='a.txt'):
+    """This function stores a file and returns the key of its blob"""
+    client.post('/storage/v1/file', data={'files[]': (io.BytesIO(content), filename)})
+    return blob_key(index.lookup(filename)['hash'])
+
+
+def stale_once(monkeypatch, driver, name, value):
+    """This function makes the first call of a method of a driver return a value looked up earlier"""
+    method, calls = getattr(driver, name), []
+
+    def stale(key):
+        calls.append(key)
+        return value if len(calls) == 1 else method(key)
+
+    monkeypatch.setattr(driver, name, stale)
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_demote_and_promote(client, files_dir, cold_dir, monkeypatch):
+    key = stored_key(client, b'content')
+    assert move_blobs() == (1, 0)
+    assert index.is_cold(key)
+    # NOTE: A cold blob has no filename on disk, yet it is served
+    assert not (files_dir / 'a.txt').exists()
+    assert (cold_dir / '.blobs').is_dir()
+    for _ in range(2):
+        assert client.get('/storage/v1/file/a.txt').data == b'content'
+    monkeypatch.setattr(Config, 'FILE_MANAGER_TIER_COLD_AFTER', 3600)
+    assert move_blobs() == (0, 1)
+    assert not index.is_cold(key)
+    assert (files_dir / 'a.txt').read_bytes() == b'content'
+    assert client.get('/storage/v1/file/a.txt').data == b'content'
+
+
+def test_deleted_cold_file(client, cold_dir):
+    key = stored_key(client, b'content')
+    move_blobs()
+    assert client.delete('/storage/v1/file/a.txt').status_code == 200
+    assert storage().stat(key) is None
+    assert not index.is_cold(key)
+
+
+def test_read_resolved_before_the_demotion(client, cold_dir, monkeypatch):
+    key = stored_key(client, b'content' * 1000)
+    driver = storage()
+    # NOTE: The path of the hot blob was looked up by a request before the mover unlinked it
+    hot_location = driver.path(key)
+    assert demote_blob(driver, index.lookup('a.txt')['hash'], None)
+    stale_once(monkeypatch, driver, 'path', hot_location)
+    with open_blob(driver, key) as file:
+        assert file.read() == b'content' * 1000
+    stale_once(monkeypatch, driver, 'path', hot_location)
+    response = client.get('/storage/v1/file/a.txt', headers={'Range': 'bytes=7-13'})
+    assert response.status_code == 206
+    assert response.data == b'content'
+    stale_once(monkeypatch, driver, 'tier', driver.hot)
+    assert b''.join(driver.stream(key, 0, 7)) == b'content'
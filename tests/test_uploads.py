@@ -0,0 +1,136 @@
+# test_uploads.py ----------------------------------------------------------------------------------
+#
+# Description:
+#    This script contains the tests of the resumable (chunked) uploads
+#
+# --------------------------------------------------------------------------------------------------
+
+
+# ==================================================================================================
+# Imports
+# ==================================================================================================
+# Build-in
+import os
+import hashlib
+# Installed
+# NOTE: Add here the Installed modules
+# Custom
+from app.config.settings import Config
+from app.utils import index, journal, uploads
+
+
+# ==================================================================================================
+# Functions
+# ==================================================================================================
+#
+def complete_upload(client, content, filename='a.txt'):
+    """This function creates an upload and sends all its content in one chunk, returns its id"""
+    response = client.post('/storage/v1/uploads', json={'filename': filename, 'size': len(content)})
+    upload_id = response.json['id']
+    client.patch(
+        '/storage/v1/uploads/{}'.format(upload_id), data=content,
+        headers={'Content-Range': 'bytes 0-{}/*'.format(len(content) - 1)})
+    return upload_id
+
+
+def finalize(client, upload_id, content):
+    """This function finalizes an upload with the SHA-256 of its content, returns the response"""
+    return client.post(
+        '/storage/v1/uploads/{}/finalize'.format(upload_id), json={'sha256': hashlib.sha256(content).hexdigest()})
+
+
+def set_finalizer(upload_id, pid, started):
+    """This function marks an upload as being finalized by a process"""
+    with index.transaction() as db:
+        db.execute(
+            'UPDATE uploads SET finalizer = ?, finalizer_started = ? WHERE id = ?', (pid, started, upload_id))
+
+
+# ==================================================================================================
+# Tests
+# ==================================================================================================
+#
+def test_upload_in_chunks(client):
+    content = b'0123456789' * 10
+    response = client.post('/storage/v1/uploads', json={'filename': 'a.txt', 'size': len(content)})
+    assert response.status_code == 201
+    upload_id = response.json['id']
+    for start in (50, 0):
+        response = client.patch(
+            '/storage/v1/uploads/{}'.format(upload_id), data=content[start:start + 50],
+            headers={'Content-Range': 'bytes {}-{}/*'.format(start, start + 49)})
+        assert response.status_code == 200
+    response = client.post(
+        '/storage/v1/uploads/{}/finalize'.format(upload_id), json={'sha256': hashlib.sha256(content).hexdigest()})
+    assert response.status_code == 200
+    assert client.get('/storage/v1/file/a.txt').data == content
+
+
+def test_upload_above_the_max_file_size(client, monkeypatch):
+    monkeypatch.setattr(Config, 'FILE_MANAGER_MAX_FILE_SIZE', 100)
+    response = client.post('/storage/v1/uploads', json={'filename': 'a.txt', 'size': 10 ** 12})
+    assert response.status_code == 413
+    response = client.post('/storage/v1/uploads', json={'filename': 'a.txt', 'size': 100})
+    assert response.status_code == 201
+    upload_id = response.json['id']
+    # NOTE: The limit is checked again by each chunk, since it may be lowered meanwhile
+    monkeypatch.setattr(Config, 'FILE_MANAGER_MAX_FILE_SIZE', 50)
+    response = client.patch(
+        '/storage/v1/uploads/{}'.format(upload_id), data=b'x' * 50, headers={'Content-Range': 'bytes 50-99/*'})
+    assert response.status_code == 413
+
+
+def test_failed_finalization_keeps_the_upload(client, monkeypatch):
+    content = b'content'
+    upload_id = complete_upload(client, content)
+    commit_file = uploads.commit_file
+
+    def failing_commit_file(*args, **kwargs):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(uploads, 'commit_file', failing_commit_file)
+    assert finalize(client, upload_id, content).status_code == 500
+    # NOTE: The upload and its data are kept, and it is no longer being finalized
+    assert client.get('/storage/v1/uploads/{}'.format(upload_id)).json['complete']
+    assert os.path.exists(uploads.upload_path(upload_id))
+    monkeypatch.setattr(uploads, 'commit_file', commit_file)
+    assert finalize(client, upload_id, content).status_code == 200
+    assert client.get('/storage/v1/file/a.txt').data == content
+    assert client.get('/storage/v1/uploads/{}'.format(upload_id)).status_code == 404
+    assert not os.path.exists(uploads.upload_path(upload_id))
+
+
+def test_finalization_retries_a_released_blob(client, monkeypatch):
+    content = b'content'
+    upload_id = complete_upload(client, content)
+    commit_file, calls = uploads.commit_file, []
+
+    def racing_commit_file(*args, **kwargs):
+        # NOTE: The blob is released by a concurrent request once, after it was committed
+        calls.append(args)
+        if len(calls) == 1:
+            raise FileNotFoundError(args[0])
+        return commit_file(*args, **kwargs)
+
+    monkeypatch.setattr(uploads, 'commit_file', racing_commit_file)
+    assert finalize(client, upload_id, content).status_code == 200
+    assert len(calls) == 2
+    assert client.get('/storage/v1/file/a.txt').data == content
+
+
+def test_upload_being_finalized(client):
+    content = b'content'
+    upload_id = complete_upload(client, content)
+    set_finalizer(upload_id, os.getpid(), journal.current_started())
+    assert finalize(client, upload_id, content).status_code == 409
+    response = client.patch(
+        '/storage/v1/uploads/{}'.format(upload_id), data=b'c', headers={'Content-Range': 'bytes 0-0/*'})
+    assert response.status_code == 409
+    assert client.delete('/storage/v1/uploads/{}'.format(upload_id)).status_code == 409
+    # NOTE: The finalization of a process that died is taken over
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    set_finalizer(upload_id, pid, None)
+    assert finalize(client, upload_id, content).status_code == 200